@@ -0,0 +1,108 @@
+"""Write throughput of create_note under each engine profile.
+
+Every profile runs in its own process, because src.db builds its engine from the
+environment at import time. Each process migrates a fresh database, creates --users users,
+then commits --notes notes from --concurrency concurrent writers, one transaction per
+note as a handler would.
+
+    python -m bench.db_write --notes 5000 --concurrency 32
+    python -m bench.db_write --database-url postgresql+asyncpg://... --profiles postgres
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+# Environment overrides per profile; anything not listed comes from src.config's defaults
+PROFILES = {
+    # SQLite as the engine was created before tuning: SQLAlchemy's 5 + 10 pool, rollback
+    # journal, fsync on every commit, no mmap, pysqlite's own 5 s lock timeout
+    "sqlite-default": {"SQLITE_POOL_SIZE": "5", "SQLITE_MAX_OVERFLOW": "10",
+                       "SQLITE_JOURNAL_MODE": "DELETE", "SQLITE_SYNCHRONOUS": "FULL",
+                       "SQLITE_BUSY_TIMEOUT": "", "SQLITE_MMAP_SIZE": "0"},
+    "sqlite-tuned": {},
+    "sqlite-batched": {"WRITE_BATCH_WINDOW": "0.002"},
+    "postgres-default": {"DB_POOL_SIZE": "5", "DB_MAX_OVERFLOW": "10", "DB_POOL_PRE_PING": "false",
+                         "DB_POOL_RECYCLE": "-1", "DB_STATEMENT_CACHE_SIZE": "100",
+                         "DB_PREPARE_THRESHOLD": "5"},
+    "postgres": {},
+    "postgres-batched": {"WRITE_BATCH_WINDOW": "0.002"},
+}
+
+def _percentile(samples, q):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0.0
+
+async def _child(args):
+    from sqlalchemy.exc import OperationalError
+    from src.auth import create_user
+    from src.db import engine
+    from src.migrate import migrate_database
+    from src.notes import create_note
+
+    await migrate_database()
+    users = [(await create_user(900_000 + i, f"bench{i}")).id for i in range(args.users)]
+    latencies, errors = [], 0
+    limit = asyncio.Semaphore(args.concurrency)
+
+    async def write(i):
+        nonlocal errors
+        async with limit:
+            started = time.perf_counter()
+            try:
+                await create_note(users[i % len(users)], f"note {i}", "benchmark content " * 8)
+            except OperationalError:
+                errors += 1
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(write(i) for i in range(args.notes)))
+    elapsed = time.perf_counter() - started
+    await engine.dispose()
+    return {
+        "notes": args.notes,
+        "errors": errors,
+        "seconds": elapsed,
+        "notes_per_sec": (args.notes - errors) / elapsed,
+        "p50_ms": _percentile(latencies, 0.50) * 1000,
+        "p99_ms": _percentile(latencies, 0.99) * 1000,
+    }
+
+def _run_profile(name, args):
+    env = dict(os.environ, BOT_TOKEN=os.environ.get("BOT_TOKEN", "123:bench"), **PROFILES[name])
+    if args.database_url:
+        env["DATABASE_URL"] = args.database_url
+    else:
+        env["DATABASE_URL"] = f"sqlite+aiosqlite:///{tempfile.mkdtemp(prefix='tgcrud-bench-')}/bench.db"
+    cmd = [sys.executable, "-m", "bench.db_write", "--child", "--notes", str(args.notes),
+           "--users", str(args.users), "--concurrency", str(args.concurrency)]
+    out = subprocess.run(cmd, env=env, capture_output=True, text=True, check=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description="create_note write throughput per engine profile")
+    parser.add_argument("--notes", type=int, default=2000)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--profiles", default="sqlite-default,sqlite-tuned,sqlite-batched",
+                        help=f"comma-separated, from: {', '.join(PROFILES)}")
+    parser.add_argument("--database-url", help="database to use instead of a fresh SQLite file per profile")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(asyncio.run(_child(args))))
+        return
+
+    print(f"{'profile':<18}{'notes/s':>10}{'p50 ms':>9}{'p99 ms':>9}{'errors':>8}")
+    for name in args.profiles.split(","):
+        result = _run_profile(name, args)
+        print(f"{name:<18}{result['notes_per_sec']:>10.1f}{result['p50_ms']:>9.2f}"
+              f"{result['p99_ms']:>9.2f}{result['errors']:>8}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,329 @@
+"""Offline stand-in for the Telegram Bot API.
+
+FakeTelegram records every Bot API call the application makes and answers with plausible
+results, so the bot can run against it with no network and no token. It also builds
+update payloads and feeds them in either by getUpdates (polling mode) or by POSTing them
+to the local webhook server (webhook mode).
+
+    DATABASE_URL=sqlite+aiosqlite:///harness.db python -m bench.fake_telegram --mode webhook
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import time
+from collections import deque
+from telegram.request import BaseRequest
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "NotePad", "username": "notepad_test_bot",
+            "can_join_groups": False, "can_read_all_group_messages": False,
+            "supports_inline_queries": True}
+
+class FakeBotRequest(BaseRequest):
+    """BaseRequest that answers Bot API calls from a FakeTelegram instead of the network."""
+
+    def __init__(self, telegram):
+        self._telegram = telegram
+
+    async def initialize(self):
+        """Nothing to connect to."""
+
+    async def shutdown(self):
+        """Nothing to disconnect from."""
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None):
+        if "/file/bot" in url:
+            # File downloads; the path is what getFile handed out
+            return self._telegram.download(url.rsplit("/", 1)[-1])
+        api_method = url.rsplit("/", 1)[-1]
+        params = request_data.parameters if request_data is not None else {}
+        if request_data is not None and request_data.contains_files:
+            self._telegram.uploads.append(request_data.multipart_data)
+        status, result = await self._telegram.handle(api_method, params)
+        return status, json.dumps(result).encode()
+
+# Methods that count against Telegram's message flood limits
+CHAT_METHODS = frozenset({"sendMessage", "editMessageText", "editMessageReplyMarkup", "sendDocument"})
+
+class FakeTelegram:
+    """In-memory Bot API: records calls, returns canned results and queues updates.
+
+    With ``global_limit``/``chat_limit`` set it also plays flood control: a chat-bound call
+    beyond that many in the last second (overall, or for its chat) gets a 429 with
+    ``retry_after``, like the real API.
+    """
+
+    def __init__(self, latency: float = 0.0, global_limit: int = None, chat_limit: int = None,
+                 retry_after: int = 1):
+        self.latency = latency
+        self.global_limit = global_limit
+        self.chat_limit = chat_limit
+        self.retry_after = retry_after
+        self.flood_errors = 0
+        self._sent = deque()  # (time, chat id) of accepted chat-bound calls in the last second
+        self._fail_next = 0
+        self.calls = []
+        self.uploads = []  # multipart data of calls that sent files: name -> (filename, bytes, mimetype)
+        self.files = {}  # file_id -> bytes the bot can download
+        self.blocked = set()  # chat ids of users who blocked the bot: sends to them get 403
+        self.deleted = set()  # (chat id, message id) of messages the user deleted: edits of them get 400
+        self._file_ids = itertools.count(1)
+        self.last_message = {}  # chat id -> last message the bot sent or edited there
+        self.webhook_url = None
+        self.confirmed_offset = 0
+        self._pending = []
+        self._new_updates = asyncio.Event()
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1000)
+
+    def request(self):
+        """Return a BaseRequest to pass to ApplicationBuilder.request()."""
+        return FakeBotRequest(self)
+
+    def calls_for(self, api_method):
+        return [params for name, params in self.calls if name == api_method]
+
+    def add_file(self, data: bytes):
+        """Store a file as if a user had uploaded it; returns its file_id."""
+        file_id = f"file{next(self._file_ids)}"
+        self.files[file_id] = data
+        return file_id
+
+    def download(self, file_path):
+        data = self.files.get(file_path)
+        if data is None:
+            return 404, json.dumps({"ok": False, "error_code": 404, "description": "Not Found"}).encode()
+        return 200, data
+
+    def fail_next(self, count: int = 1):
+        """Answer the next ``count`` chat-bound calls with 429 regardless of the limits."""
+        self._fail_next += count
+
+    def _flooded(self, api_method, params):
+        if api_method not in CHAT_METHODS:
+            return False
+        if self._fail_next:
+            self._fail_next -= 1
+            return True
+        if self.global_limit is None and self.chat_limit is None:
+            return False
+        now = time.monotonic()
+        while self._sent and now - self._sent[0][0] >= 1:
+            self._sent.popleft()
+        chat_id = params.get("chat_id")
+        if (self.global_limit is not None and len(self._sent) >= self.global_limit) or (
+                self.chat_limit is not None
+                and sum(1 for _, c in self._sent if c == chat_id) >= self.chat_limit):
+            return True
+        self._sent.append((now, chat_id))
+        return False
+
+    async def handle(self, api_method, params):
+        """Answer one Bot API call with an HTTP status and JSON body."""
+        if api_method == "getUpdates":
+            return 200, {"ok": True, "result": await self._get_updates(params)}
+
+        if self._flooded(api_method, params):
+            self.flood_errors += 1
+            return 429, {"ok": False, "error_code": 429,
+                         "description": f"Too Many Requests: retry after {self.retry_after}",
+                         "parameters": {"retry_after": self.retry_after}}
+        if api_method in CHAT_METHODS and int(params.get("chat_id", 0)) in self.blocked:
+            return 403, {"ok": False, "error_code": 403, "description": "Forbidden: bot was blocked by the user"}
+        if (int(params.get("chat_id", 0)), params.get("message_id")) in self.deleted:
+            return 400, {"ok": False, "error_code": 400, "description": "Bad Request: message to edit not found"}
+        self.calls.append((api_method, params))
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        handler = getattr(self, "_api_" + api_method, None)
+        result = handler(params) if handler else True
+        return 200, {"ok": True, "result": result}
+
+    # Bot API methods
+
+    def _api_getMe(self, params):
+        return BOT_USER
+
+    def _api_setWebhook(self, params):
+        self.webhook_url = params.get("url")
+        return True
+
+    def _api_deleteWebhook(self, params):
+        self.webhook_url = None
+        return True
+
+    def _api_sendMessage(self, params):
+        return self._message(params["chat_id"], params.get("text"), params.get("reply_markup"))
+
+    def _api_editMessageText(self, params):
+        if "inline_message_id" in params:
+            return True
+        return self._message(params["chat_id"], params.get("text"), params.get("reply_markup"),
+                             message_id=params["message_id"])
+
+    def _api_sendDocument(self, params):
+        message = self._message(params["chat_id"], None)
+        message["document"] = {"file_id": "document", "file_unique_id": "document"}
+        return message
+
+    def _api_getFile(self, params):
+        file_id = params["file_id"]
+        return {"file_id": file_id, "file_unique_id": file_id, "file_size": len(self.files.get(file_id, b"")),
+                "file_path": file_id}
+
+    def _message(self, chat_id, text, reply_markup=None, message_id=None):
+        message = {
+            "message_id": message_id or next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": int(chat_id), "type": "private"},
+            "from": BOT_USER,
+        }
+        if text is not None:
+            message["text"] = text
+        if reply_markup:
+            message["reply_markup"] = reply_markup
+        self.last_message[int(chat_id)] = message
+        return message
+
+    async def _get_updates(self, params):
+        offset = params.get("offset", 0)
+        self.confirmed_offset = max(self.confirmed_offset, offset)
+        self._pending = [u for u in self._pending if u["update_id"] >= offset]
+        if not self._pending:
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), min(params.get("timeout", 0), 1) or 0.01)
+            except asyncio.TimeoutError:
+                pass
+        return self._pending[:params.get("limit", 100)]
+
+    # Update builders and delivery
+
+    def _user(self, user_id):
+        return {"id": user_id, "is_bot": False, "first_name": f"User {user_id}",
+                "username": f"user{user_id}"}
+
+    def message_update(self, user_id: int, text: str):
+        """Build a private-chat text message update from ``user_id``."""
+        message = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": self._user(user_id),
+            "text": text,
+        }
+        if text.startswith("/"):
+            command = text.split()[0]
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(command)}]
+        return {"update_id": next(self._update_ids), "message": message}
+
+    def document_update(self, user_id: int, file_id: str, file_name: str = "notes.jsonl.gz"):
+        """Build a private-chat message update carrying a file stored with add_file()."""
+        update = self.message_update(user_id, "")
+        message = update["message"]
+        del message["text"]
+        message["document"] = {"file_id": file_id, "file_unique_id": file_id, "file_name": file_name,
+                               "file_size": len(self.files.get(file_id, b""))}
+        return update
+
+    def callback_update(self, user_id: int, data: str, message_id: int = 1):
+        """Build a callback query update for a button tap on one of the bot's messages."""
+        update_id = next(self._update_ids)
+        return {
+            "update_id": update_id,
+            "callback_query": {
+                "id": str(update_id),
+                "from": self._user(user_id),
+                "chat_instance": str(user_id),
+                "data": data,
+                "message": {
+                    "message_id": message_id,
+                    "date": int(time.time()),
+                    "chat": {"id": user_id, "type": "private"},
+                    "from": BOT_USER,
+                    "text": "",
+                },
+            },
+        }
+
+    def inline_query_update(self, user_id: int, query: str, offset: str = ""):
+        """Build an inline query update, as sent while the user types ``@bot <query>``."""
+        update_id = next(self._update_ids)
+        return {
+            "update_id": update_id,
+            "inline_query": {"id": str(update_id), "from": self._user(user_id), "query": query, "offset": offset},
+        }
+
+    def push_update(self, update):
+        """Queue an update for the next getUpdates call (polling mode)."""
+        self._pending.append(update)
+        self._new_updates.set()
+
+    async def post_webhook(self, update, url=None, secret_token=None):
+        """POST an update to the bot's webhook as Telegram would; returns the HTTP status."""
+        import httpx
+
+        headers = {"X-Telegram-Bot-Api-Secret-Token": secret_token} if secret_token else {}
+        async with httpx.AsyncClient() as client:
+            response = await client.post(url or self.webhook_url, json=update, headers=headers)
+        return response.status_code
+
+async def _run_scenario(mode, users, latency):
+    """Drive the real handlers from several users at once and check per-user ordering."""
+    from src.config import WEBHOOK_SECRET
+    from src.main import build_application, start_ingress
+    from src.migrate import migrate_database
+
+    await migrate_database()
+    telegram = FakeTelegram(latency=latency)
+    app = build_application(request=telegram.request())
+    await app.initialize()
+    await app.start()
+    await start_ingress(app, mode)
+
+    started = time.perf_counter()
+    script = ["/start", "list_notes", "back_to_menu", "settings", "back_to_menu"]
+    updates = []
+    for step in script:
+        for user_id in range(10_000, 10_000 + users):
+            if step.startswith("/"):
+                updates.append(telegram.message_update(user_id, step))
+            else:
+                updates.append(telegram.callback_update(user_id, step))
+    for update in updates:
+        if mode == "webhook":
+            await telegram.post_webhook(update, secret_token=WEBHOOK_SECRET)
+        else:
+            telegram.push_update(update)
+
+    if mode == "polling":
+        # getUpdates confirms everything below its offset once it has been queued
+        while telegram.confirmed_offset <= updates[-1]["update_id"]:
+            await asyncio.sleep(0.01)
+    await app.update_queue.join()
+    elapsed = time.perf_counter() - started
+
+    # Each user's callbacks must have been answered in the order they were sent
+    answered = {}
+    for params in telegram.calls_for("answerCallbackQuery"):
+        update_id = int(params["callback_query_id"])
+        user_id = next(u["callback_query"]["from"]["id"] for u in updates if u["update_id"] == update_id)
+        answered.setdefault(user_id, []).append(update_id)
+    out_of_order = [user_id for user_id, ids in answered.items() if ids != sorted(ids)]
+
+    await app.updater.stop()
+    await app.stop()
+    await app.shutdown()
+    print(f"{mode}: {len(updates)} updates from {users} users handled in {elapsed:.2f}s, "
+          f"{len(telegram.calls)} Bot API calls recorded")
+    print(f"per-user ordering: {'OK' if not out_of_order else f'VIOLATED for {out_of_order}'}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the bot against a fake Telegram Bot API")
+    parser.add_argument("--mode", choices=["polling", "webhook"], default="webhook")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.02,
+                        help="simulated Bot API round-trip time in seconds")
+    args = parser.parse_args()
+    asyncio.run(_run_scenario(args.mode, args.users, args.latency))
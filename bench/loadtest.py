@@ -0,0 +1,246 @@
+"""Offline load test: replay a mix of user actions through the real handlers.
+
+Every simulated user sends /start and then a random sequence of actions drawn from
+--mix. Updates go through the application built by src.main (handlers, per-update
+sessions, router) against bench.fake_telegram's Bot API and a temporary SQLite database,
+so nothing leaves the machine.
+
+    python -m bench.loadtest --users 2000 --actions 10 --concurrency 64
+    python -m bench.loadtest --compare bench/results/<earlier run>.json
+
+Results are printed and saved as JSON (--out) so runs can be compared across commits.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import subprocess
+import tempfile
+import time
+from collections import defaultdict
+from contextvars import ContextVar
+
+DEFAULT_MIX = "create=3,list=4,view=3,pattern=2,start=1"
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+def _parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        mix[name.strip()] = float(weight or 1)
+    unknown = set(mix) - set(ACTIONS)
+    if unknown:
+        raise SystemExit(f"Unknown actions in --mix: {', '.join(sorted(unknown))}")
+    return mix
+
+def _percentile(samples, q):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+# Each action returns the list of update payloads one user action produces
+
+def _start(sim, user_id):
+    return [sim.telegram.message_update(user_id, "/start")]
+
+def _create(sim, user_id):
+    n = sim.rng.randrange(1_000_000)
+    body = " ".join(sim.rng.choice(sim.words) for _ in range(sim.rng.randint(5, 60)))
+    return [
+        sim.telegram.callback_update(user_id, sim.router.encode("new_note")),
+        # The note parser splits on the lower-case markers
+        sim.telegram.message_update(user_id, f"title: note {n}\ncontent: {body}"),
+    ]
+
+def _list(sim, user_id):
+    return [sim.telegram.callback_update(user_id, sim.router.encode("list_notes"))]
+
+def _view(sim, user_id):
+    # Open a note from the last listing the bot showed this user, if any
+    markup = sim.telegram.last_message.get(user_id, {}).get("reply_markup") or {}
+    buttons = [b for row in markup.get("inline_keyboard", []) for b in row
+               if b.get("text", "").startswith("📖")]
+    if not buttons:
+        return _list(sim, user_id)
+    return [sim.telegram.callback_update(user_id, sim.rng.choice(buttons)["callback_data"])]
+
+def _pattern(sim, user_id):
+    # Tap four digits and save them: the setup screen's first time, Settings' change form
+    # after that. Either way one bcrypt hash and a user write.
+    digits = sim.rng.sample(range(1, 10), 4)
+    if user_id not in sim.patterned:
+        sim.patterned.add(user_id)
+        return [sim.telegram.callback_update(user_id, sim.router.encode("pattern", d)) for d in digits] + [
+            sim.telegram.callback_update(user_id, sim.router.encode("set_pattern"))]
+    return [sim.telegram.callback_update(user_id, sim.router.encode("change_pattern"))] + [
+        sim.telegram.callback_update(user_id, sim.router.encode("new_pattern", d)) for d in digits] + [
+        sim.telegram.callback_update(user_id, sim.router.encode("set_new_pattern"))]
+
+ACTIONS = {"start": _start, "create": _create, "list": _list, "view": _view, "pattern": _pattern}
+
+# Per-update statement counter, bumped by an engine event listener. The handler runs in
+# the task that calls process_update, so the count belongs to exactly one update.
+_queries = ContextVar("queries", default=None)
+
+def _count_query(*_):
+    counter = _queries.get()
+    if counter is not None:
+        counter[0] += 1
+
+class Simulation:
+    def __init__(self, app, telegram, router, mix, seed):
+        self.app = app
+        self.telegram = telegram
+        self.router = router
+        self.rng = random.Random(seed)
+        self.names = list(mix)
+        self.weights = [mix[name] for name in self.names]
+        self.words = ["milk", "meeting", "idea", "todo", "call", "book", "trip", "code", "fix", "plan"]
+        self.patterned = set()  # users whose pattern is set
+        self.latencies = defaultdict(list)
+        self.queries = defaultdict(int)
+        self.errors = 0
+
+    async def run_user(self, user_id, actions):
+        from telegram import Update
+        from src.metrics import HANDLER_ERRORS
+
+        plan = ["start"] + self.rng.choices(self.names, self.weights, k=actions)
+        for name in plan:
+            for payload in ACTIONS[name](self, user_id):
+                update = Update.de_json(payload, self.app.bot)
+                errors_before = HANDLER_ERRORS.total()
+                counter = [0]
+                token = _queries.set(counter)
+                started = time.perf_counter()
+                try:
+                    await self.app.process_update(update)
+                finally:
+                    self.latencies[name].append(time.perf_counter() - started)
+                    _queries.reset(token)
+                self.queries[name] += counter[0]
+                self.errors += HANDLER_ERRORS.total() - errors_before
+
+async def run(args):
+    from sqlalchemy import event
+    from src.config import PATTERN_BCRYPT_ROUNDS
+    from src.db import engine
+    from bench.fake_telegram import FakeTelegram
+    from src.handlers import router
+    from src.main import build_application
+    from src.migrate import migrate_database
+
+    await migrate_database()
+    telegram = FakeTelegram(latency=args.api_latency)
+    app = build_application(request=telegram.request())
+    await app.initialize()
+    sim = Simulation(app, telegram, router, _parse_mix(args.mix), args.seed)
+
+    event.listen(engine.sync_engine, "after_cursor_execute", _count_query)
+
+    limit = asyncio.Semaphore(args.concurrency)
+
+    async def one_user(user_id):
+        async with limit:
+            await sim.run_user(user_id, args.actions)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one_user(100_000 + i) for i in range(args.users)))
+    elapsed = time.perf_counter() - started
+    await app.shutdown()
+
+    updates = sum(len(samples) for samples in sim.latencies.values())
+    all_samples = [s for samples in sim.latencies.values() for s in samples]
+    report = {
+        "commit": _git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {"users": args.users, "actions": args.actions, "concurrency": args.concurrency,
+                   "mix": args.mix, "api_latency": args.api_latency, "seed": args.seed,
+                   "bcrypt_rounds": PATTERN_BCRYPT_ROUNDS},
+        "updates": updates,
+        "errors": sim.errors,
+        "seconds": elapsed,
+        "updates_per_sec": updates / elapsed,
+        "p50_ms": _percentile(all_samples, 0.50) * 1000,
+        "p99_ms": _percentile(all_samples, 0.99) * 1000,
+        "queries_per_update": sum(sim.queries.values()) / updates,
+        "api_calls_per_update": len(telegram.calls) / updates,
+        "actions": {
+            name: {
+                "updates": len(samples),
+                "mean_ms": statistics.fmean(samples) * 1000,
+                "p50_ms": _percentile(samples, 0.50) * 1000,
+                "p99_ms": _percentile(samples, 0.99) * 1000,
+                "queries_per_update": sim.queries[name] / len(samples),
+            }
+            for name, samples in sorted(sim.latencies.items())
+        },
+    }
+    return report
+
+def print_report(report, baseline=None):
+    def delta(key, source=None, base=None):
+        if not base or key not in base:
+            return ""
+        old, new = base[key], source[key]
+        return f"  ({(new - old) / old * 100:+.1f}%)" if old else ""
+
+    print(f"commit {report['commit']}: {report['updates']} updates in {report['seconds']:.2f}s, "
+          f"{report['errors']} handler errors")
+    for key, unit in [("updates_per_sec", "/s"), ("p50_ms", " ms"), ("p99_ms", " ms"),
+                      ("queries_per_update", ""), ("api_calls_per_update", "")]:
+        print(f"  {key:<22}{report[key]:>10.2f}{unit}{delta(key, report, baseline)}")
+    print(f"  {'action':<10}{'updates':>9}{'mean ms':>10}{'p50 ms':>9}{'p99 ms':>9}{'queries':>9}")
+    for name, stats in report["actions"].items():
+        print(f"  {name:<10}{stats['updates']:>9}{stats['mean_ms']:>10.2f}{stats['p50_ms']:>9.2f}"
+              f"{stats['p99_ms']:>9.2f}{stats['queries_per_update']:>9.2f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline load test driving the real handlers")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--actions", type=int, default=10, help="actions per user after /start")
+    parser.add_argument("--concurrency", type=int, default=64, help="users active at once")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"action weights (default {DEFAULT_MIX})")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="fake Bot API delay in seconds")
+    parser.add_argument("--bcrypt-rounds", type=int, help="pattern hash cost (default PATTERN_BCRYPT_ROUNDS)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--database-url", help="database to use instead of a temporary SQLite file")
+    parser.add_argument("--out", help="where to save the JSON results (default bench/results/)")
+    parser.add_argument("--compare", help="earlier JSON results to compare against")
+    args = parser.parse_args()
+
+    # Must be decided before src.config is imported
+    workdir = tempfile.mkdtemp(prefix="tgcrud-bench-")
+    os.environ["DATABASE_URL"] = args.database_url or f"sqlite+aiosqlite:///{workdir}/bench.db"
+    os.environ.setdefault("BOT_TOKEN", "123:bench")
+    os.environ.setdefault("METRICS_PORT", "0")
+    # Measures the handlers; outbound rate limiting is exercised by bench.ratelimit
+    os.environ.setdefault("RATE_LIMIT_GLOBAL", "0")
+    if args.bcrypt_rounds is not None:
+        os.environ["PATTERN_BCRYPT_ROUNDS"] = str(args.bcrypt_rounds)
+
+    report = asyncio.run(run(args))
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+
+    out = args.out or os.path.join(RESULTS_DIR, f"loadtest-{report['commit']}-{int(time.time())}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"results saved to {out}")
+
+if __name__ == "__main__":
+    main()
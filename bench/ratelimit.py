@@ -0,0 +1,100 @@
+"""Exercise the outbound rate limiter against the fake Bot API's flood control.
+
+Each simulated user sends /start and then taps all nine pattern digits as fast as the
+bot handles them, which edits the same message once per tap. The fake Bot API answers
+429 once a chat or the bot exceeds its per-second limits. Every profile runs in its own
+process, because src.main reads the limiter settings from the environment at import time.
+
+    python -m bench.ratelimit --users 40
+
+The run checks that every user ends up seeing their full pattern, i.e. that coalescing
+never drops the latest edit, and reports 429s, edits actually sent and drain time.
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+PROFILES = {
+    "unlimited": {"RATE_LIMIT_GLOBAL": "0"},
+    "limited": {},
+}
+
+async def _child(args):
+    from telegram import Update
+    from bench.fake_telegram import FakeTelegram
+    from src.handlers import router
+    from src.main import build_application
+    from src.metrics import HANDLER_ERRORS
+    from src.migrate import migrate_database
+
+    await migrate_database()
+    telegram = FakeTelegram(latency=args.latency, global_limit=args.global_limit,
+                            chat_limit=args.chat_limit)
+    app = build_application(request=telegram.request())
+    await app.initialize()
+
+    async def user(user_id):
+        await app.process_update(Update.de_json(telegram.message_update(user_id, "/start"), app.bot))
+        for digit in range(1, 10):
+            payload = telegram.callback_update(user_id, router.encode("pattern", digit))
+            await app.process_update(Update.de_json(payload, app.bot))
+
+    users = range(300_000, 300_000 + args.users)
+    started = time.perf_counter()
+    await asyncio.gather(*(user(user_id) for user_id in users))
+    handled = time.perf_counter() - started
+    if app.bot.rate_limiter is not None:
+        await app.bot.rate_limiter.drain()
+    drained = time.perf_counter() - started
+    await app.shutdown()
+
+    complete = sum(1 for user_id in users
+                   if telegram.last_message.get(user_id, {}).get("text", "").endswith("123456789"))
+    return {
+        "taps": args.users * 9,
+        "handled_seconds": handled,
+        "drained_seconds": drained,
+        "edits_sent": len(telegram.calls_for("editMessageText")),
+        "flood_errors": telegram.flood_errors,
+        "handler_errors": HANDLER_ERRORS.total(),
+        "users_with_full_pattern": complete,
+    }
+
+def _run_profile(name, args):
+    env = dict(os.environ, BOT_TOKEN=os.environ.get("BOT_TOKEN", "123:bench"), METRICS_PORT="0",
+               DATABASE_URL=f"sqlite+aiosqlite:///{tempfile.mkdtemp(prefix='tgcrud-bench-')}/bench.db",
+               LOG_LEVEL="CRITICAL", **PROFILES[name])
+    cmd = [sys.executable, "-m", "bench.ratelimit", "--child", "--users", str(args.users),
+           "--latency", str(args.latency), "--global-limit", str(args.global_limit),
+           "--chat-limit", str(args.chat_limit)]
+    out = subprocess.run(cmd, env=env, capture_output=True, text=True, check=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description="Outbound rate limiting against fake flood control")
+    parser.add_argument("--users", type=int, default=40)
+    parser.add_argument("--latency", type=float, default=0.02, help="fake Bot API delay in seconds")
+    parser.add_argument("--global-limit", type=int, default=30, help="fake flood control: calls/s overall")
+    parser.add_argument("--chat-limit", type=int, default=4, help="fake flood control: calls/s per chat")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(asyncio.run(_child(args))))
+        return
+
+    print(f"{'profile':<11}{'taps':>6}{'handled s':>11}{'drained s':>11}{'edits':>7}"
+          f"{'429s':>6}{'errors':>8}{'full pattern':>14}")
+    for name in PROFILES:
+        r = _run_profile(name, args)
+        print(f"{name:<11}{r['taps']:>6}{r['handled_seconds']:>11.2f}{r['drained_seconds']:>11.2f}"
+              f"{r['edits_sent']:>7}{r['flood_errors']:>6}{r['handler_errors']:>8}"
+              f"{r['users_with_full_pattern']:>9}/{args.users}")
+
+if __name__ == "__main__":
+    main()
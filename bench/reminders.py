@@ -0,0 +1,94 @@
+"""Reminder scheduler (src.reminders) over a large backlog, driven by a simulated clock.
+
+Seeds reminders spread over the next day, then advances a fake clock a step at a time
+and lets the scheduler send whatever comes due, restarting it (a fresh scheduler, as
+after a crash) partway through. Checks every reminder was sent exactly once, and reports
+the most reminders ever held in memory and how long the run took.
+
+    python -m bench.reminders --reminders 200000 --step 60 --restart-at 0.5
+"""
+import argparse
+import asyncio
+import collections
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+async def _seed(reminders, users, start):
+    from sqlalchemy import insert
+    from src.db import session_scope
+    from src.migrate import migrate_database
+    from src.models import User, Note, Reminder, note_body
+
+    await migrate_database()
+    async with session_scope() as session:
+        await session.execute(insert(User), [{"telegram_id": str(600_000 + i)} for i in range(users)])
+        await session.execute(insert(Note), [{"user_id": i + 1, "title": f"Note {i}", **note_body("Some text")}
+                                             for i in range(users)])
+    rows = []
+    for n in range(reminders):
+        user = random.randrange(users)
+        rows.append({"note_id": user + 1, "user_id": user + 1, "chat_id": 600_000 + user,
+                     "due_at": start + timedelta(seconds=random.uniform(0, 86400))})
+        if len(rows) == 10_000 or n == reminders - 1:
+            async with session_scope() as session:
+                await session.execute(insert(Reminder), rows)
+            rows = []
+
+async def _main(args):
+    from telegram import Bot
+    from bench.fake_telegram import FakeTelegram
+    from src.reminders import ReminderScheduler
+
+    start = datetime.now(timezone.utc).replace(microsecond=0)
+    began = time.perf_counter()
+    await _seed(args.reminders, args.users, start)
+    print(f"seeded {args.reminders} reminders for {args.users} users in {time.perf_counter() - began:.1f}s")
+
+    telegram = FakeTelegram()
+    bot = Bot("123:bench", request=telegram.request())
+    await bot.initialize()
+    now = start
+    scheduler = ReminderScheduler(bot, clock=lambda: now)
+    restarted = False
+    most_queued = ticks = 0
+    began = time.perf_counter()
+    while now <= start + timedelta(days=1, seconds=args.step):
+        await scheduler.tick()
+        ticks += 1
+        most_queued = max(most_queued, len(scheduler))
+        now += timedelta(seconds=args.step)
+        if not restarted and now >= start + timedelta(days=args.restart_at):
+            scheduler = ReminderScheduler(bot, clock=lambda: now)
+            restarted = True
+    elapsed = time.perf_counter() - began
+
+    sent = collections.Counter(params["chat_id"] for params in telegram.calls_for("sendMessage"))
+    total = sum(sent.values())
+    print(f"{ticks} ticks of {args.step}s simulated in {elapsed:.1f}s")
+    print(f"sent {total} of {args.reminders} ({total / elapsed:.0f}/s), most held in memory {most_queued}")
+    if total != args.reminders:
+        print("MISMATCH: reminders lost or sent twice")
+    await bot.shutdown()
+
+def main():
+    parser = argparse.ArgumentParser(description="Reminder scheduler over a day of reminders")
+    parser.add_argument("--reminders", type=int, default=200_000)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--step", type=int, default=60, help="simulated seconds per scheduler tick")
+    parser.add_argument("--restart-at", type=float, default=0.5, help="fraction of the day to restart at")
+    parser.add_argument("--database-url", help="database to use instead of a temporary SQLite file")
+    args = parser.parse_args()
+
+    # Read by src.config at import time
+    os.environ["DATABASE_URL"] = args.database_url or (
+        f"sqlite+aiosqlite:///{tempfile.mkdtemp(prefix='tgcrud-bench-')}/bench.db")
+    os.environ.setdefault("BOT_TOKEN", "123:bench")
+    os.environ.setdefault("REMINDER_RATE", "1000000")
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    asyncio.run(_main(args))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""Note history (src.revisions): storage and reconstruction time over hundreds of edits.
+
+For each REVISION_MAX_CHAIN value, in its own process (src.config is read at import
+time), creates one note of about --size characters, makes --revisions small random edits
+to it through update_note, then rebuilds every revision with get_revision. Reports the
+history's stored size next to keeping each version whole, and the time per rebuild.
+A chain of 0 stores every revision whole; a very long one only snapshots when the deltas
+since the last one outweigh a whole version.
+
+    python -m bench.revisions --revisions 500 --size 4000 --chains 0,8,32,100000
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+WORDS = ("note", "meeting", "plan", "today", "call", "buy", "milk", "project", "deadline", "idea",
+         "remember", "the", "a", "to", "and", "with", "after", "before", "review", "draft")
+
+def _percentile(samples, q):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0.0
+
+def _edit(content, rng):
+    words = content.split(" ")
+    at = rng.randrange(len(words))
+    kind = rng.random()
+    if kind < 0.4:
+        words[at] = rng.choice(WORDS)
+    elif kind < 0.7:
+        words[at:at] = [rng.choice(WORDS) for _ in range(rng.randint(1, 12))]
+    else:
+        del words[at:at + rng.randint(1, 8)]
+    return " ".join(words) or rng.choice(WORDS)
+
+async def _child(args):
+    from sqlalchemy import func
+    from sqlalchemy.future import select
+    from src.auth import create_user
+    from src.db import engine, session_scope
+    from src.migrate import migrate_database
+    from src.models import NoteRevision
+    from src.notes import create_note, update_note
+    from src.revisions import get_revision, list_revisions
+
+    await migrate_database()
+    rng = random.Random(args.seed)
+    user = await create_user("700000", "bench")
+    content = " ".join(rng.choice(WORDS) for _ in range(args.size // 6))
+    note = await create_note(user.id, "Bench", content)
+
+    whole = 0
+    writes = []
+    while len(writes) < args.revisions:
+        edited = _edit(content, rng)
+        if edited == content:
+            continue
+        whole += len(content.encode())
+        content = edited
+        started = time.perf_counter()
+        await update_note(note.id, user.id, "Bench", content)
+        writes.append(time.perf_counter() - started)
+
+    revisions, _ = await list_revisions(user.id, note.id, limit=args.revisions)
+    rebuilds = []
+    for revision in revisions:
+        started = time.perf_counter()
+        await get_revision(user.id, revision.id)
+        rebuilds.append(time.perf_counter() - started)
+    async with session_scope() as session:
+        stored, snapshots = (await session.execute(
+            select(func.sum(func.length(NoteRevision.data)),
+                   func.sum(func.cast(NoteRevision.snapshot, NoteRevision.chain.type)))
+            .where(NoteRevision.note_id == note.id)
+        )).one()
+    await engine.dispose()
+    return {
+        "revisions": len(revisions),
+        "snapshots": snapshots,
+        "stored_kb": stored / 1024,
+        "whole_kb": whole / 1024,
+        "write_p50_ms": _percentile(writes, 0.50) * 1000,
+        "rebuild_p50_ms": _percentile(rebuilds, 0.50) * 1000,
+        "rebuild_p99_ms": _percentile(rebuilds, 0.99) * 1000,
+        "rebuild_max_ms": max(rebuilds) * 1000,
+    }
+
+def _run(chain, args):
+    env = dict(os.environ, BOT_TOKEN=os.environ.get("BOT_TOKEN", "123:bench"), REVISION_MAX_CHAIN=str(chain),
+               REVISIONS_PER_NOTE=str(args.revisions), LOG_LEVEL="WARNING")
+    env["DATABASE_URL"] = args.database_url or (
+        f"sqlite+aiosqlite:///{tempfile.mkdtemp(prefix='tgcrud-bench-')}/bench.db")
+    cmd = [sys.executable, "-m", "bench.revisions", "--child", "--revisions", str(args.revisions),
+           "--size", str(args.size), "--seed", str(args.seed)]
+    out = subprocess.run(cmd, env=env, capture_output=True, text=True, check=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description="Note history storage and reconstruction time")
+    parser.add_argument("--revisions", type=int, default=500)
+    parser.add_argument("--size", type=int, default=4000, help="approximate note length in characters")
+    parser.add_argument("--chains", default="0,8,32,100000", help="comma-separated REVISION_MAX_CHAIN values")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--database-url", help="database to use instead of a fresh SQLite file per run")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(asyncio.run(_child(args))))
+        return
+
+    print(f"{'max chain':>10}{'snapshots':>10}{'stored KB':>11}{'whole KB':>10}{'write ms':>10}"
+          f"{'rebuild p50':>13}{'p99':>8}{'max':>8}")
+    for chain in args.chains.split(","):
+        r = _run(int(chain), args)
+        print(f"{chain:>10}{r['snapshots']:>10}{r['stored_kb']:>11.1f}{r['whole_kb']:>10.1f}"
+              f"{r['write_p50_ms']:>10.2f}{r['rebuild_p50_ms']:>13.2f}{r['rebuild_p99_ms']:>8.2f}"
+              f"{r['rebuild_max_ms']:>8.2f}")
+
+if __name__ == "__main__":
+    main()
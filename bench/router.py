@@ -0,0 +1,77 @@
+"""Micro-benchmark: callback dispatch cost of CallbackRouter vs the baseline's if/elif chain.
+
+    python -m bench.router [--number 200000]
+
+Only the dispatch step is timed (finding the handler and parsing its arguments); the
+handlers themselves are not run.
+"""
+import argparse
+import os
+import timeit
+
+# Importing src.handlers builds the engine; no database is touched here
+os.environ.setdefault("DATABASE_URL", "sqlite+aiosqlite:///:memory:")
+os.environ.setdefault("BOT_TOKEN", "123:bench")
+
+from src.handlers import router  # noqa: E402
+
+def legacy_dispatch(data):
+    """The baseline's handle_callback_query chain and callback_data, minus the awaits."""
+    if data.startswith("pattern_"):
+        return "handle_pattern_setup", ()
+    elif data == "set_pattern":
+        return "handle_pattern_setup", ()
+    elif data == "unlock_pattern":
+        return "show_locked_message", ()
+    elif data in ["new_note", "list_notes", "settings", "lock_device"]:
+        return "handle_main_menu", ()
+    elif data == "back_to_menu":
+        return "show_main_menu", ()
+    elif data.startswith("view_note_"):
+        return "show_note_details", (int(data.split("_")[2]),)
+    elif data.startswith("edit_note_"):
+        return "show_edit_note_form", (int(data.split("_")[2]),)
+    elif data.startswith("delete_note_"):
+        return "delete_note_confirmation", (int(data.split("_")[2]),)
+    elif data == "change_pattern":
+        return "show_pattern_change", ()
+    return None
+
+# Called directly, like legacy_dispatch, so neither side pays for an extra frame
+router_dispatch = router.decode
+
+# (baseline callback_data, action name, fields) for a spread of early and late branches
+SAMPLES = [
+    ("pattern_5", "pattern", (5,)),
+    ("list_notes", "list_notes", ()),
+    ("back_to_menu", "back_to_menu", ()),
+    ("view_note_1234567", "view_note", (1234567,)),
+    ("edit_note_1234567", "edit_note", (1234567,)),
+    ("delete_note_1234567", "delete_note", (1234567,)),
+    ("change_pattern", "change_pattern", ()),
+]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--number", type=int, default=200_000, help="calls per sample")
+    args = parser.parse_args()
+
+    print(f"{'callback':<22}{'legacy ns':>11}{'router ns':>11}{'compact ns':>12}{'bytes':>13}")
+    totals = [0.0, 0.0, 0.0]
+    for legacy, name, values in SAMPLES:
+        compact = router.encode(name, *values)
+        timings = [
+            timeit.timeit(lambda: legacy_dispatch(legacy), number=args.number),
+            timeit.timeit(lambda: router_dispatch(legacy), number=args.number),
+            timeit.timeit(lambda: router_dispatch(compact), number=args.number),
+        ]
+        for i, t in enumerate(timings):
+            totals[i] += t
+        ns = [t / args.number * 1e9 for t in timings]
+        print(f"{legacy:<22}{ns[0]:>11.0f}{ns[1]:>11.0f}{ns[2]:>12.0f}"
+              f"{len(legacy):>6} -> {len(compact):<4}")
+    mean = [t / (args.number * len(SAMPLES)) * 1e9 for t in totals]
+    print(f"{'mean':<22}{mean[0]:>11.0f}{mean[1]:>11.0f}{mean[2]:>12.0f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""Throughput of the multi-process mode (src.workers) with 1 to N worker processes.
+
+Seeds users with a few notes each, then replays the same stream of button taps (note
+list, a note, back to the menu, settings) through a WorkerPool for each worker count, as
+the ingress would, and times until every worker has handled its share. Workers answer
+Bot API calls from an in-process fake, so nothing leaves the machine.
+
+    python -m bench.workers --users 500 --taps 8 --workers 1,2,4
+
+Scaling is bounded by the cores available and, on SQLite, by its single writer; this
+workload only reads, so it mostly measures handler CPU.
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+
+async def _seed(users, notes_per_user):
+    from src.auth import create_user
+    from src.migrate import migrate_database
+    from src.notes import create_note
+
+    await migrate_database()
+    note_ids = {}
+    for telegram_id in range(500_000, 500_000 + users):
+        user = await create_user(str(telegram_id), f"user{telegram_id}")
+        note_ids[telegram_id] = [(await create_note(user.id, f"Note {n}", "Some text " * 20)).id
+                                 for n in range(notes_per_user)]
+    return note_ids
+
+def _updates(note_ids, taps):
+    from bench.fake_telegram import FakeTelegram
+    from src.handlers import router
+
+    telegram = FakeTelegram()
+    script = [router.encode("list_notes"), None, router.encode("back_to_menu"), router.encode("settings")]
+    updates = []
+    for step in range(taps):
+        for telegram_id, ids in note_ids.items():
+            data = script[step % len(script)] or router.encode("view_note", ids[step % len(ids)])
+            updates.append((telegram_id, json.dumps(telegram.callback_update(telegram_id, data)).encode()))
+    return updates
+
+async def _run(workers, updates, latency):
+    from src.workers import WorkerPool
+
+    pool = WorkerPool(workers, ["--fake-api-latency", latency])
+    await pool.start()
+    started = time.perf_counter()
+    for key, payload in updates:
+        await pool.dispatch(payload, key)
+    results = await pool.stop()
+    elapsed = time.perf_counter() - started
+    return elapsed, results
+
+async def _main(args):
+    note_ids = await _seed(args.users, args.notes)
+    updates = _updates(note_ids, args.taps)
+    print(f"{len(updates)} updates from {args.users} users; {os.cpu_count()} CPUs")
+    print(f"{'workers':>8}{'seconds':>10}{'updates/s':>12}{'speedup':>9}{'errors':>8}  per worker")
+    baseline = None
+    for workers in args.workers:
+        elapsed, results = await _run(workers, updates, args.api_latency)
+        rate = len(updates) / elapsed
+        baseline = baseline or rate
+        errors = sum(r["handler_errors"] for r in results if r)
+        print(f"{workers:>8}{elapsed:>10.2f}{rate:>12.0f}{rate / baseline:>8.2f}x{errors:>8}  "
+              f"{[r['updates'] if r else None for r in results]}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Multi-process worker pool throughput")
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--notes", type=int, default=3, help="notes seeded per user")
+    parser.add_argument("--taps", type=int, default=8, help="button taps per user")
+    parser.add_argument("--workers", default=None,
+                        help="comma-separated worker counts (default: 1, 2, 4... up to the CPU count)")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="fake Bot API delay in seconds")
+    parser.add_argument("--database-url", help="database to use instead of a temporary SQLite file")
+    args = parser.parse_args()
+    if args.workers:
+        args.workers = [int(n) for n in args.workers.split(",")]
+    else:
+        args.workers = [1]
+        while args.workers[-1] * 2 <= (os.cpu_count() or 1):
+            args.workers.append(args.workers[-1] * 2)
+
+    # Read by src.config at import time, here and in every worker process
+    os.environ["DATABASE_URL"] = args.database_url or (
+        f"sqlite+aiosqlite:///{tempfile.mkdtemp(prefix='tgcrud-bench-')}/bench.db")
+    os.environ.setdefault("BOT_TOKEN", "123:bench")
+    os.environ["METRICS_PORT"] = "0"
+    os.environ["RATE_LIMIT_GLOBAL"] = "0"
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    asyncio.run(_main(args))
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,110 @@
-from telegram.ext import ContextTypes
-from .db import SessionLocal
-from .models import User
-
-async def list_users(update, context: ContextTypes.DEFAULT_TYPE):
-    session = SessionLocal()
-    user = session.query(User).filter_by(telegram_id=update.effective_user.id).first()
-
-    if not user or not user.is_admin:
-        await update.message.reply_text("You are not admin.")
-        return
-
-    users = session.query(User).all()
-    msg = "Registered Users:\n"
-    for u in users:
-        msg += f"{u.id}: {u.phone} (Admin: {u.is_admin})\n"
-    await update.message.reply_text(msg)
+import csv
+import io
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import case, func
+from sqlalchemy.future import select
+from src.config import ADMIN_PAGE_SIZE, ACTIVE_USER_DAYS, NOTES_TRANSFER_BATCH
+from src.db import session_scope
+from src.models import User, Note
+
+# Admin views over every user. Pages are keyset-paginated on users.id, and counts come
+# from grouped queries, never from a query per user.
+
+USER_COLUMNS = (User.id, User.telegram_id, User.username, User.is_admin, User.is_locked, User.created_at)
+
+def users_page_query(cursor: int = None, before: bool = False, limit: int = ADMIN_PAGE_SIZE):
+    # Counted per row through ix_notes_user_id_updated_at; a page is only `limit` users
+    notes = select(func.count()).where(Note.user_id == User.id).scalar_subquery()
+    stmt = select(*USER_COLUMNS, notes.label("notes"))
+    if cursor is not None:
+        stmt = stmt.where(User.id < cursor if before else User.id > cursor)
+    stmt = stmt.order_by(User.id.desc() if before else User.id.asc())
+    # One extra row tells us whether another page exists
+    return stmt.limit(limit + 1)
+
+async def list_users(cursor: int = None, before: bool = False, limit: int = ADMIN_PAGE_SIZE):
+    """Return one page of users in sign-up order, with their note counts.
+
+    Works like src.notes.get_user_notes_page: returns ``(users, prev_cursor, next_cursor)``.
+    """
+    async with session_scope() as session:
+        result = await session.execute(users_page_query(cursor, before, limit))
+        users = result.all()
+
+    has_more = len(users) > limit
+    users = users[:limit]
+    if before:
+        users.reverse()
+        has_prev, has_next = has_more, True
+    else:
+        has_prev, has_next = cursor is not None, has_more
+    if not users:
+        return users, None, None
+    return (
+        users,
+        users[0].id if has_prev else None,
+        users[-1].id if has_next else None,
+    )
+
+async def user_stats():
+    """Return user and note totals, with one aggregate query over each table."""
+    since = datetime.now(timezone.utc) - timedelta(days=ACTIVE_USER_DAYS)
+    per_user = (
+        select(func.count().label("notes"), func.max(Note.updated_at).label("last_write"))
+        .group_by(Note.user_id)
+        .subquery()
+    )
+    async with session_scope() as session:
+        users = (await session.execute(select(
+            func.count().label("users"),
+            func.coalesce(func.sum(case((User.is_admin, 1), else_=0)), 0).label("admins"),
+            func.coalesce(func.sum(case((User.is_locked, 1), else_=0)), 0).label("locked"),
+            func.coalesce(func.sum(case((User.created_at >= since, 1), else_=0)), 0).label("new"),
+        ))).one()
+        notes = (await session.execute(select(
+            func.count().label("writers"),
+            func.coalesce(func.sum(per_user.c.notes), 0).label("notes"),
+            func.coalesce(func.max(per_user.c.notes), 0).label("most"),
+            func.coalesce(func.sum(case((per_user.c.last_write >= since, 1), else_=0)), 0).label("active"),
+        ))).one()
+    return {
+        "users": users.users,
+        "admins": users.admins,
+        "locked": users.locked,
+        "new_users": users.new,
+        "users_with_notes": notes.writers,
+        "notes": notes.notes,
+        "notes_per_user": notes.notes / users.users if users.users else 0,
+        "most_notes": notes.most,
+        "active_users": notes.active,
+        "active_days": ACTIVE_USER_DAYS,
+    }
+
+async def export_users_csv(out):
+    """Write every user, with their note count, to the binary file ``out`` as CSV.
+
+    Rows are streamed NOTES_TRANSFER_BATCH at a time. Returns how many users were written.
+    """
+    counts = select(Note.user_id, func.count().label("notes")).group_by(Note.user_id).subquery()
+    stmt = (
+        select(*USER_COLUMNS, func.coalesce(counts.c.notes, 0).label("notes"))
+        .outerjoin(counts, counts.c.user_id == User.id)
+        .order_by(User.id)
+        .execution_options(yield_per=NOTES_TRANSFER_BATCH)
+    )
+    count = 0
+    text = io.TextIOWrapper(out, encoding="utf-8", newline="", write_through=True)
+    writer = csv.writer(text)
+    writer.writerow(["id", "telegram_id", "username", "is_admin", "is_locked", "created_at", "notes"])
+    async with session_scope() as session:
+        result = await session.stream(stmt)
+        async for rows in result.partitions():
+            writer.writerows(
+                (row.id, row.telegram_id, row.username or "", int(bool(row.is_admin)), int(row.is_locked),
+                 row.created_at.isoformat() if row.created_at else "", row.notes)
+                for row in rows
+            )
+            count += len(rows)
+    # Leave ``out`` open for the caller
+    text.detach()
+    return count
@@ -1,29 +1,132 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import bcrypt
 from sqlalchemy.future import select
-from sqlalchemy import func
-from src.db import SessionLocal
+from sqlalchemy import func, update
+from src.cache import TTLCache
+from src.config import (USER_CACHE_SIZE, USER_CACHE_TTL, PATTERN_BCRYPT_ROUNDS, PATTERN_HASH_WORKERS,
+                        PATTERN_MAX_FAILURES, PATTERN_LOCKOUT)
+from src.db import session_scope, after_commit
+from src.metrics import REGISTRY
 from src.models import User
 
+# Users keyed by telegram_id. Entries are detached ORM rows (expire_on_commit=False),
+# so every write path must refresh or drop its entry.
+user_cache = TTLCache(USER_CACHE_SIZE, USER_CACHE_TTL)
+REGISTRY.gauge("user_cache_hits", "User lookups answered from the cache", lambda: user_cache.hits)
+REGISTRY.gauge("user_cache_misses", "User lookups that went to the database", lambda: user_cache.misses)
+REGISTRY.gauge("user_cache_size", "Users currently cached", lambda: len(user_cache))
+
+def cache_user(user):
+    """Store or refresh a user in the lookup cache."""
+    user_cache.set(str(user.telegram_id), user)
+
+def invalidate_user(telegram_id):
+    """Drop a user from the lookup cache after it has been modified."""
+    user_cache.pop(str(telegram_id))
+
+def get_user_cache_stats():
+    """Return hit/miss counters for sizing USER_CACHE_SIZE."""
+    return user_cache.stats()
+
 async def get_user_by_telegram_id(telegram_id: str):
-    async with SessionLocal() as session:
+    user = user_cache.get(str(telegram_id))
+    if user is not None:
+        return user
+
+    async with session_scope() as session:
         result = await session.execute(select(User).filter_by(telegram_id=str(telegram_id)))
-        return result.scalar()
+        user = result.scalar()
+    if user is not None:
+        cache_user(user)
+    return user
 
 async def create_user(telegram_id: str, username: str, is_admin: bool=False):
-    async with SessionLocal() as session:
+    async with session_scope() as session:
         # Check if this is the first user (make them admin)
         user_count = await session.execute(select(func.count(User.id)))
         is_first_user = user_count.scalar() == 0
-        
+
         # If it's the first user, make them admin regardless of the is_admin parameter
         if is_first_user:
             is_admin = True
-        
+
         user = User(telegram_id=telegram_id, username=username, is_admin=is_admin)
         session.add(user)
-        await session.commit()
-        return user
+        await session.flush()
+        # Only cache the row once it is durable, so a rolled-back update leaves no ghost
+        after_commit(session, lambda: cache_user(user))
+    return user
+
+# bcrypt is deliberately slow (~250 ms at cost 12) and releases the GIL while it works,
+# so it runs on a few dedicated threads. The semaphore keeps callers waiting on the
+# event loop rather than piling work into the executor's unbounded queue.
+_hash_executor = ThreadPoolExecutor(max_workers=PATTERN_HASH_WORKERS, thread_name_prefix="bcrypt")
+_hash_slots = None
+
+# Wrong patterns per user id; each failure restarts the PATTERN_LOCKOUT window
+failed_attempts = TTLCache(USER_CACHE_SIZE, PATTERN_LOCKOUT)
+
+PATTERN_CHECKS = REGISTRY.counter(
+    "pattern_checks_total", "Pattern lock verifications, by outcome", ["outcome"])
+REGISTRY.gauge("pattern_users_locked_out", "Users currently refused for too many wrong patterns",
+               lambda: sum(1 for user_id in failed_attempts.keys() if is_locked_out(user_id)))
+
+async def _run_bcrypt(fn, *args):
+    global _hash_slots
+    if _hash_slots is None:
+        _hash_slots = asyncio.Semaphore(PATTERN_HASH_WORKERS)
+    async with _hash_slots:
+        return await asyncio.get_running_loop().run_in_executor(_hash_executor, fn, *args)
+
+async def hash_pattern(pattern: str) -> str:
+    """Return the bcrypt hash of a pattern, computed off the event loop."""
+    salt = bcrypt.gensalt(PATTERN_BCRYPT_ROUNDS)
+    hashed = await _run_bcrypt(bcrypt.hashpw, pattern.encode(), salt)
+    return hashed.decode()
+
+def is_locked_out(user_id: int) -> bool:
+    """True while the user has too many recent wrong patterns to be checked again."""
+    return failed_attempts.get(user_id, 0) >= PATTERN_MAX_FAILURES
+
+async def verify_pattern_lock(user, pattern: str):
+    """Check ``pattern`` against the user's stored hash.
+
+    Users with PATTERN_MAX_FAILURES recent wrong patterns are refused without hashing, so
+    a flood of guesses can't tie up the bcrypt threads.
+    """
+    if is_locked_out(user.id):
+        PATTERN_CHECKS.inc(outcome="locked_out")
+        return False
+    if not user.pattern_lock:
+        return False
+    ok = await _run_bcrypt(bcrypt.checkpw, pattern.encode(), user.pattern_lock.encode())
+    if ok:
+        failed_attempts.pop(user.id)
+    else:
+        failed_attempts.set(user.id, failed_attempts.get(user.id, 0) + 1)
+    PATTERN_CHECKS.inc(outcome="ok" if ok else "wrong")
+    return ok
+
+async def _update_user(user, **values):
+    async with session_scope() as session:
+        await session.execute(update(User).where(User.id == user.id).values(**values))
+        # The cached row is stale now; the next lookup reloads it
+        after_commit(session, lambda: invalidate_user(user.telegram_id))
+    # ``user`` is usually the cached row itself, and the caller's transaction may yet roll
+    # back: drop it now so no other lookup sees the uncommitted values set below
+    invalidate_user(user.telegram_id)
+    for name, value in values.items():
+        setattr(user, name, value)
+
+async def set_pattern_lock(user, pattern: str):
+    """Hash and store a new pattern for ``user``."""
+    await _update_user(user, pattern_lock=await hash_pattern(pattern))
+
+async def set_locked(user, locked: bool):
+    """Persist whether the user's notepad is locked."""
+    await _update_user(user, is_locked=locked)
 
-async def verify_pattern_lock(user_id: int, pattern: str):
-    """Verify unlock by checking if the user is the admin."""
-    from src.config import ADMIN_ID
-    return user_id == ADMIN_ID
+async def clear_blocked(user):
+    """Include a user who had blocked the bot in broadcasts again."""
+    await _update_user(user, blocked_at=None)
@@ -0,0 +1,191 @@
+"""Admin broadcasts: one message to every user who hasn't blocked the bot.
+
+A broadcast walks users in id order, a batch at a time, and keeps its place in
+broadcasts.cursor. Every attempt is recorded in broadcast_deliveries as soon as it is
+made, so a broadcast resumed after a crash or restart skips the users it already
+reached. Only a send that completed but wasn't recorded yet can be repeated.
+"""
+import asyncio
+import logging
+import time
+from sqlalchemy import func, update
+from sqlalchemy.future import select
+from telegram.error import Forbidden, TelegramError
+from src.auth import invalidate_user
+from src.config import BROADCAST_RATE, BROADCAST_SENDERS, BROADCAST_BATCH
+from src.db import session_scope, after_commit
+from src.metrics import REGISTRY
+from src.models import User, Broadcast, BroadcastDelivery
+from src.ratelimit import TokenBucket, PRIORITY_BULK
+
+logger = logging.getLogger(__name__)
+
+BROADCAST_DELIVERIES = REGISTRY.counter(
+    "broadcast_deliveries_total", "Broadcast messages attempted, by outcome", ["status"])
+
+# Running broadcasts by id; stopped at shutdown and resumed by resume_broadcasts()
+_running = {}
+_stopping = False
+REGISTRY.gauge("broadcasts_running", "Broadcasts currently sending", lambda: len(_running))
+
+async def create_broadcast(bot, text: str, created_by: int):
+    """Record a broadcast and start sending it once the transaction commits."""
+    async with session_scope() as session:
+        broadcast = Broadcast(text=text, created_by=created_by)
+        session.add(broadcast)
+        await session.flush()
+        after_commit(session, lambda: start_broadcast(bot, broadcast.id))
+    return broadcast
+
+def start_broadcast(bot, broadcast_id: int):
+    """Run a broadcast in the background, unless it is already running."""
+    if broadcast_id in _running:
+        return
+    task = _running[broadcast_id] = asyncio.create_task(run_broadcast(bot, broadcast_id))
+    task.add_done_callback(lambda task: _finished(broadcast_id, task))
+
+def _finished(broadcast_id, task):
+    _running.pop(broadcast_id, None)
+    if not task.cancelled() and task.exception() is not None:
+        # Still marked running, so the next restart resumes it
+        logger.error("Broadcast %s stopped", broadcast_id, exc_info=task.exception())
+
+async def resume_broadcasts(bot):
+    """Restart every broadcast that was still sending when the bot stopped."""
+    global _stopping
+    _stopping = False
+    async with session_scope() as session:
+        result = await session.execute(select(Broadcast.id).filter_by(status="running").order_by(Broadcast.id))
+        broadcast_ids = result.scalars().all()
+    for broadcast_id in broadcast_ids:
+        logger.info("Resuming broadcast %s", broadcast_id)
+        start_broadcast(bot, broadcast_id)
+
+async def stop_broadcasts(timeout: float = 10):
+    """Stop running broadcasts; they carry on from their cursor after a restart.
+
+    Sends already in flight are allowed ``timeout`` seconds to finish and be recorded,
+    so they aren't repeated on resume. Broadcasts still running after that are cancelled.
+    """
+    global _stopping
+    _stopping = True
+    tasks = list(_running.values())
+    if not tasks:
+        return
+    _, pending = await asyncio.wait(tasks, timeout=timeout)
+    for task in pending:
+        task.cancel()
+    await asyncio.gather(*pending, return_exceptions=True)
+
+async def delivery_counts(broadcast_ids):
+    """Return {broadcast_id: {status: count}} from one grouped query."""
+    counts = {broadcast_id: {} for broadcast_id in broadcast_ids}
+    if not counts:
+        return counts
+    async with session_scope() as session:
+        result = await session.execute(
+            select(BroadcastDelivery.broadcast_id, BroadcastDelivery.status, func.count())
+            .where(BroadcastDelivery.broadcast_id.in_(broadcast_ids))
+            .group_by(BroadcastDelivery.broadcast_id, BroadcastDelivery.status)
+        )
+        for broadcast_id, status, count in result:
+            counts[broadcast_id][status] = count
+    return counts
+
+async def recent_broadcasts(limit: int = 5):
+    """Return the latest broadcasts, newest first, each with its delivery counts."""
+    async with session_scope() as session:
+        result = await session.execute(select(Broadcast).order_by(Broadcast.id.desc()).limit(limit))
+        broadcasts = result.scalars().all()
+    counts = await delivery_counts([b.id for b in broadcasts])
+    return [(b, counts[b.id]) for b in broadcasts]
+
+async def run_broadcast(bot, broadcast_id: int):
+    """Send a broadcast to every remaining user, then report the totals to its creator."""
+    async with session_scope() as session:
+        broadcast = await session.get(Broadcast, broadcast_id)
+    if broadcast is None or broadcast.status != "running":
+        return
+
+    # Paces the broadcast on its own, below the global limit; the outbound rate limiter
+    # (if enabled) also sends these after any interactive traffic
+    bucket = TokenBucket(BROADCAST_RATE, 1, time.monotonic())
+    senders = asyncio.Semaphore(BROADCAST_SENDERS)
+
+    async def deliver(user):
+        async with senders:
+            while (wait := bucket.wait_time(time.monotonic())) > 0:
+                await asyncio.sleep(wait)
+            if _stopping:
+                return
+            bucket.take()
+            status = await _send(bot, user.telegram_id, broadcast.text)
+        await _record(broadcast_id, user, status)
+
+    cursor = broadcast.cursor
+    while True:
+        async with session_scope() as session:
+            result = await session.execute(
+                select(User.id, User.telegram_id)
+                .where(User.id > cursor, User.blocked_at.is_(None))
+                .order_by(User.id)
+                .limit(BROADCAST_BATCH)
+            )
+            users = result.all()
+            if not users:
+                break
+            result = await session.execute(
+                select(BroadcastDelivery.user_id).where(
+                    BroadcastDelivery.broadcast_id == broadcast_id,
+                    BroadcastDelivery.user_id.in_([user.id for user in users]),
+                )
+            )
+            reached = set(result.scalars())
+
+        await asyncio.gather(*(deliver(user) for user in users if user.id not in reached))
+        if _stopping:
+            # Part of this batch may be unsent, so the cursor stays before it
+            return
+        cursor = users[-1].id
+        async with session_scope() as session:
+            await session.execute(update(Broadcast).where(Broadcast.id == broadcast_id).values(cursor=cursor))
+
+    async with session_scope() as session:
+        await session.execute(
+            update(Broadcast).where(Broadcast.id == broadcast_id).values(status="done", finished_at=func.now())
+        )
+        creator = await session.get(User, broadcast.created_by) if broadcast.created_by else None
+    counts = (await delivery_counts([broadcast_id]))[broadcast_id]
+    logger.info("Broadcast %s finished: %s", broadcast_id, counts)
+    if creator is not None:
+        try:
+            await bot.send_message(
+                int(creator.telegram_id),
+                f"📣 Broadcast #{broadcast_id} finished\n\n"
+                f"✅ Sent: {counts.get('sent', 0)}\n"
+                f"🚫 Blocked: {counts.get('blocked', 0)}\n"
+                f"❌ Failed: {counts.get('failed', 0)}",
+            )
+        except TelegramError as e:
+            logger.warning("Could not report broadcast %s to its creator: %s", broadcast_id, e)
+
+async def _send(bot, telegram_id, text):
+    # rate_limit_args may only be passed when a rate limiter is set
+    kwargs = {"rate_limit_args": PRIORITY_BULK} if bot.rate_limiter is not None else {}
+    try:
+        await bot.send_message(int(telegram_id), text, **kwargs)
+        return "sent"
+    except Forbidden:
+        # Blocked the bot, or deleted their account
+        return "blocked"
+    except TelegramError as e:
+        logger.info("Broadcast to %s failed: %s", telegram_id, e)
+        return "failed"
+
+async def _record(broadcast_id, user, status):
+    async with session_scope() as session:
+        session.add(BroadcastDelivery(broadcast_id=broadcast_id, user_id=user.id, status=status))
+        if status == "blocked":
+            await session.execute(update(User).where(User.id == user.id).values(blocked_at=func.now()))
+            after_commit(session, lambda: invalidate_user(user.telegram_id))
+    BROADCAST_DELIVERIES.inc(status=status)
@@ -6,3 +6,128 @@ load_dotenv()
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 DATABASE_URL = os.getenv("DATABASE_URL")
 ADMIN_ID = None  # Initially, no admin is set. The first user to call /start becomes the admin.
+
+# Pattern lock hashing: bcrypt cost factor and the threads it may occupy. After
+# PATTERN_MAX_FAILURES wrong patterns a user is refused without hashing until
+# PATTERN_LOCKOUT seconds pass without another attempt.
+PATTERN_BCRYPT_ROUNDS = int(os.getenv("PATTERN_BCRYPT_ROUNDS", "12"))
+PATTERN_HASH_WORKERS = int(os.getenv("PATTERN_HASH_WORKERS", "2"))
+PATTERN_MAX_FAILURES = int(os.getenv("PATTERN_MAX_FAILURES", "5"))
+PATTERN_LOCKOUT = float(os.getenv("PATTERN_LOCKOUT", "300"))
+
+# In-process cache in front of src.auth user lookups
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "300"))
+
+# Notes shown per "My Notes" page
+NOTES_PAGE_SIZE = int(os.getenv("NOTES_PAGE_SIZE", "10"))
+
+# Update ingress: "polling" or "webhook"
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "127.0.0.1")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "telegram")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")  # Public URL Telegram posts to; defaults to the local listener
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+
+# Worker processes behind one ingress process (see src.workers); 1 runs everything in one
+WORKERS = int(os.getenv("WORKERS", "1"))
+
+# Updates from different users handled at once; one user's updates always run in order
+MAX_CONCURRENT_UPDATES = int(os.getenv("MAX_CONCURRENT_UPDATES", "16"))
+
+# Conversation state store: "memory" (single process) or "db" (shared, survives restarts)
+STATE_BACKEND = os.getenv("STATE_BACKEND", "memory")
+STATE_TTL = float(os.getenv("STATE_TTL", "3600"))  # Idle sessions older than this are evicted
+STATE_CACHE_SIZE = int(os.getenv("STATE_CACHE_SIZE", "10000"))
+STATE_SWEEP_INTERVAL = float(os.getenv("STATE_SWEEP_INTERVAL", "300"))
+
+# Logging and observability
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+SQL_ECHO = os.getenv("SQL_ECHO", "false").lower() in ("1", "true", "yes")
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))  # 0 disables the /metrics endpoint
+
+# Database engine tuning. Pre-ping and recycle only apply to server databases.
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))  # Seconds; -1 never recycles
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "500"))  # asyncpg, per connection
+DB_PREPARE_THRESHOLD = int(os.getenv("DB_PREPARE_THRESHOLD", "5"))  # psycopg: executions before preparing
+# SQLite has one writer at a time: a small pool makes writers queue fairly for a connection
+# instead of polling for the file lock, which starves some of them into "database is locked"
+SQLITE_POOL_SIZE = int(os.getenv("SQLITE_POOL_SIZE", "5"))
+SQLITE_MAX_OVERFLOW = int(os.getenv("SQLITE_MAX_OVERFLOW", "0"))
+# SQLite pragmas set on every new connection; an empty value leaves SQLite's default
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_BUSY_TIMEOUT = os.getenv("SQLITE_BUSY_TIMEOUT", "5000")  # Milliseconds
+SQLITE_MMAP_SIZE = os.getenv("SQLITE_MMAP_SIZE", "268435456")  # Bytes
+
+# Group commit for note writes: writes arriving within this many seconds share one
+# transaction (0 disables batching); a batch commits early once it has the max ops
+WRITE_BATCH_WINDOW = float(os.getenv("WRITE_BATCH_WINDOW", "0"))
+WRITE_BATCH_MAX_OPS = int(os.getenv("WRITE_BATCH_MAX_OPS", "64"))
+
+# Outbound Bot API rate limits, in messages per second (RATE_LIMIT_GLOBAL=0 disables them)
+RATE_LIMIT_GLOBAL = float(os.getenv("RATE_LIMIT_GLOBAL", "30"))
+RATE_LIMIT_PER_CHAT = float(os.getenv("RATE_LIMIT_PER_CHAT", "1"))
+RATE_LIMIT_CHAT_BURST = int(os.getenv("RATE_LIMIT_CHAT_BURST", "3"))
+RATE_LIMIT_MAX_RETRIES = int(os.getenv("RATE_LIMIT_MAX_RETRIES", "3"))  # Per request, on 429
+
+# /export and /import: notes read or inserted per batch, and the most an import may hold
+# (bots can't download files over 20 MB anyway)
+NOTES_TRANSFER_BATCH = int(os.getenv("NOTES_TRANSFER_BATCH", "500"))
+IMPORT_MAX_BYTES = int(os.getenv("IMPORT_MAX_BYTES", str(20 * 1024 * 1024)))
+IMPORT_MAX_NOTES = int(os.getenv("IMPORT_MAX_NOTES", "10000"))
+
+# /users admin listing: users per page, and how recent a note write counts as active
+ADMIN_PAGE_SIZE = int(os.getenv("ADMIN_PAGE_SIZE", "20"))
+ACTIVE_USER_DAYS = int(os.getenv("ACTIVE_USER_DAYS", "30"))
+
+# /broadcast: messages a second (below RATE_LIMIT_GLOBAL, so replies to users still get
+# through), sends in flight at once, and users read per batch
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "20"))
+BROADCAST_SENDERS = int(os.getenv("BROADCAST_SENDERS", "8"))
+BROADCAST_BATCH = int(os.getenv("BROADCAST_BATCH", "200"))
+
+# Inline mode (@bot <title prefix>): users whose title index is kept in memory and for how
+# long, how long Telegram may reuse an answer for that user, and results per answer (max 50)
+INLINE_INDEX_USERS = int(os.getenv("INLINE_INDEX_USERS", "1000"))
+INLINE_INDEX_TTL = float(os.getenv("INLINE_INDEX_TTL", "3600"))
+INLINE_CACHE_TIME = int(os.getenv("INLINE_CACHE_TIME", "10"))
+INLINE_RESULTS = int(os.getenv("INLINE_RESULTS", "20"))
+
+# Note reminders. Times typed without a zone are read in REMINDER_TIMEZONE. The scheduler
+# keeps reminders due in the next REMINDER_WINDOW seconds in memory (loading at most
+# REMINDER_LOAD_BATCH at once), sends REMINDER_BATCH at a time at REMINDER_RATE a second
+# with REMINDER_SENDERS in flight, and leases what it sends for REMINDER_LEASE seconds. A
+# send that fails for a passing reason is retried once its lease runs out, up to
+# REMINDER_MAX_ATTEMPTS sends in all
+REMINDER_TIMEZONE = os.getenv("REMINDER_TIMEZONE", "UTC")
+REMINDER_WINDOW = float(os.getenv("REMINDER_WINDOW", "600"))
+REMINDER_LOAD_BATCH = int(os.getenv("REMINDER_LOAD_BATCH", "5000"))
+REMINDER_BATCH = int(os.getenv("REMINDER_BATCH", "100"))
+REMINDER_RATE = float(os.getenv("REMINDER_RATE", "20"))
+REMINDER_SENDERS = int(os.getenv("REMINDER_SENDERS", "8"))
+REMINDER_LEASE = float(os.getenv("REMINDER_LEASE", "300"))
+REMINDER_MAX_ATTEMPTS = int(os.getenv("REMINDER_MAX_ATTEMPTS", "5"))
+REMINDER_MAX_PER_USER = int(os.getenv("REMINDER_MAX_PER_USER", "100"))
+
+# Note history: a revision is stored whole once this many deltas separate it from the last
+# whole one (bounding how many are applied to rebuild a version), and each note keeps its
+# latest REVISIONS_PER_NOTE revisions
+REVISION_MAX_CHAIN = int(os.getenv("REVISION_MAX_CHAIN", "32"))
+REVISIONS_PER_NOTE = int(os.getenv("REVISIONS_PER_NOTE", "500"))
+
+# Redelivered updates: every update_id is remembered in memory (UPDATE_DEDUP_SIZE of them);
+# "db" also records them for UPDATE_DEDUP_WINDOW seconds, across restarts and processes
+UPDATE_DEDUP_BACKEND = os.getenv("UPDATE_DEDUP_BACKEND", "memory")
+UPDATE_DEDUP_SIZE = int(os.getenv("UPDATE_DEDUP_SIZE", "10000"))
+UPDATE_DEDUP_WINDOW = float(os.getenv("UPDATE_DEDUP_WINDOW", "86400"))
+
+# Last content rendered into each bot message, so identical edits are skipped
+RENDER_CACHE_SIZE = int(os.getenv("RENDER_CACHE_SIZE", "50000"))
+RENDER_CACHE_TTL = float(os.getenv("RENDER_CACHE_TTL", "86400"))
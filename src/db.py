@@ -1,8 +1,257 @@
+import asyncio
+import functools
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from sqlalchemy import event
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
-from sqlalchemy.orm import sessionmaker, declarative_base
-from src.config import DATABASE_URL
+from sqlalchemy.orm import Session, sessionmaker, declarative_base
+from sqlalchemy.engine import make_url
+from src.config import (
+    DATABASE_URL, SQL_ECHO, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE,
+    DB_POOL_PRE_PING, DB_STATEMENT_CACHE_SIZE, DB_PREPARE_THRESHOLD, SQLITE_POOL_SIZE,
+    SQLITE_MAX_OVERFLOW, SQLITE_JOURNAL_MODE, SQLITE_SYNCHRONOUS, SQLITE_BUSY_TIMEOUT, SQLITE_MMAP_SIZE,
+)
+from src.metrics import REGISTRY, TimedAsyncAdaptedQueuePool, instrument_engine
 
-engine = create_async_engine(DATABASE_URL, echo=True)
+def _is_memory_sqlite(url):
+    return url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:")
+
+def _engine_config(url):
+    """Return the URL and create_async_engine() options for the configured backend."""
+    url = make_url(url)
+    if _is_memory_sqlite(url):
+        # In-memory SQLite keeps its single-connection pool
+        return url, {}
+
+    options = {"poolclass": TimedAsyncAdaptedQueuePool, "pool_timeout": DB_POOL_TIMEOUT}
+    if url.get_backend_name() == "sqlite":
+        options.update(pool_size=SQLITE_POOL_SIZE, max_overflow=SQLITE_MAX_OVERFLOW)
+        return url, options
+
+    options.update(pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW)
+    # Server databases drop idle connections; check and recycle ours before they go stale
+    options["pool_pre_ping"] = DB_POOL_PRE_PING
+    options["pool_recycle"] = DB_POOL_RECYCLE
+    if url.get_driver_name() == "asyncpg":
+        # SQLAlchemy's cache of prepared statements, per connection (0 disables it)
+        url = url.update_query_dict({"prepared_statement_cache_size": str(DB_STATEMENT_CACHE_SIZE)})
+    elif url.get_driver_name() == "psycopg":
+        # Server-side prepare after this many executions of a statement (negative disables it,
+        # e.g. behind a transaction-pooling PgBouncer)
+        options["connect_args"] = {"prepare_threshold": DB_PREPARE_THRESHOLD if DB_PREPARE_THRESHOLD >= 0 else None}
+    return url, options
+
+def _sqlite_pragmas():
+    # busy_timeout first: switching the journal mode itself may have to wait for a lock
+    pragmas = [
+        ("busy_timeout", SQLITE_BUSY_TIMEOUT),
+        ("journal_mode", SQLITE_JOURNAL_MODE),
+        ("synchronous", SQLITE_SYNCHRONOUS),
+        ("mmap_size", SQLITE_MMAP_SIZE),
+    ]
+    return [f"PRAGMA {name} = {value}" for name, value in pragmas if value]
+
+def tune_sqlite(engine):
+    """Apply the configured pragmas to every new connection of a file-backed SQLite engine."""
+    if engine.dialect.name != "sqlite" or _is_memory_sqlite(engine.url):
+        return
+    statements = _sqlite_pragmas()
+
+    @event.listens_for(engine.sync_engine, "connect")
+    def _set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for statement in statements:
+            cursor.execute(statement)
+        cursor.close()
+
+_url, _options = _engine_config(DATABASE_URL)
+engine = create_async_engine(_url, echo=SQL_ECHO, **_options)
+tune_sqlite(engine)
+instrument_engine(engine)
 SessionLocal = sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
 
+# Sessions remember whether they have written, so a write batcher is never handed work
+# its caller's own transaction could block (SQLite has a single writer)
+@event.listens_for(Session, "after_flush")
+def _flushed(session, flush_context):
+    session.info["wrote"] = True
+
+@event.listens_for(Session, "do_orm_execute")
+def _executed(state):
+    if state.is_insert or state.is_update or state.is_delete:
+        state.session.info["wrote"] = True
+
 Base = declarative_base()
+
+# Session shared by every DB helper while one Telegram update is being handled
+_current_session = ContextVar("current_session", default=None)
+
+def _committed(session):
+    """Run the after_commit callbacks queued so far, outside any update's session."""
+    session.info["wrote"] = False
+    callbacks, session.info["after_commit"] = session.info["after_commit"], []
+    # Tasks they start must not inherit the session
+    token = _current_session.set(None)
+    try:
+        for callback in callbacks:
+            callback()
+    finally:
+        _current_session.reset(token)
+
+@asynccontextmanager
+async def _unit_of_work():
+    async with SessionLocal() as session:
+        session.info["after_commit"] = []
+        async with session.begin():
+            yield session
+        _committed(session)
+
+@asynccontextmanager
+async def session_scope():
+    """Yield the session of the update being handled, or a short-lived one outside handlers.
+
+    Helpers must flush rather than commit: the owner of the scope commits when the handler
+    returns, so everything an update writes commits or rolls back together.
+    """
+    session = _current_session.get()
+    if session is not None:
+        yield session
+        return
+    async with _unit_of_work() as session:
+        yield session
+
+def after_commit(session, callback):
+    """Run ``callback`` once the transaction of ``session`` has committed."""
+    session.info["after_commit"].append(callback)
+
+async def release_session():
+    """Give back the calling handler's connection if its transaction has only read so far.
+
+    Runs before every Bot API request (see src.ratelimit), so a handler that has only read
+    holds no pooled connection while it waits on the network or the rate limiter; a later
+    query begins a new transaction. Once the handler has written, its transaction stays
+    open until it returns, so the update's writes still commit or roll back as one (at the
+    cost of holding the connection, and SQLite's write lock, across those calls).
+    """
+    session = _current_session.get()
+    if session is None or session.info.get("task") is not asyncio.current_task():
+        return
+    if session.in_transaction() and not session.info.get("wrote"):
+        await session.commit()
+        _committed(session)
+
+def with_session(callback):
+    """Wrap a handler so its DB helpers share one session and its writes one transaction.
+
+    The transaction commits when the handler returns and rolls back if it raises; only a
+    stretch that has not written yet ends early, before a Bot API call (see release_session).
+    """
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        async with SessionLocal() as session:
+            session.info["after_commit"] = []
+            session.info["task"] = asyncio.current_task()
+            token = _current_session.set(session)
+            try:
+                result = await callback(update, context)
+                if session.in_transaction():
+                    await session.commit()
+            finally:
+                _current_session.reset(token)
+            _committed(session)
+        return result
+    return wrapper
+
+WRITE_BATCH_SIZE = REGISTRY.histogram(
+    "db_write_batch_size", "Writes committed together by a WriteBatcher",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256))
+
+class WriteBatcher:
+    """Group commit: writes submitted within ``window`` seconds (or ``max_ops`` of them)
+    share one transaction, so they pay for one commit between them.
+
+    Each write runs in its own savepoint, so a failing one is rolled back alone and its
+    caller gets the exception; the others still commit. Callers are resumed only once the
+    shared transaction has committed. Batches commit one at a time, and the next one fills
+    up while the previous commits.
+    """
+
+    def __init__(self, window: float, max_ops: int = 64):
+        self.window = window
+        self.max_ops = max_ops
+        self._pending = []
+        self._timer = None
+        self._lock = None
+        self._tasks = set()
+
+    async def submit(self, op):
+        """Run ``await op(session)`` in the next batch and return its result after commit."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((op, future))
+        if len(self._pending) >= self.max_ops:
+            self._start_flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._start_flush)
+        return await future
+
+    def _start_flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.create_task(self._flush(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _flush(self, batch):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            # Callers whose wait was cancelled before the batch started are dropped
+            batch = [(op, future) for op, future in batch if not future.done()]
+            if not batch:
+                return
+            WRITE_BATCH_SIZE.observe(len(batch))
+            outcomes = []
+            try:
+                async with _unit_of_work() as session:
+                    token = _current_session.set(session)
+                    try:
+                        for op, future in batch:
+                            callbacks = len(session.info["after_commit"])
+                            try:
+                                async with session.begin_nested():
+                                    outcomes.append((future, await op(session), None))
+                            except Exception as e:
+                                del session.info["after_commit"][callbacks:]
+                                outcomes.append((future, None, e))
+                    finally:
+                        _current_session.reset(token)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                return
+            for future, result, error in outcomes:
+                if future.done():
+                    continue
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(result)
+
+async def run_write(op, batcher=None):
+    """Run ``await op(session)`` and return its result.
+
+    With a batcher the write is group-committed and this returns after the commit. Without
+    one, or when the current update's transaction has already written, it joins the
+    current transaction like any other helper.
+    """
+    if batcher is not None:
+        session = _current_session.get()
+        if session is None or not session.info.get("wrote"):
+            return await batcher.submit(op)
+    async with session_scope() as session:
+        return await op(session)
@@ -0,0 +1,85 @@
+"""Drop updates that have already been handled.
+
+Telegram delivers an update again when it isn't sure we got it: after a polling restart
+that hadn't confirmed its offset yet, or when a webhook response was lost. Without this,
+handlers run twice (a second note is created, callbacks repeat their writes).
+
+Every update_id is remembered in a bounded in-memory LRU. With UPDATE_DEDUP_BACKEND=db
+it is also recorded in the processed_updates table for UPDATE_DEDUP_WINDOW seconds, so
+duplicates are caught across restarts and by every bot process. An update is marked when
+it arrives, before its handlers run: one that crashed its handler is not retried.
+"""
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import delete
+from telegram import Update
+from telegram.ext import ApplicationHandlerStop, TypeHandler
+from src.cache import TTLCache
+from src.config import UPDATE_DEDUP_BACKEND, UPDATE_DEDUP_SIZE, UPDATE_DEDUP_WINDOW
+from src.db import session_scope
+from src.metrics import REGISTRY
+from src.models import ProcessedUpdate
+
+UPDATES_DEDUPLICATED = REGISTRY.counter(
+    "updates_deduplicated_total", "Redelivered updates dropped before any handler ran, by where they were known",
+    ["layer"])
+
+class UpdateDeduplicator:
+    def __init__(self, backend: str = UPDATE_DEDUP_BACKEND, size: int = UPDATE_DEDUP_SIZE,
+                 window: float = UPDATE_DEDUP_WINDOW):
+        if backend not in ("memory", "db"):
+            raise ValueError(f"Unknown UPDATE_DEDUP_BACKEND {backend!r}, expected 'memory' or 'db'")
+        self.backend = backend
+        self.window = window
+        self.seen = TTLCache(size, window)
+
+    def _insert(self, dialect_name):
+        if dialect_name == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+        # A conflict returns no row
+        return (insert(ProcessedUpdate).on_conflict_do_nothing(index_elements=[ProcessedUpdate.update_id])
+                .returning(ProcessedUpdate.update_id))
+
+    async def is_duplicate(self, update_id: int) -> bool:
+        """Record ``update_id`` as handled; True if it already was."""
+        if self.seen.get(update_id) is not None:
+            UPDATES_DEDUPLICATED.inc(layer="memory")
+            return True
+        self.seen.set(update_id, True)
+        if self.backend != "db":
+            return False
+
+        # Its own short transaction: the mark must stick even if the handler fails
+        async with session_scope() as session:
+            result = await session.execute(
+                self._insert(session.bind.dialect.name),
+                {"update_id": update_id, "processed_at": datetime.now(timezone.utc)},
+            )
+            inserted = result.scalar() is not None
+        if not inserted:
+            UPDATES_DEDUPLICATED.inc(layer="db")
+            return True
+        return False
+
+    async def evict_expired(self):
+        """Forget update ids older than the window; returns how many rows were dropped."""
+        if self.backend != "db":
+            # The LRU expires entries by itself
+            return 0
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=self.window)
+        async with session_scope() as session:
+            result = await session.execute(delete(ProcessedUpdate).where(ProcessedUpdate.processed_at < cutoff))
+        return result.rowcount
+
+deduplicator = UpdateDeduplicator()
+
+REGISTRY.gauge("updates_dedup_cache_size", "Update ids remembered in memory", lambda: len(deduplicator.seen))
+
+async def drop_duplicate_updates(update: Update, context):
+    if await deduplicator.is_duplicate(update.update_id):
+        raise ApplicationHandlerStop
+
+def dedup_handler():
+    """TypeHandler to add in group -1, ahead of every other handler."""
+    return TypeHandler(Update, drop_duplicate_updates)
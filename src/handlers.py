@@ -1,11 +1,36 @@
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import ContextTypes, CommandHandler, MessageHandler, CallbackQueryHandler, filters
-from src.auth import create_user, get_user_by_telegram_id, verify_pattern_lock
-from src.notes import create_note, get_user_notes, get_note_by_id, update_note, delete_note
+import asyncio
+import logging
+import tempfile
+from datetime import date
+from telegram import (Update, InlineKeyboardButton, InlineKeyboardMarkup, InlineQueryResultArticle,
+                      InlineQueryResultsButton, InputTextMessageContent)
+from telegram.constants import MessageLimit
+from telegram.ext import (ContextTypes, CommandHandler, MessageHandler, CallbackQueryHandler, InlineQueryHandler,
+                          filters)
+from src.auth import (create_user, get_user_by_telegram_id, verify_pattern_lock, is_locked_out,
+                      set_pattern_lock, set_locked, clear_blocked)
+from src.broadcast import create_broadcast, recent_broadcasts
+from src.notes import (create_note, get_user_notes_page, get_note_by_id, get_note_contents, update_note, delete_note,
+                       search_notes, export_notes, import_notes)
+from src.admin import list_users, user_stats, export_users_csv
+from src.revisions import list_revisions, get_revision
+from src.reminders import add_reminder, note_reminders, clear_reminders, parse_reminder_time, format_local
+from src.db import with_session
+from src.state import create_state_store
+from src.router import CallbackRouter
+from src.keyboards import Keyboards
+from src.render import render_cache
+from src.metrics import REGISTRY, instrument_handler
+from src.title_index import get_index
 import src.config as config
 
+logger = logging.getLogger(__name__)
+
 # Store user states for conversation flow
-user_states = {}
+user_states = create_state_store()
+
+# Inline keyboard actions; the routing table is at the bottom of this module
+router = CallbackRouter()
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /start command and set admin if not already set"""
@@ -27,6 +52,9 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = await get_user_by_telegram_id(telegram_id)
     if not user:
         user = await create_user(telegram_id, username)
+    elif user.blocked_at is not None:
+        # They're talking to the bot again, so they have unblocked it
+        await clear_blocked(user)
     
     if not user.pattern_lock:
         # First time user - need to set pattern lock
@@ -40,21 +68,8 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def show_pattern_setup(update: Update, context: ContextTypes.DEFAULT_TYPE, user):
     """Show pattern setup screen for first-time users"""
-    print(f"DEBUG: Showing pattern setup for user {user.username}")
-    keyboard = [
-        [InlineKeyboardButton("1", callback_data="pattern_1"),
-         InlineKeyboardButton("2", callback_data="pattern_2"),
-         InlineKeyboardButton("3", callback_data="pattern_3")],
-        [InlineKeyboardButton("4", callback_data="pattern_4"),
-         InlineKeyboardButton("5", callback_data="pattern_5"),
-         InlineKeyboardButton("6", callback_data="pattern_6")],
-        [InlineKeyboardButton("7", callback_data="pattern_7"),
-         InlineKeyboardButton("8", callback_data="pattern_8"),
-         InlineKeyboardButton("9", callback_data="pattern_9")],
-        [InlineKeyboardButton("🔒 Set Pattern", callback_data="set_pattern")]
-    ]
-    
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    logger.debug("Showing pattern setup for user %s", user.username)
+    reply_markup = keyboards.pattern_setup
     await update.message.reply_text(
         "📱 Welcome to NotePad!\n\n"
         "🔐 First, set your pattern lock:\n"
@@ -65,42 +80,37 @@ async def show_pattern_setup(update: Update, context: ContextTypes.DEFAULT_TYPE,
     )
     
     # Store user state
-    user_states[user.id] = "setting_pattern"
+    await user_states.set(user.id, "setting_pattern")
     context.user_data['temp_pattern'] = ""
-    print(f"DEBUG: Pattern setup displayed, user state set to 'setting_pattern'")
+    logger.debug("Pattern setup displayed, user state set to 'setting_pattern'")
 
 async def show_pattern_lock(update: Update, context: ContextTypes.DEFAULT_TYPE, user):
     """Show pattern lock screen for locked users"""
-    keyboard = [
-        [InlineKeyboardButton("🔓 Unlock", callback_data="unlock_pattern")]
-    ]
-    
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    await update.message.reply_text(
-        "📱 NotePad is locked\n\n"
-        "🔐 Enter your pattern to unlock:\n\n"
-        "Current pattern: " + context.user_data.get('temp_pattern', ''),
-        reply_markup=reply_markup
-    )
-    
+    reply_markup = keyboards.pattern_lock
+    text = ("📱 NotePad is locked\n\n"
+            "🔐 Enter your pattern to unlock:\n\n"
+            "Current pattern: ")
+    if update.callback_query:
+        # Sent as a new message: the tapped one was just edited to "Device locked!"
+        await update.callback_query.message.reply_text(text, reply_markup=reply_markup)
+    else:
+        await update.message.reply_text(text, reply_markup=reply_markup)
+
     # Store user state
-    user_states[user.id] = "unlocking"
-    context.user_data['temp_pattern'] = ""
+    await user_states.set(user.id, "unlocking")
+    context.user_data['unlock_pattern'] = ""
 
 async def show_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE, user):
     """Show main menu when user is unlocked"""
-    keyboard = [
-        [InlineKeyboardButton("📝 New Note", callback_data="new_note")],
-        [InlineKeyboardButton("📚 My Notes", callback_data="list_notes")],
-        [InlineKeyboardButton("⚙️ Settings", callback_data="settings")],
-        [InlineKeyboardButton("🔒 Lock", callback_data="lock_device")]
-    ]
-    
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    # Back at the menu, so any unfinished flow (new note, edit, ...) is abandoned
+    if await user_states.get(user.id) is not None:
+        await user_states.delete(user.id)
+
+    reply_markup = keyboards.main_menu
     
     # Check if this is a callback query or message
     if update.callback_query:
-        await update.callback_query.edit_message_text(
+        await render_cache.edit(update.callback_query,
             "📱 NotePad - Main Menu\n\n"
             "Welcome back, " + user.username + "!\n"
             "What would you like to do?",
@@ -114,55 +124,94 @@ async def show_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE, use
             reply_markup=reply_markup
         )
 
-async def handle_pattern_setup(update: Update, context: ContextTypes.DEFAULT_TYPE, user):
-    """Handle pattern setup button presses"""
+async def handle_pattern_digit(update: Update, context: ContextTypes.DEFAULT_TYPE, user, digit):
+    """Handle a number tap on the pattern setup keyboard"""
     query = update.callback_query
-    print(f"DEBUG: Pattern setup called with: {query.data}")
+    logger.debug("Pattern setup called with digit %s", digit)
     await query.answer()
     
-    if query.data.startswith("pattern_"):
-        number = query.data.split("_")[1]
-        current_pattern = context.user_data.get('temp_pattern', "")
-        if number not in current_pattern:
-            context.user_data['temp_pattern'] = current_pattern + number
-            await query.edit_message_text(
-                "📱 Welcome to NotePad!\n\n"
-                "🔐 First, set your pattern lock:\n"
-                "• Tap the numbers in your desired pattern\n"
-                "• Then tap 'Set Pattern' to confirm\n\n"
-                "Current pattern: " + context.user_data['temp_pattern'],
-                reply_markup=query.message.reply_markup
-            )
-    
-    elif query.data == "set_pattern":
-        pattern = context.user_data.get('temp_pattern', "")
-        if len(pattern) >= 4:
-            await query.edit_message_text("✅ Pattern lock set successfully!")
-            await show_main_menu(update, context, user)
-        else:
-            await query.answer("❌ Pattern must be at least 4 digits!")
+    number = str(digit)
+    current_pattern = context.user_data.get('temp_pattern', "")
+    if number not in current_pattern:
+        context.user_data['temp_pattern'] = current_pattern + number
+        await render_cache.edit(query,
+            "📱 Welcome to NotePad!\n\n"
+            "🔐 First, set your pattern lock:\n"
+            "• Tap the numbers in your desired pattern\n"
+            "• Then tap 'Set Pattern' to confirm\n\n"
+            "Current pattern: " + context.user_data['temp_pattern'],
+            reply_markup=keyboards.pattern_setup
+        )
+
+async def handle_set_pattern(update: Update, context: ContextTypes.DEFAULT_TYPE, user):
+    """Handle the 'Set Pattern' button"""
+    query = update.callback_query
+    if user.pattern_lock:
+        # Setup screens left in the chat can't replace an existing pattern
+        await query.answer("❌ A pattern is already set. Change it from Settings.")
+        return
+    pattern = context.user_data.get('temp_pattern', "")
+    if len(pattern) >= 4:
+        await query.answer()
+        await set_pattern_lock(user, pattern)
+        context.user_data.pop('temp_pattern', None)
+        await render_cache.edit(query, "✅ Pattern lock set successfully!")
+        await show_main_menu(update, context, user)
+    else:
+        await query.answer("❌ Pattern must be at least 4 digits!")
+
+async def handle_lock_device(update: Update, context: ContextTypes.DEFAULT_TYPE, user):
+    """Handle the 'Lock' main menu button"""
+    await set_locked(user, True)
+    await render_cache.edit(update.callback_query, "🔒 Device locked!")
+    await show_pattern_lock(update, context, user)
 
-async def handle_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE, user):
-    """Handle main menu button presses"""
+async def handle_unlock_digit(update: Update, context: ContextTypes.DEFAULT_TYPE, user, digit):
+    """Handle a number tap on the pattern lock keyboard"""
     query = update.callback_query
     await query.answer()
-    
-    if query.data == "new_note":
-        await show_new_note_form(update, context, user)
-    elif query.data == "list_notes":
-        await show_user_notes(update, context, user)
-    elif query.data == "settings":
-        await show_settings(update, context, user)
-    elif query.data == "lock_device":
-        await query.edit_message_text("🔒 Device locked!")
-        await show_pattern_lock(update, context, user)
+
+    number = str(digit)
+    current_pattern = context.user_data.get('unlock_pattern', "")
+    if number not in current_pattern:
+        context.user_data['unlock_pattern'] = current_pattern + number
+        await render_cache.edit(query,
+            "📱 NotePad is locked\n\n"
+            "🔐 Enter your pattern to unlock:\n\n"
+            "Current pattern: " + "•" * len(context.user_data['unlock_pattern']),
+            reply_markup=keyboards.pattern_lock
+        )
+
+async def handle_unlock(update: Update, context: ContextTypes.DEFAULT_TYPE, user):
+    """Handle the 'Unlock' button: check the entered pattern"""
+    query = update.callback_query
+    pattern = context.user_data.pop('unlock_pattern', "")
+    if not pattern:
+        # Pattern lock screens sent before digit entry existed
+        await show_locked_message(update, context, user)
+        return
+
+    if await verify_pattern_lock(user, pattern):
+        await query.answer("🔓 Unlocked")
+        await set_locked(user, False)
+        await show_main_menu(update, context, user)
+        return
+    if is_locked_out(user.id):
+        await query.answer("⏳ Too many wrong patterns. Try again later.", show_alert=True)
+    else:
+        await query.answer("❌ Wrong pattern!")
+    await render_cache.edit(query,
+        "📱 NotePad is locked\n\n"
+        "🔐 Enter your pattern to unlock:\n\n"
+        "Current pattern: ",
+        reply_markup=keyboards.pattern_lock
+    )
 
 async def show_new_note_form(update: Update, context: ContextTypes.DEFAULT_TYPE, user):
     """Show form to create a new note"""
-    keyboard = [[InlineKeyboardButton("❌ Cancel", callback_data="back_to_menu")]]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    reply_markup = keyboards.new_note
     
-    await update.callback_query.edit_message_text(
+    await render_cache.edit(update.callback_query,
         "📝 Create New Note\n\n"
         "Please send your note in this format:\n"
         "Title: [Your title here]\n"
@@ -171,16 +220,20 @@ async def show_new_note_form(update: Update, context: ContextTypes.DEFAULT_TYPE,
         reply_markup=reply_markup
     )
     
-    user_states[user.id] = "creating_note"
+    await user_states.set(user.id, "creating_note")
+
+async def show_user_notes(update: Update, context: ContextTypes.DEFAULT_TYPE, user, updated_at=None, note_id=None,
+                          before=False):
+    """Show one page of the user's notes, anchored on the note a Prev/Next button names"""
+    cursor = (updated_at, note_id) if note_id is not None else None
+    notes, prev_cursor, next_cursor = await get_user_notes_page(user.id, cursor, before)
+    if not notes and cursor is not None:
+        # Every note past the anchor is gone; start again from the top
+        notes, prev_cursor, next_cursor = await get_user_notes_page(user.id)
 
-async def show_user_notes(update: Update, context: ContextTypes.DEFAULT_TYPE, user):
-    """Show list of user's notes"""
-    notes = await get_user_notes(user.id)
-    
     if not notes:
-        keyboard = [[InlineKeyboardButton("🔙 Back", callback_data="back_to_menu")]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await update.callback_query.edit_message_text(
+        reply_markup = keyboards.back_to_menu
+        await render_cache.edit(update.callback_query,
             "📚 My Notes\n\n"
             "You don't have any notes yet.\n"
             "Create your first note!",
@@ -193,47 +246,309 @@ async def show_user_notes(update: Update, context: ContextTypes.DEFAULT_TYPE, us
     
     for note in notes:
         text += f"📝 {note.title}\n"
-        text += f"   {note.content[:50]}{'...' if len(note.content) > 50 else ''}\n"
+        text += f"   {note.preview}{'...' if note.content_length > len(note.preview) else ''}\n"
         text += f"   📅 {note.updated_at.strftime('%Y-%m-%d %H:%M')}\n\n"
         
         keyboard.append([
-            InlineKeyboardButton(f"📖 {note.title}", callback_data=f"view_note_{note.id}"),
-            InlineKeyboardButton(f"✏️ Edit", callback_data=f"edit_note_{note.id}"),
-            InlineKeyboardButton(f"🗑️ Delete", callback_data=f"delete_note_{note.id}")
+            InlineKeyboardButton(f"📖 {note.title}", callback_data=router.encode("view_note", note.id)),
+            InlineKeyboardButton(f"✏️ Edit", callback_data=router.encode("edit_note", note.id)),
+            InlineKeyboardButton(f"🗑️ Delete", callback_data=router.encode("delete_note", note.id))
         ])
     
-    keyboard.append([InlineKeyboardButton("🔙 Back", callback_data="back_to_menu")])
+    pager = []
+    if prev_cursor is not None:
+        pager.append(InlineKeyboardButton("⬅️ Prev", callback_data=router.encode("notes_prev", *prev_cursor)))
+    if next_cursor is not None:
+        pager.append(InlineKeyboardButton("Next ➡️", callback_data=router.encode("notes_next", *next_cursor)))
+    if pager:
+        keyboard.append(pager)
+    keyboard.append([keyboards.back_to_menu_button])
     reply_markup = InlineKeyboardMarkup(keyboard)
     
-    await update.callback_query.edit_message_text(text, reply_markup=reply_markup)
+    await render_cache.edit(update.callback_query, text, reply_markup=reply_markup)
 
-async def show_settings(update: Update, context: ContextTypes.DEFAULT_TYPE, user):
-    """Show settings menu"""
-    keyboard = [
-        [InlineKeyboardButton("🔐 Change Pattern", callback_data="change_pattern")],
-        [InlineKeyboardButton("🔙 Back", callback_data="back_to_menu")]
+async def search_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /search <terms>"""
+    user = await get_user_by_telegram_id(str(update.effective_user.id))
+    if not user:
+        await update.message.reply_text("Please send /start first.")
+        return
+    if user.is_locked:
+        await update.message.reply_text("🔒 NotePad is locked. Send /start to unlock it first.")
+        return
+
+    terms = " ".join(context.args)
+    if not terms.strip():
+        await update.message.reply_text("🔍 Usage: /search <words to find>")
+        return
+
+    # Later pages are requested by button, which can only carry the offset
+    context.user_data['search_terms'] = terms
+    await show_search_results(update, context, user, 0)
+
+INLINE_LOOKUPS_CANCELLED = REGISTRY.counter(
+    "inline_lookups_cancelled_total", "Inline query lookups dropped because the user had typed on")
+
+# The lookup answering each user's latest inline query, by Telegram user id
+_inline_lookups = {}
+
+async def handle_inline_query(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle @bot <prefix>: the user's notes whose title starts with it, to share in any chat"""
+    query = update.inline_query
+    user_id = query.from_user.id
+    # Queries arrive on every keystroke; only the newest one is still worth answering
+    previous = _inline_lookups.get(user_id)
+    if previous is not None:
+        previous.cancel()
+    lookup = _inline_lookups[user_id] = asyncio.create_task(answer_inline_query(query))
+    try:
+        await lookup
+    except asyncio.CancelledError:
+        if asyncio.current_task().cancelling():
+            raise
+        INLINE_LOOKUPS_CANCELLED.inc()
+    finally:
+        if _inline_lookups.get(user_id) is lookup:
+            del _inline_lookups[user_id]
+
+async def answer_inline_query(query):
+    user = await get_user_by_telegram_id(str(query.from_user.id))
+    if not user or user.is_locked:
+        # Nothing to show, but a button that opens the bot; not cached, so it goes once they're in
+        button = InlineQueryResultsButton(text="🔒 Unlock NotePad" if user else "📝 Open NotePad",
+                                          start_parameter="inline")
+        await query.answer([], cache_time=0, is_personal=True, button=button)
+        return
+
+    offset = int(query.offset or 0)
+    index = await get_index(user.id)
+    notes, has_more = index.find(query.query, offset, config.INLINE_RESULTS)
+    # Only the notes on this page are read from the database
+    contents = await get_note_contents(user.id, [note_id for note_id, _, _ in notes])
+    results = [
+        InlineQueryResultArticle(
+            id=str(note_id),
+            title=title,
+            description=preview,
+            input_message_content=InputTextMessageContent(
+                f"📝 {title}\n\n{contents[note_id]}"[:MessageLimit.MAX_TEXT_LENGTH]
+            ),
+        )
+        for note_id, title, preview in notes
+        if note_id in contents
     ]
+    # Personal, so a cached answer is never shown to anyone else
+    await query.answer(results, cache_time=config.INLINE_CACHE_TIME, is_personal=True,
+                       next_offset=str(offset + len(notes)) if has_more else "")
+
+async def export_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /export: send all of the user's notes as a gzip JSON lines file"""
+    user = await get_user_by_telegram_id(str(update.effective_user.id))
+    if not user:
+        await update.message.reply_text("Please send /start first.")
+        return
+    if user.is_locked:
+        await update.message.reply_text("🔒 NotePad is locked. Send /start to unlock it first.")
+        return
+
+    # Spills to disk past 1 MB while it's written; only the compressed result is read
+    # back whole, for the upload
+    with tempfile.SpooledTemporaryFile(max_size=1024 * 1024) as out:
+        count = await export_notes(user.id, out)
+        if not count:
+            await update.message.reply_text("📭 You have no notes to export.")
+            return
+        out.seek(0)
+        await update.message.reply_document(
+            out.read(), filename=f"notes-{date.today().isoformat()}.jsonl.gz",
+            caption=f"📦 {count} notes exported. Send /import and then this file to restore them."
+        )
+
+async def import_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /import: wait for an export file"""
+    user = await get_user_by_telegram_id(str(update.effective_user.id))
+    if not user:
+        await update.message.reply_text("Please send /start first.")
+        return
+    if user.is_locked:
+        await update.message.reply_text("🔒 NotePad is locked. Send /start to unlock it first.")
+        return
+
+    await user_states.set(user.id, "importing")
+    await update.message.reply_text(
+        "📥 Import Notes\n\n"
+        "Send a file made by /export. Its notes are added to the ones you already have.\n"
+        "Type 'cancel' to stop."
+    )
+
+async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle an uploaded file: the notes to import after /import"""
+    user = await get_user_by_telegram_id(str(update.effective_user.id))
+    if not user or await user_states.get(user.id) != "importing":
+        await update.message.reply_text("📎 To import notes from a file, send /import first.")
+        return
+
+    document = update.message.document
+    if document.file_size and document.file_size > config.IMPORT_MAX_BYTES:
+        await update.message.reply_text(
+            f"❌ That file is too large; imports are limited to {config.IMPORT_MAX_BYTES // (1024 * 1024)} MB.")
+        return
+
+    with tempfile.SpooledTemporaryFile(max_size=1024 * 1024) as upload:
+        file = await document.get_file()
+        await file.download_to_memory(upload)
+        upload.seek(0)
+        try:
+            count = await import_notes(user.id, upload)
+        except ValueError as e:
+            await update.message.reply_text(f"❌ Import failed: {e}. No notes were imported.")
+            return
+    await user_states.delete(user.id)
+    await update.message.reply_text(f"✅ Imported {count} notes.")
+
+def _users_page_text(users):
+    text = "👥 Registered Users\n\n"
+    for u in users:
+        flags = (" 👑" if u.is_admin else "") + (" 🔒" if u.is_locked else "")
+        text += f"{u.id}. @{u.username or '-'} ({u.telegram_id}){flags}\n"
+        text += f"   📝 {u.notes} notes · joined {u.created_at.strftime('%Y-%m-%d') if u.created_at else '?'}\n"
+    return text
+
+async def users_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /users: the first page of the admin user listing"""
+    user = await get_user_by_telegram_id(str(update.effective_user.id))
+    if not user or not user.is_admin:
+        await update.message.reply_text("You are not admin.")
+        return
+
+    users, prev_cursor, next_cursor = await list_users()
+    await update.message.reply_text(_users_page_text(users),
+                                    reply_markup=keyboards.users_page(prev_cursor, next_cursor))
+
+async def show_users_page(update: Update, context: ContextTypes.DEFAULT_TYPE, user, cursor=None, before=False):
+    """Show one page of the admin user listing"""
+    users, prev_cursor, next_cursor = await list_users(cursor, before)
+    if not users and cursor is not None:
+        users, prev_cursor, next_cursor = await list_users()
+    await render_cache.edit(update.callback_query, _users_page_text(users),
+                            reply_markup=keyboards.users_page(prev_cursor, next_cursor))
+
+async def show_user_stats(update: Update, context: ContextTypes.DEFAULT_TYPE, user):
+    """Show aggregate user and note statistics"""
+    stats = await user_stats()
+    await render_cache.edit(update.callback_query,
+        "📊 User Statistics\n\n"
+        f"👥 Users: {stats['users']} ({stats['admins']} admins, {stats['locked']} locked)\n"
+        f"🆕 Joined in the last {stats['active_days']} days: {stats['new_users']}\n"
+        f"✍️ Active in the last {stats['active_days']} days: {stats['active_users']}\n\n"
+        f"📝 Notes: {stats['notes']} from {stats['users_with_notes']} users\n"
+        f"📈 Per user: {stats['notes_per_user']:.1f} on average, {stats['most_notes']} at most",
+        reply_markup=keyboards.user_stats
+    )
+
+async def send_users_csv(update: Update, context: ContextTypes.DEFAULT_TYPE, user):
+    """Send every user as a CSV document"""
+    with tempfile.SpooledTemporaryFile(max_size=1024 * 1024) as out:
+        count = await export_users_csv(out)
+        out.seek(0)
+        await update.callback_query.message.reply_document(
+            out.read(), filename=f"users-{date.today().isoformat()}.csv", caption=f"👥 {count} users"
+        )
+
+async def broadcast_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /broadcast <message>: send a message to every user (admins only)"""
+    user = await get_user_by_telegram_id(str(update.effective_user.id))
+    if not user or not user.is_admin:
+        await update.message.reply_text("You are not admin.")
+        return
+
+    # Everything after the command (CommandHandler saw it as the first entity), however it
+    # is separated from it; the command is ASCII, so its UTF-16 length is its length here
+    command = update.message.entities[0]
+    text = update.message.text[command.offset + command.length:].strip()
+    if not text:
+        lines = ["📣 Usage: /broadcast <message>", ""]
+        for broadcast, counts in await recent_broadcasts():
+            lines.append(
+                f"#{broadcast.id} {broadcast.status} · ✅ {counts.get('sent', 0)} "
+                f"🚫 {counts.get('blocked', 0)} ❌ {counts.get('failed', 0)} · {broadcast.text[:30]}"
+            )
+        await update.message.reply_text("\n".join(lines))
+        return
+
+    broadcast = await create_broadcast(context.bot, text, user.id)
+    await update.message.reply_text(
+        f"📣 Broadcast #{broadcast.id} started. You'll get a summary when it finishes; "
+        "send /broadcast to check on it."
+    )
+
+def _admin_only(show, **kwargs):
+    """Run ``show`` for admins; anyone else just gets the tap answered"""
+    async def handler(update: Update, context: ContextTypes.DEFAULT_TYPE, user, *values):
+        if not user.is_admin:
+            await update.callback_query.answer("❌ Admins only")
+            return
+        await update.callback_query.answer()
+        await show(update, context, user, *values, **kwargs)
+    return handler
+
+async def show_search_results(update: Update, context: ContextTypes.DEFAULT_TYPE, user, offset):
+    """Show one page of /search results"""
+    terms = context.user_data.get('search_terms', "")
+    notes, has_more = await search_notes(user.id, terms, offset)
+
+    if not notes:
+        text = f"🔍 No notes match \"{terms}\"."
+    else:
+        text = f"🔍 Results for \"{terms}\":\n\n"
+    keyboard = []
+    for note in notes:
+        text += f"📝 {note.title}\n"
+        text += f"   {note.preview}{'...' if note.content_length > len(note.preview) else ''}\n\n"
+        keyboard.append([InlineKeyboardButton(f"📖 {note.title}", callback_data=router.encode("view_note", note.id))])
+
+    pager = []
+    if offset > 0:
+        prev_offset = max(offset - config.NOTES_PAGE_SIZE, 0)
+        pager.append(InlineKeyboardButton("⬅️ Prev", callback_data=router.encode("search_page", prev_offset)))
+    if has_more:
+        pager.append(InlineKeyboardButton("Next ➡️", callback_data=router.encode("search_page", offset + len(notes))))
+    if pager:
+        keyboard.append(pager)
+    keyboard.append([keyboards.back_to_menu_button])
     reply_markup = InlineKeyboardMarkup(keyboard)
+
+    if update.callback_query:
+        await render_cache.edit(update.callback_query, text, reply_markup=reply_markup)
+    else:
+        await update.message.reply_text(text, reply_markup=reply_markup)
+
+async def show_settings(update: Update, context: ContextTypes.DEFAULT_TYPE, user):
+    """Show settings menu"""
+    reply_markup = keyboards.settings
     
-    await update.callback_query.edit_message_text(
+    await render_cache.edit(update.callback_query,
         "⚙️ Settings\n\n"
         "Manage your NotePad settings:",
         reply_markup=reply_markup
     )
 
 async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Handle text messages for note creation"""
+    """Handle text messages for note creation and editing"""
     telegram_id = str(update.effective_user.id)
     user = await get_user_by_telegram_id(telegram_id)
     
-    if not user or user.id not in user_states:
+    if not user:
+        return
+    state = await user_states.get(user.id)
+    if state is None:
         return
     
-    if user_states[user.id] == "creating_note":
+    if state == "creating_note":
         text = update.message.text
         
         if text.lower() == "cancel":
-            user_states.pop(user.id, None)
+            await user_states.delete(user.id)
             await update.message.reply_text("❌ Note creation cancelled.")
             return
         
@@ -244,8 +559,12 @@ async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE
                 content_part = text.split("content:")[1].strip()
                 
                 if title_part and content_part:
-                    note = await create_note(user.id, title_part, content_part)
-                    user_states.pop(user.id, None)
+                    # Keyed by the message (its id is only unique within its chat), so a
+                    # redelivered message can't create the note twice
+                    message = update.message
+                    note = await create_note(user.id, title_part, content_part,
+                                             idempotency_key=f"msg:{message.chat_id}:{message.message_id}")
+                    await user_states.delete(user.id)
                     await update.message.reply_text(
                         f"✅ Note created successfully!\n\n"
                         f"📝 Title: {note.title}\n"
@@ -258,43 +577,87 @@ async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE
         else:
             await update.message.reply_text("❌ Please use the format:\nTitle: [title]\nContent: [content]")
 
+    elif state == "importing":
+        if update.message.text.lower() == "cancel":
+            await user_states.delete(user.id)
+            await update.message.reply_text("❌ Import cancelled.")
+        else:
+            await update.message.reply_text("📎 Please send the export as a file, or type 'cancel'.")
+
+    elif state.startswith("reminding_note_"):
+        note_id = int(state[len("reminding_note_"):])
+        text = update.message.text
+
+        if text.lower() == "cancel":
+            await user_states.delete(user.id)
+            await update.message.reply_text("❌ Reminder cancelled.")
+            return
+
+        due_at = parse_reminder_time(text)
+        if due_at is None:
+            await update.message.reply_text(
+                "❌ Please send a future time like 18:00, 2026-10-20 09:00, in 30m or in 2h, or 'cancel'."
+            )
+            return
+        note = await get_note_by_id(note_id, user.id)
+        if not note:
+            await user_states.delete(user.id)
+            await update.message.reply_text("❌ Note not found!")
+            return
+        try:
+            await add_reminder(user, note.id, due_at)
+        except ValueError as e:
+            await update.message.reply_text(f"❌ {str(e).capitalize()}.")
+            return
+        await user_states.delete(user.id)
+        await update.message.reply_text(
+            f"⏰ I'll remind you about \"{note.title}\" on {format_local(due_at)} ({config.REMINDER_TIMEZONE})."
+        )
+
+    elif state.startswith("editing_note_"):
+        note_id = int(state[len("editing_note_"):])
+        text = update.message.text
+
+        if text.lower() == "cancel":
+            await user_states.delete(user.id)
+            await update.message.reply_text("❌ Editing cancelled.")
+            return
+
+        note = await get_note_by_id(note_id, user.id)
+        if note:
+            note = await update_note(note_id, user.id, note.title, text)
+        await user_states.delete(user.id)
+        if not note:
+            await update.message.reply_text("❌ Note not found!")
+            return
+        await update.message.reply_text(
+            f"✅ Note updated successfully!\n\n"
+            f"📝 Title: {note.title}\n"
+            f"📄 Content: {note.content[:100]}{'...' if len(note.content) > 100 else ''}"
+        )
+
+# The only buttons a locked notepad answers
+UNLOCK_ACTIONS = frozenset({"unlock_digit", "unlock_pattern"})
+
 async def handle_callback_query(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle all callback queries"""
-    print("DEBUG: handle_callback_query function called!")
     query = update.callback_query
-    print(f"DEBUG: Received callback: {query.data}")
+    logger.debug("Received callback: %s", query.data)
     telegram_id = str(query.from_user.id)
     user = await get_user_by_telegram_id(telegram_id)
     
     if not user:
         await query.answer("❌ User not found!")
         return
-    
-    # Handle different callback types
-    if query.data.startswith("pattern_"):
-        await handle_pattern_setup(update, context, user)
-    elif query.data == "set_pattern":
-        await handle_pattern_setup(update, context, user)
-    elif query.data == "unlock_pattern":
-        await show_locked_message(update, context)
-    elif query.data in ["new_note", "list_notes", "settings", "lock_device"]:
-        await handle_main_menu(update, context, user)
-    elif query.data == "back_to_menu":
-        await show_main_menu(update, context, user)
-    elif query.data.startswith("view_note_"):
-        note_id = int(query.data.split("_")[2])
-        await show_note_details(update, context, user, note_id)
-    elif query.data.startswith("edit_note_"):
-        note_id = int(query.data.split("_")[2])
-        await show_edit_note_form(update, context, user, note_id)
-    elif query.data.startswith("delete_note_"):
-        note_id = int(query.data.split("_")[2])
-        await delete_note_confirmation(update, context, user, note_id)
-    elif query.data == "change_pattern":
-        await show_pattern_change(update, context, user)
-    else:
-        # Debug: log unknown callback data
-        print(f"Unknown callback data: {query.data}")
+
+    if user.is_locked:
+        # Buttons on older messages must not get past the lock
+        if not await router.dispatch(update, context, user, allow=UNLOCK_ACTIONS):
+            await query.answer("🔒 NotePad is locked. Enter your pattern to unlock it.", show_alert=True)
+        return
+
+    if not await router.dispatch(update, context, user):
+        logger.warning("Unknown callback data: %s", query.data)
         await query.answer("❌ Unknown action!")
 
 async def show_note_details(update: Update, context: ContextTypes.DEFAULT_TYPE, user, note_id):
@@ -304,14 +667,9 @@ async def show_note_details(update: Update, context: ContextTypes.DEFAULT_TYPE,
         await update.callback_query.answer("❌ Note not found!")
         return
     
-    keyboard = [
-        [InlineKeyboardButton("✏️ Edit", callback_data=f"edit_note_{note.id}")],
-        [InlineKeyboardButton("🗑️ Delete", callback_data=f"delete_note_{note.id}")],
-        [InlineKeyboardButton("🔙 Back", callback_data="list_notes")]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    reply_markup = keyboards.note_details(note.id)
     
-    await update.callback_query.edit_message_text(
+    await render_cache.edit(update.callback_query,
         f"📖 {note.title}\n\n"
         f"📄 {note.content}\n\n"
         f"📅 Created: {note.created_at.strftime('%Y-%m-%d %H:%M')}\n"
@@ -326,17 +684,85 @@ async def show_edit_note_form(update: Update, context: ContextTypes.DEFAULT_TYPE
         await update.callback_query.answer("❌ Note not found!")
         return
     
-    keyboard = [[InlineKeyboardButton("❌ Cancel", callback_data=f"view_note_{note.id}")]]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    reply_markup = keyboards.edit_note(note.id)
     
-    await update.callback_query.edit_message_text(
+    await render_cache.edit(update.callback_query,
         f"✏️ Edit Note: {note.title}\n\n"
         f"Current content:\n{note.content}\n\n"
         f"Send your new content, or 'cancel' to go back.",
         reply_markup=reply_markup
     )
     
-    user_states[user.id] = f"editing_note_{note_id}"
+    await user_states.set(user.id, f"editing_note_{note_id}")
+
+async def show_reminder_form(update: Update, context: ContextTypes.DEFAULT_TYPE, user, note_id):
+    """Ask when to be reminded about a note, listing the reminders it already has"""
+    note = await get_note_by_id(note_id, user.id)
+    if not note:
+        await update.callback_query.answer("❌ Note not found!")
+        return
+
+    pending = await note_reminders(user.id, note.id)
+    text = f"⏰ Remind me about: {note.title}\n\n"
+    if pending:
+        text += "Pending:\n" + "".join(f"• {format_local(due_at)}\n" for due_at in pending[:10]) + "\n"
+    text += (
+        "Send a time, e.g. 18:00, 2026-10-20 09:00, in 30m, in 2h or in 1d "
+        f"({config.REMINDER_TIMEZONE}).\n"
+        "Or send 'cancel' to go back."
+    )
+    await render_cache.edit(update.callback_query, text,
+                            reply_markup=keyboards.reminder_form(note.id, bool(pending)))
+    await user_states.set(user.id, f"reminding_note_{note.id}")
+
+async def handle_clear_reminders(update: Update, context: ContextTypes.DEFAULT_TYPE, user, note_id):
+    """Delete every pending reminder on a note"""
+    cleared = await clear_reminders(user.id, note_id)
+    await update.callback_query.answer(f"🔕 {cleared} reminder(s) cleared")
+    await show_reminder_form(update, context, user, note_id)
+
+async def show_note_history(update: Update, context: ContextTypes.DEFAULT_TYPE, user, note_id, before=0):
+    """List a note's earlier versions, newest first"""
+    note = await get_note_by_id(note_id, user.id)
+    if not note:
+        await update.callback_query.answer("❌ Note not found!")
+        return
+
+    revisions, has_more = await list_revisions(user.id, note.id, before or None)
+    if not revisions:
+        text = f"🕘 History: {note.title}\n\nThis note hasn't been edited yet."
+    else:
+        text = f"🕘 History: {note.title}\n\nEarlier versions, newest first. Tap one to view or restore it."
+    buttons = [
+        (r.id, f"#{r.revision} · {r.saved_at.strftime('%Y-%m-%d %H:%M') if r.saved_at else '?'} · {r.title[:30]}")
+        for r in revisions
+    ]
+    await render_cache.edit(update.callback_query, text, reply_markup=keyboards.note_history(
+        note.id, buttons, revisions[-1].revision if has_more else None))
+
+async def show_revision(update: Update, context: ContextTypes.DEFAULT_TYPE, user, revision_id):
+    """Show one earlier version of a note"""
+    revision = await get_revision(user.id, revision_id)
+    if not revision:
+        await update.callback_query.answer("❌ Version not found!")
+        return
+
+    saved_at = revision["saved_at"].strftime("%Y-%m-%d %H:%M") if revision["saved_at"] else "?"
+    text = f"🕘 Version #{revision['revision']} from {saved_at}\n\n📖 {revision['title']}\n\n📄 {revision['content']}"
+    if len(text) > MessageLimit.MAX_TEXT_LENGTH:
+        text = text[:MessageLimit.MAX_TEXT_LENGTH - 1] + "…"
+    await render_cache.edit(update.callback_query, text,
+                            reply_markup=keyboards.revision(revision["note_id"], revision_id))
+
+async def handle_restore_revision(update: Update, context: ContextTypes.DEFAULT_TYPE, user, revision_id):
+    """Make an earlier version the note's content again; the replaced one joins the history"""
+    revision = await get_revision(user.id, revision_id)
+    note = revision and await update_note(revision["note_id"], user.id, revision["title"], revision["content"])
+    if not note:
+        await update.callback_query.answer("❌ Version not found!")
+        return
+    await update.callback_query.answer(f"♻️ Restored version #{revision['revision']}")
+    await show_note_details(update, context, user, note.id)
 
 async def delete_note_confirmation(update: Update, context: ContextTypes.DEFAULT_TYPE, user, note_id):
     """Show delete confirmation for a note"""
@@ -345,13 +771,9 @@ async def delete_note_confirmation(update: Update, context: ContextTypes.DEFAULT
         await update.callback_query.answer("❌ Note not found!")
         return
     
-    keyboard = [
-        [InlineKeyboardButton("✅ Yes, Delete", callback_data=f"confirm_delete_{note.id}")],
-        [InlineKeyboardButton("❌ Cancel", callback_data=f"view_note_{note.id}")]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    reply_markup = keyboards.delete_confirmation(note.id)
     
-    await update.callback_query.edit_message_text(
+    await render_cache.edit(update.callback_query,
         f"🗑️ Delete Note\n\n"
         f"Are you sure you want to delete:\n"
         f"📝 {note.title}\n\n"
@@ -359,57 +781,132 @@ async def delete_note_confirmation(update: Update, context: ContextTypes.DEFAULT
         reply_markup=reply_markup
     )
 
+async def handle_confirm_delete(update: Update, context: ContextTypes.DEFAULT_TYPE, user, note_id):
+    """Delete a note once the user has confirmed"""
+    if await delete_note(note_id, user.id):
+        await update.callback_query.answer("🗑️ Note deleted")
+    else:
+        await update.callback_query.answer("❌ Note not found!")
+    await show_user_notes(update, context, user)
+
 async def show_pattern_change(update: Update, context: ContextTypes.DEFAULT_TYPE, user):
     """Show pattern change form"""
-    keyboard = [
-        [InlineKeyboardButton("1", callback_data="new_pattern_1"),
-         InlineKeyboardButton("2", callback_data="new_pattern_2"),
-         InlineKeyboardButton("3", callback_data="new_pattern_3")],
-        [InlineKeyboardButton("4", callback_data="new_pattern_4"),
-         InlineKeyboardButton("5", callback_data="new_pattern_5"),
-         InlineKeyboardButton("6", callback_data="new_pattern_6")],
-        [InlineKeyboardButton("7", callback_data="new_pattern_7"),
-         InlineKeyboardButton("8", callback_data="new_pattern_8"),
-         InlineKeyboardButton("9", callback_data="new_pattern_9")],
-        [InlineKeyboardButton("🔒 Set New Pattern", callback_data="set_new_pattern")],
-        [InlineKeyboardButton("🔙 Back", callback_data="settings")]
-    ]
-    
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    await update.callback_query.edit_message_text(
+    reply_markup = keyboards.pattern_change
+    await render_cache.edit(update.callback_query,
         "🔐 Change Pattern Lock\n\n"
         "Enter your new pattern:\n\n"
         "Current pattern: " + context.user_data.get('new_temp_pattern', ''),
         reply_markup=reply_markup
     )
     
-    user_states[user.id] = "changing_pattern"
+    await user_states.set(user.id, "changing_pattern")
     context.user_data['new_temp_pattern'] = ""
 
-# Add new function get_unlock_keyboard for creating a WebApp button for pattern unlock
+async def handle_new_pattern_digit(update: Update, context: ContextTypes.DEFAULT_TYPE, user, digit):
+    """Handle a number tap on the change pattern keyboard"""
+    query = update.callback_query
+    await query.answer()
+
+    number = str(digit)
+    current_pattern = context.user_data.get('new_temp_pattern', "")
+    if number not in current_pattern:
+        context.user_data['new_temp_pattern'] = current_pattern + number
+        await render_cache.edit(query,
+            "🔐 Change Pattern Lock\n\n"
+            "Enter your new pattern:\n\n"
+            "Current pattern: " + context.user_data['new_temp_pattern'],
+            reply_markup=keyboards.pattern_change
+        )
+
+async def handle_set_new_pattern(update: Update, context: ContextTypes.DEFAULT_TYPE, user):
+    """Handle the 'Set New Pattern' button"""
+    query = update.callback_query
+    pattern = context.user_data.get('new_temp_pattern', "")
+    if len(pattern) >= 4:
+        await set_pattern_lock(user, pattern)
+        context.user_data.pop('new_temp_pattern', None)
+        await query.answer("✅ Pattern changed successfully!")
+        await show_settings(update, context, user)
+    else:
+        await query.answer("❌ Pattern must be at least 4 digits!")
+
+# WebApp button for pattern unlock, built the first time a locked user needs it
+_unlock_keyboard = None
 
 def get_unlock_keyboard():
     # Telegram WebApp integration for sliding pattern unlock
-    from telegram import InlineKeyboardMarkup, InlineKeyboardButton, WebAppInfo
-    web_app_url = "https://abenih.github.io/my-bot-webapp/webapp/pattern_lock.html"  # Updated URL
-    keyboard = [
-        [InlineKeyboardButton("Swipe to Unlock", web_app=WebAppInfo(url=web_app_url))]
-    ]
-    return InlineKeyboardMarkup(keyboard)
+    global _unlock_keyboard
+    if _unlock_keyboard is None:
+        from telegram import WebAppInfo
+        web_app_url = "https://abenih.github.io/my-bot-webapp/webapp/pattern_lock.html"  # Updated URL
+        _unlock_keyboard = InlineKeyboardMarkup(
+            [[InlineKeyboardButton("Swipe to Unlock", web_app=WebAppInfo(url=web_app_url))]]
+        )
+    return _unlock_keyboard
 
 def get_handlers():
     """Return all handlers for the bot"""
     return [
-        CommandHandler("start", start),
-        CallbackQueryHandler(handle_callback_query),
-        MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text_message)
+        CommandHandler("start", instrument_handler(with_session(start))),
+        CommandHandler("search", instrument_handler(with_session(search_command))),
+        CommandHandler("users", instrument_handler(with_session(users_command))),
+        CommandHandler("broadcast", instrument_handler(with_session(broadcast_command))),
+        CommandHandler("export", instrument_handler(with_session(export_command))),
+        CommandHandler("import", instrument_handler(with_session(import_command))),
+        MessageHandler(filters.Document.ALL, instrument_handler(with_session(handle_document))),
+        CallbackQueryHandler(instrument_handler(with_session(handle_callback_query))),
+        MessageHandler(filters.TEXT & ~filters.COMMAND, instrument_handler(with_session(handle_text_message))),
+        # No shared session: a lookup may be cancelled mid-query, and it only reads
+        InlineQueryHandler(instrument_handler(handle_inline_query)),
     ]
 
-async def show_locked_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def show_locked_message(update: Update, context: ContextTypes.DEFAULT_TYPE, user=None):
     """Send a message instructing the user to use the Swipe to Unlock interface."""
     message = "Device locked. Please use the 'Swipe to Unlock' button to unlock your Notepad."
     if update.callback_query:
-        await update.callback_query.edit_message_text(message)
+        await render_cache.edit(update.callback_query, message)
         await update.callback_query.answer()
     elif update.message:
         await update.message.reply_text(message)
+
+def _answered(show, **kwargs):
+    """Acknowledge the button tap, then run ``show``"""
+    async def handler(update: Update, context: ContextTypes.DEFAULT_TYPE, user, *values):
+        await update.callback_query.answer()
+        await show(update, context, user, *values, **kwargs)
+    return handler
+
+# Callback routing table. Codes are stored in buttons already sent to users: never reuse
+# or renumber one. Names double as the legacy "name" / "name_<id>" callback strings.
+router.action(1, "pattern", int, choices=range(1, 10))(handle_pattern_digit)
+router.action(2, "set_pattern")(handle_set_pattern)
+router.action(3, "unlock_pattern")(handle_unlock)
+router.action(4, "new_note")(_answered(show_new_note_form))
+router.action(5, "list_notes")(_answered(show_user_notes))
+router.action(6, "settings")(_answered(show_settings))
+router.action(7, "lock_device")(_answered(handle_lock_device))
+router.action(8, "back_to_menu")(show_main_menu)
+router.action(9, "notes_next", int, int)(_answered(show_user_notes))
+router.action(10, "notes_prev", int, int)(_answered(show_user_notes, before=True))
+router.action(11, "search_page", int)(_answered(show_search_results))
+router.action(12, "view_note", int)(show_note_details)
+router.action(13, "edit_note", int)(show_edit_note_form)
+router.action(14, "delete_note", int)(delete_note_confirmation)
+router.action(15, "confirm_delete", int)(handle_confirm_delete)
+router.action(16, "change_pattern")(show_pattern_change)
+router.action(17, "new_pattern", int, choices=range(1, 10))(handle_new_pattern_digit)
+router.action(18, "set_new_pattern")(handle_set_new_pattern)
+router.action(19, "unlock_digit", int, choices=range(1, 10))(handle_unlock_digit)
+router.action(20, "users_next", int)(_admin_only(show_users_page))
+router.action(21, "users_prev", int)(_admin_only(show_users_page, before=True))
+router.action(22, "users_list")(_admin_only(show_users_page))
+router.action(23, "users_stats")(_admin_only(show_user_stats))
+router.action(24, "users_csv")(_admin_only(send_users_csv))
+router.action(25, "remind_note", int)(show_reminder_form)
+router.action(26, "clear_reminders", int)(handle_clear_reminders)
+router.action(27, "note_history", int, int)(show_note_history)
+router.action(28, "view_revision", int)(show_revision)
+router.action(29, "restore_revision", int)(handle_restore_revision)
+
+# Shared keyboards, encoded with the routes above
+keyboards = Keyboards(router)
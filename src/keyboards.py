@@ -0,0 +1,114 @@
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+# Keyboards that never change are built once and shared by every message that shows
+# them; PTB's markup objects are immutable, so sharing is safe. Per-note keyboards are
+# built on demand from the same button definitions.
+
+def _markup(*rows):
+    return InlineKeyboardMarkup(tuple(tuple(row) for row in rows))
+
+def _digit_rows(encode, action):
+    return [
+        [InlineKeyboardButton(str(digit), callback_data=encode(action, digit)) for digit in range(row, row + 3)]
+        for row in (1, 4, 7)
+    ]
+
+class Keyboards:
+    """The bot's inline keyboards, encoded with ``router``'s callback data."""
+
+    def __init__(self, router):
+        encode = self._encode = router.encode
+        self.back_to_menu_button = InlineKeyboardButton("🔙 Back", callback_data=encode("back_to_menu"))
+
+        self.pattern_setup = _markup(
+            *_digit_rows(encode, "pattern"),
+            [InlineKeyboardButton("🔒 Set Pattern", callback_data=encode("set_pattern"))],
+        )
+        self.pattern_lock = _markup(
+            *_digit_rows(encode, "unlock_digit"),
+            [InlineKeyboardButton("🔓 Unlock", callback_data=encode("unlock_pattern"))],
+        )
+        self.main_menu = _markup(
+            [InlineKeyboardButton("📝 New Note", callback_data=encode("new_note"))],
+            [InlineKeyboardButton("📚 My Notes", callback_data=encode("list_notes"))],
+            [InlineKeyboardButton("⚙️ Settings", callback_data=encode("settings"))],
+            [InlineKeyboardButton("🔒 Lock", callback_data=encode("lock_device"))],
+        )
+        self.new_note = _markup(
+            [InlineKeyboardButton("❌ Cancel", callback_data=encode("back_to_menu"))],
+        )
+        self.back_to_menu = _markup([self.back_to_menu_button])
+        self.settings = _markup(
+            [InlineKeyboardButton("🔐 Change Pattern", callback_data=encode("change_pattern"))],
+            [self.back_to_menu_button],
+        )
+        self.pattern_change = _markup(
+            *_digit_rows(encode, "new_pattern"),
+            [InlineKeyboardButton("🔒 Set New Pattern", callback_data=encode("set_new_pattern"))],
+            [InlineKeyboardButton("🔙 Back", callback_data=encode("settings"))],
+        )
+
+        self.user_stats = _markup(
+            [InlineKeyboardButton("👥 Users", callback_data=encode("users_list"))],
+        )
+
+    def users_page(self, prev_cursor=None, next_cursor=None):
+        encode = self._encode
+        pager = []
+        if prev_cursor is not None:
+            pager.append(InlineKeyboardButton("⬅️ Prev", callback_data=encode("users_prev", prev_cursor)))
+        if next_cursor is not None:
+            pager.append(InlineKeyboardButton("Next ➡️", callback_data=encode("users_next", next_cursor)))
+        return _markup(
+            *([pager] if pager else []),
+            [InlineKeyboardButton("📊 Stats", callback_data=encode("users_stats")),
+             InlineKeyboardButton("📄 CSV", callback_data=encode("users_csv"))],
+        )
+
+    def note_details(self, note_id: int):
+        encode = self._encode
+        return _markup(
+            [InlineKeyboardButton("✏️ Edit", callback_data=encode("edit_note", note_id))],
+            [InlineKeyboardButton("⏰ Remind me", callback_data=encode("remind_note", note_id))],
+            [InlineKeyboardButton("🕘 History", callback_data=encode("note_history", note_id, 0))],
+            [InlineKeyboardButton("🗑️ Delete", callback_data=encode("delete_note", note_id))],
+            [InlineKeyboardButton("🔙 Back", callback_data=encode("list_notes"))],
+        )
+
+    def edit_note(self, note_id: int):
+        return _markup([InlineKeyboardButton("❌ Cancel", callback_data=self._encode("view_note", note_id))])
+
+    def reminder_form(self, note_id: int, has_reminders: bool = False):
+        encode = self._encode
+        return _markup(
+            *([[InlineKeyboardButton("🔕 Clear reminders", callback_data=encode("clear_reminders", note_id))]]
+              if has_reminders else []),
+            [InlineKeyboardButton("❌ Cancel", callback_data=encode("view_note", note_id))],
+        )
+
+    def note_history(self, note_id: int, revisions, older_than=None):
+        encode = self._encode
+        return _markup(
+            *([InlineKeyboardButton(label, callback_data=encode("view_revision", revision_id))]
+              for revision_id, label in revisions),
+            *([[InlineKeyboardButton("Older ➡️", callback_data=encode("note_history", note_id, older_than))]]
+              if older_than is not None else []),
+            [InlineKeyboardButton("🔙 Back", callback_data=encode("view_note", note_id))],
+        )
+
+    def revision(self, note_id: int, revision_id: int):
+        encode = self._encode
+        return _markup(
+            [InlineKeyboardButton("♻️ Restore this version", callback_data=encode("restore_revision", revision_id))],
+            [InlineKeyboardButton("🔙 History", callback_data=encode("note_history", note_id, 0))],
+        )
+
+    def open_note(self, note_id: int):
+        return _markup([InlineKeyboardButton("📖 Open note", callback_data=self._encode("view_note", note_id))])
+
+    def delete_confirmation(self, note_id: int):
+        encode = self._encode
+        return _markup(
+            [InlineKeyboardButton("✅ Yes, Delete", callback_data=encode("confirm_delete", note_id))],
+            [InlineKeyboardButton("❌ Cancel", callback_data=encode("view_note", note_id))],
+        )
@@ -0,0 +1,58 @@
+import atexit
+import logging
+import logging.handlers
+import queue
+import sys
+from contextvars import ContextVar
+
+# Record attributes written as key=value after the message, when a record has them
+FIELDS = ("update_id", "user_id", "handler", "duration")
+
+# Fields of the update being handled (set by src.metrics.instrument_handler); every
+# record logged meanwhile, from any logger, carries them
+log_context = ContextVar("log_context", default=None)
+
+_listener = None
+
+class _ContextFilter(logging.Filter):
+    # Runs in the logging task, before the record crosses to the listener thread
+    def filter(self, record):
+        fields = log_context.get()
+        if fields:
+            for name, value in fields.items():
+                if not hasattr(record, name):
+                    setattr(record, name, value)
+        return True
+
+class KeyValueFormatter(logging.Formatter):
+    """Formatter appending ``name=value`` for each of FIELDS set on the record."""
+
+    def formatMessage(self, record):
+        message = super().formatMessage(record)
+        fields = " ".join(f"{name}={getattr(record, name)}" for name in FIELDS
+                          if getattr(record, name, None) is not None)
+        return f"{message} {fields}" if fields else message
+
+def setup_logging(level: str = "INFO"):
+    """Send log records through a queue so formatting and stream I/O run off the event loop.
+
+    Handlers only enqueue records; a QueueListener thread formats and writes them.
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    records = queue.SimpleQueue()
+    stream = logging.StreamHandler(sys.stderr)
+    stream.setFormatter(KeyValueFormatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    _listener = logging.handlers.QueueListener(records, stream, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+    root = logging.getLogger()
+    handler = logging.handlers.QueueHandler(records)
+    handler.addFilter(_ContextFilter())
+    root.handlers[:] = [handler]
+    root.setLevel(level.upper())
+    # httpx logs every Bot API request at INFO
+    logging.getLogger("httpx").setLevel(logging.WARNING)
@@ -1,37 +1,175 @@
+import time
+_import_started = time.perf_counter()
+
+import argparse
 import asyncio
+import logging
 import sys
-from telegram.ext import ApplicationBuilder
-from src.config import BOT_TOKEN, ADMIN_ID
-from src.handlers import get_handlers
-from src.db import engine, Base
+from src.config import (BOT_TOKEN, BOT_MODE, WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH,
+                        WEBHOOK_URL, WEBHOOK_SECRET, MAX_CONCURRENT_UPDATES, STATE_SWEEP_INTERVAL,
+                        LOG_LEVEL, METRICS_HOST, METRICS_PORT, RATE_LIMIT_GLOBAL, RATE_LIMIT_PER_CHAT,
+                        RATE_LIMIT_CHAT_BURST, RATE_LIMIT_MAX_RETRIES, WORKERS)
+from src.log import setup_logging
+
+# The bot's own modules (and telegram.ext, SQLAlchemy and the rest they pull in) are
+# imported where they are first needed, so that profile_startup times them as steps
+IMPORT_SECONDS = time.perf_counter() - _import_started
+
+logger = logging.getLogger(__name__)
 
 # Cross-platform event loop fix
 if sys.platform.startswith("win"):
     asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
 
-async def main():
-    # Create database tables if not exist
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+def build_application(request=None, get_updates_request=None, global_rate=RATE_LIMIT_GLOBAL):
+    """Build the bot application; ``request`` lets the fake Telegram harness stand in for the Bot API.
 
-    # Build the Telegram bot
-    app = ApplicationBuilder().token(BOT_TOKEN).build()
+    ``global_rate`` is this process's share of the global outbound limit.
+    """
+    from telegram.ext import ApplicationBuilder
+    from src.db import release_session
+    from src.dedup import dedup_handler
+    from src.handlers import get_handlers
+    from src.metrics import InstrumentedHTTPXRequest
+    from src.ratelimit import OutboundRateLimiter
+    from src.updates import PerUserUpdateProcessor
+
+    builder = ApplicationBuilder().token(BOT_TOKEN).concurrent_updates(
+        PerUserUpdateProcessor(MAX_CONCURRENT_UPDATES)
+    )
+    if request is not None:
+        builder = builder.request(request).get_updates_request(request)
+    else:
+        # Same pool sizes as PTB's defaults, but timing every Bot API call
+        builder = builder.request(InstrumentedHTTPXRequest(connection_pool_size=256)).get_updates_request(
+            get_updates_request or InstrumentedHTTPXRequest()
+        )
+    # Every Bot API call passes through the limiter, even with limits off (global_rate 0),
+    # so a handler that has only read gives back its connection before it goes out
+    builder = builder.rate_limiter(OutboundRateLimiter(
+        global_rate, RATE_LIMIT_PER_CHAT, RATE_LIMIT_CHAT_BURST, RATE_LIMIT_MAX_RETRIES,
+        before_request=release_session,
+    ))
+    app = builder.build()
 
+    # Redelivered updates stop here, before any handler in group 0 sees them
+    app.add_handler(dedup_handler(), group=-1)
     # Add all handlers
-    print("DEBUG: Adding handlers...")
     for handler in get_handlers():
-        print(f"DEBUG: Adding handler: {type(handler).__name__}")
+        logger.debug("Adding handler: %s", type(handler).__name__)
         app.add_handler(handler)
-    print("DEBUG: All handlers added successfully")
+    return app
+
+async def start_ingress(app, mode=BOT_MODE):
+    """Start receiving updates by long polling or through the local webhook server"""
+    if mode == "webhook":
+        webhook_url = WEBHOOK_URL or f"http://{WEBHOOK_LISTEN}:{WEBHOOK_PORT}/{WEBHOOK_PATH}"
+        await app.updater.start_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            url_path=WEBHOOK_PATH,
+            webhook_url=webhook_url,
+            secret_token=WEBHOOK_SECRET,
+        )
+        logger.info("Listening for webhook updates on %s:%s/%s", WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH)
+    elif mode == "polling":
+        await app.updater.start_polling()
+        logger.info("Polling for updates")
+    else:
+        raise ValueError(f"Unknown BOT_MODE {mode!r}, expected 'polling' or 'webhook'")
+
+async def sweep_idle_states():
+    """Periodically evict conversation states idle longer than STATE_TTL, and old update ids"""
+    from src.dedup import deduplicator
+    from src.handlers import user_states
+
+    while True:
+        await asyncio.sleep(STATE_SWEEP_INTERVAL)
+        try:
+            evicted = await user_states.evict_idle()
+            if evicted:
+                logger.debug("Evicted %s idle conversation states", evicted)
+        except Exception:
+            logger.exception("Failed to evict idle conversation states")
+        try:
+            await deduplicator.evict_expired()
+        except Exception:
+            logger.exception("Failed to evict processed update ids")
+
+async def profile_startup():
+    """Time each startup step up to the first getUpdates call, print them and stop"""
+    setup_logging(LOG_LEVEL)
+    steps = [("import src.main", IMPORT_SECONDS)]
+    started = time.perf_counter()
+
+    async def step(name, awaitable):
+        began = time.perf_counter()
+        result = await awaitable
+        steps.append((name, time.perf_counter() - began))
+        return result
+
+    began = time.perf_counter()
+    from src.migrate import migrate_database
+    from src.metrics import InstrumentedHTTPXRequest
+    steps.append(("import src.migrate, metrics", time.perf_counter() - began))
+    await step("migrate_database", migrate_database())
+
+    class FirstPollProbe(InstrumentedHTTPXRequest):
+        """getUpdates request that notes when the first poll goes out"""
 
-    print("Bot is running...")
-    print("DEBUG: Bot initialized and starting...")
+        __slots__ = ("sent",)
+
+        def __init__(self):
+            super().__init__()
+            self.sent = asyncio.Event()
+
+        async def do_request(self, url, method, request_data=None, *args, **kwargs):
+            self.sent.set()
+            return await super().do_request(url, method, request_data, *args, **kwargs)
+
+    began = time.perf_counter()
+    probe = FirstPollProbe()
+    app = build_application(get_updates_request=probe)
+    steps.append(("build_application", time.perf_counter() - began))
+    await step("app.initialize (getMe)", app.initialize())
+    await step("app.start", app.start())
+    await step("start_ingress", start_ingress(app))
+    if BOT_MODE == "polling":
+        await step("first getUpdates sent", asyncio.wait_for(probe.sent.wait(), 30))
+    total = IMPORT_SECONDS + time.perf_counter() - started
+
+    for name, seconds in steps:
+        print(f"{name:<28}{seconds * 1000:>9.1f} ms")
+    print(f"{'time to first poll':<28}{total * 1000:>9.1f} ms")
+
+    await app.updater.stop()
+    await app.stop()
+    await app.shutdown()
+
+async def main():
+    setup_logging(LOG_LEVEL)
+    from src.broadcast import resume_broadcasts, stop_broadcasts
+    from src.handlers import keyboards
+    from src.metrics import start_metrics_server
+    from src.migrate import migrate_database
+    from src.reminders import start_reminders, stop_reminders
+
+    # Bring the database schema up to date
+    await migrate_database()
+
+    # Build the Telegram bot
+    app = build_application()
+    metrics_server = await start_metrics_server(METRICS_HOST, METRICS_PORT) if METRICS_PORT else None
+
+    logger.info("Bot is running...")
     
     # Initialize and start the bot
     await app.initialize()
     await app.start()
-    await app.updater.start_polling()
-    print("DEBUG: Bot is now polling for updates...")
+    await start_ingress(app)
+    sweeper = asyncio.create_task(sweep_idle_states())
+    await resume_broadcasts(app.bot)
+    start_reminders(app.bot, keyboards.open_note)
     
     # Keep the bot running
     try:
@@ -39,22 +177,27 @@ async def main():
     except KeyboardInterrupt:
         pass
     finally:
+        sweeper.cancel()
+        await stop_broadcasts()
+        await stop_reminders()
+        if metrics_server is not None:
+            metrics_server.close()
         await app.updater.stop()
         await app.stop()
         await app.shutdown()
 
-async def start(update, context):
-    """Handle /start command and set admin if not already set"""
-    # Set admin if not yet assigned
-    if ADMIN_ID is None:
-        ADMIN_ID = update.effective_user.id
-        await update.message.reply_text("You are now set as the admin.")
-    else:
-        await update.message.reply_text("Welcome back!")
-    
-    # Continue with normal start logic
-    # ...existing start logic...
-
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the bot")
+    parser.add_argument("--profile-startup", action="store_true",
+                        help="report import time and time to the first poll, then exit")
+    parser.add_argument("--workers", type=int, default=WORKERS,
+                        help="worker processes behind one ingress process (default: WORKERS, 1)")
+    args = parser.parse_args()
     # Simple async execution
-    asyncio.run(main())
+    if args.profile_startup:
+        asyncio.run(profile_startup())
+    elif args.workers > 1:
+        from src.workers import run_ingress
+        asyncio.run(run_ingress(args.workers))
+    else:
+        asyncio.run(main())
@@ -0,0 +1,257 @@
+"""In-process metrics exposed in the Prometheus text format.
+
+Recording is a dict lookup plus a couple of integer updates on the event loop thread;
+formatting only happens when /metrics is scraped.
+"""
+import asyncio
+import functools
+import logging
+import time
+from bisect import bisect_left
+from sqlalchemy import event
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from telegram.request import HTTPXRequest
+from src.log import log_context
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(names, values, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[n] for n in self.label_names)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(tuple(labels[n] for n in self.label_names), 0)
+
+    def total(self):
+        """Sum over every label combination."""
+        return sum(self._values.values())
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(self.label_names, key)} {value}")
+        return lines
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.buckets = tuple(buckets)
+        # key -> [per-bucket counts (last one is +Inf), sum, count]
+        self._series = {}
+
+    def observe(self, value, **labels):
+        key = tuple(labels[n] for n in self.label_names)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def time(self, **labels):
+        """Context manager observing the duration of its block."""
+        return _Timer(self, labels)
+
+    def count(self, **labels):
+        series = self._series.get(tuple(labels[n] for n in self.label_names))
+        return series[2] if series else 0
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total, count) in sorted(self._series.items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound!r}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, key)} {count}")
+        return lines
+
+class _Timer:
+    __slots__ = ("_histogram", "_labels", "_started")
+
+    def __init__(self, histogram, labels):
+        self._histogram = histogram
+        self._labels = labels
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._histogram.observe(time.perf_counter() - self._started, **self._labels)
+
+class Gauge:
+    """Value read from ``fn`` at scrape time; ``fn`` returns a number or {labels tuple: number}."""
+
+    def __init__(self, name, help, fn, labels=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._fn = fn
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        values = self._fn()
+        if not isinstance(values, dict):
+            values = {(): values}
+        for key, value in sorted(values.items()):
+            lines.append(f"{self.name}{_format_labels(self.label_names, key)} {value}")
+        return lines
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self.register(Counter(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def gauge(self, name, help, fn, labels=()):
+        return self.register(Gauge(name, help, fn, labels))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+HANDLER_LATENCY = REGISTRY.histogram(
+    "bot_handler_duration_seconds", "Time spent handling one update, per handler", ["handler"])
+HANDLER_ERRORS = REGISTRY.counter(
+    "bot_handler_errors_total", "Updates whose handler raised, per handler", ["handler"])
+CALLBACK_LATENCY = REGISTRY.histogram(
+    "bot_callback_action_duration_seconds", "Time spent in each inline keyboard action", ["action"])
+DB_QUERY_LATENCY = REGISTRY.histogram(
+    "db_query_duration_seconds", "Database statement execution time, per statement kind", ["statement"])
+DB_POOL_CHECKOUT = REGISTRY.histogram(
+    "db_pool_checkout_seconds", "Time waiting for a pooled database connection")
+TELEGRAM_API_LATENCY = REGISTRY.histogram(
+    "telegram_api_duration_seconds", "Bot API round-trip time, per method", ["method"])
+
+def instrument_handler(callback):
+    """Wrap a PTB handler callback to record its latency and failures.
+
+    Records logged while it runs carry the update's id, its user's id and the handler name,
+    and it logs each handled update at DEBUG with its duration.
+    """
+    name = callback.__name__
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        user = getattr(update, "effective_user", None)
+        token = log_context.set({"update_id": getattr(update, "update_id", None),
+                                 "user_id": user.id if user is not None else None, "handler": name})
+        started = time.perf_counter()
+        try:
+            return await callback(update, context)
+        except Exception:
+            HANDLER_ERRORS.inc(handler=name)
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            HANDLER_LATENCY.observe(elapsed, handler=name)
+            logger.debug("Handled update", extra={"duration": f"{elapsed:.4f}"})
+            log_context.reset(token)
+    return wrapper
+
+def instrument_engine(engine):
+    """Time every statement run through ``engine`` (an AsyncEngine)."""
+    sync_engine = engine.sync_engine
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["query_started"].pop()
+        kind = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "OTHER"
+        DB_QUERY_LATENCY.observe(time.perf_counter() - started, statement=kind)
+
+    @event.listens_for(sync_engine, "handle_error")
+    def _error(context):
+        if context.connection is not None and context.connection.info.get("query_started"):
+            context.connection.info["query_started"].pop()
+
+class TimedAsyncAdaptedQueuePool(AsyncAdaptedQueuePool):
+    """AsyncAdaptedQueuePool that records how long each checkout waited."""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            DB_POOL_CHECKOUT.observe(time.perf_counter() - started)
+
+class InstrumentedHTTPXRequest(HTTPXRequest):
+    """HTTPXRequest that records the latency of every Bot API call."""
+
+    __slots__ = ()
+
+    async def do_request(self, url, method, request_data=None, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await super().do_request(url, method, request_data, *args, **kwargs)
+        finally:
+            TELEGRAM_API_LATENCY.observe(time.perf_counter() - started, method=url.rsplit("/", 1)[-1])
+
+async def _serve(reader, writer):
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), 5)
+        # Drain the headers; the request has no body we care about
+        while (await asyncio.wait_for(reader.readline(), 5)) not in (b"\r\n", b"\n", b""):
+            pass
+        parts = request_line.decode("latin-1").split()
+        if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+            status, body = "200 OK", REGISTRY.render().encode()
+        else:
+            status, body = "404 Not Found", b"Not found\n"
+        writer.write(
+            f"HTTP/1.1 {status}\r\n"
+            f"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: close\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError) as e:
+        logger.debug("Metrics request failed: %s", e)
+    finally:
+        writer.close()
+
+async def start_metrics_server(host: str, port: int):
+    """Serve GET /metrics on host:port; returns the asyncio server."""
+    server = await asyncio.start_server(_serve, host, port)
+    logger.info("Serving metrics on http://%s:%s/metrics", host, port)
+    return server
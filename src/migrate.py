@@ -1,16 +1,239 @@
+import argparse
 import asyncio
+import hashlib
+import logging
 import sys
-from sqlalchemy import text
+from datetime import datetime, timezone
+from sqlalchemy import (Column, Integer, String, Boolean, DateTime, MetaData, Table,
+                        false, func, inspect, select, text)
+from sqlalchemy.exc import DBAPIError
 from src.db import engine
+from src.log import setup_logging
+from src.models import (User, Note, ConversationState, Broadcast, BroadcastDelivery, ProcessedUpdate,
+                        Reminder, NoteRevision, PREVIEW_LENGTH)
+
+logger = logging.getLogger(__name__)
 
 # Cross-platform event loop fix
 if sys.platform.startswith("win"):
     asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
 
-async def migrate_database():
-    """Add missing columns to existing users table"""
+# Applied versions are recorded here, one row per migration
+schema_migrations = Table(
+    "schema_migrations",
+    MetaData(),
+    Column("version", Integer, primary_key=True),
+    Column("description", String, nullable=False),
+    Column("applied_at", DateTime(timezone=True), server_default=func.now()),
+)
+
+# A single row holding SCHEMA_FINGERPRINT once every migration has been applied. Boot
+# reads only this row; alembic and the inspector are loaded only when it doesn't match.
+schema_fingerprint = Table(
+    "schema_fingerprint",
+    MetaData(),
+    Column("id", Integer, primary_key=True),
+    Column("fingerprint", String, nullable=False),
+)
+
+# Migrations are plain functions run through alembic's Operations API, so batch mode
+# handles the ALTERs SQLite can't do in place. Each one checks what already exists,
+# because create_all() used to build these tables straight from the models.
+
+def _has_column(inspector, table, column):
+    return any(c["name"] == column for c in inspector.get_columns(table))
+
+def _has_index(inspector, table, name):
+    return any(i["name"] == name for i in inspector.get_indexes(table))
+
+def _create_base_tables(op, inspector):
+    bind = op.get_bind()
+    User.__table__.create(bind, checkfirst=True)
+    Note.__table__.create(bind, checkfirst=True)
+
+def _add_user_lock_columns(op, inspector):
+    if not _has_column(inspector, "users", "pattern_lock"):
+        op.add_column("users", Column("pattern_lock", String))
+    if not _has_column(inspector, "users", "is_locked"):
+        op.add_column("users", Column("is_locked", Boolean, nullable=False, server_default=false()))
+
+def _add_telegram_id_index(op, inspector):
+    if not _has_index(inspector, "users", "ix_users_telegram_id"):
+        op.create_index("ix_users_telegram_id", "users", ["telegram_id"], unique=True)
+
+def _add_notes_user_index(op, inspector):
+    if not any(fk["referred_table"] == "users" for fk in inspector.get_foreign_keys("notes")):
+        # Notes whose owner no longer exists can't be reached from any handler and
+        # would make the constraint fail on PostgreSQL
+        op.execute(text("DELETE FROM notes WHERE user_id NOT IN (SELECT id FROM users)"))
+        with op.batch_alter_table("notes") as batch:
+            batch.create_foreign_key("fk_notes_user_id_users", "users", ["user_id"], ["id"],
+                                     ondelete="CASCADE")
+    if not _has_index(inspect(op.get_bind()), "notes", "ix_notes_user_id_updated_at"):
+        op.create_index("ix_notes_user_id_updated_at", "notes",
+                        ["user_id", text("updated_at DESC"), text("id DESC")])
+
+def _create_conversation_states(op, inspector):
+    ConversationState.__table__.create(op.get_bind(), checkfirst=True)
+
+def _create_notes_search_index(op, inspector):
+    dialect = op.get_bind().dialect.name
+    if dialect == "sqlite":
+        # Kept in sync by src.search rather than triggers, so note writes stay explicit
+        op.execute(text("CREATE VIRTUAL TABLE IF NOT EXISTS notes_fts USING fts5("
+                        "title, content, owner, tokenize = 'unicode61 remove_diacritics 2')"))
+        op.execute(text("DELETE FROM notes_fts"))
+        op.execute(text("INSERT INTO notes_fts (rowid, title, content, owner) "
+                        "SELECT id, title, content, 'u' || user_id FROM notes"))
+    elif dialect == "postgresql":
+        if not _has_column(inspector, "notes", "search_vector"):
+            op.execute(text("ALTER TABLE notes ADD COLUMN search_vector tsvector"))
+        op.execute(text("UPDATE notes SET search_vector = "
+                        "setweight(to_tsvector('simple', title), 'A') || "
+                        "setweight(to_tsvector('simple', content), 'B')"))
+        op.execute(text("CREATE INDEX IF NOT EXISTS ix_notes_search_vector "
+                        "ON notes USING GIN (search_vector)"))
+
+def _add_notes_preview(op, inspector):
+    if not _has_column(inspector, "notes", "preview"):
+        op.add_column("notes", Column("preview", String, nullable=False, server_default=""))
+    if not _has_column(inspector, "notes", "content_length"):
+        op.add_column("notes", Column("content_length", Integer, nullable=False, server_default="0"))
+    # Same values as src.models.note_body(); substr() counts characters on both backends
+    op.execute(text(f"UPDATE notes SET preview = substr(content, 1, {PREVIEW_LENGTH}), "
+                    "content_length = length(content)"))
+
+def _create_schema_fingerprint(op, inspector):
+    schema_fingerprint.create(op.get_bind(), checkfirst=True)
+
+def _create_broadcasts(op, inspector):
+    if not _has_column(inspector, "users", "blocked_at"):
+        op.add_column("users", Column("blocked_at", DateTime(timezone=True)))
+    bind = op.get_bind()
+    Broadcast.__table__.create(bind, checkfirst=True)
+    BroadcastDelivery.__table__.create(bind, checkfirst=True)
+
+def _add_update_dedup(op, inspector):
+    if not _has_column(inspector, "notes", "idempotency_key"):
+        op.add_column("notes", Column("idempotency_key", String))
+    if not _has_index(inspect(op.get_bind()), "notes", "ix_notes_user_id_idempotency_key"):
+        op.create_index("ix_notes_user_id_idempotency_key", "notes", ["user_id", "idempotency_key"], unique=True)
+    ProcessedUpdate.__table__.create(op.get_bind(), checkfirst=True)
+
+def _create_reminders(op, inspector):
+    Reminder.__table__.create(op.get_bind(), checkfirst=True)
+
+def _create_note_revisions(op, inspector):
+    NoteRevision.__table__.create(op.get_bind(), checkfirst=True)
+
+def _add_reminder_attempts(op, inspector):
+    if not _has_column(inspector, "reminders", "attempts"):
+        op.add_column("reminders", Column("attempts", Integer, nullable=False, server_default="0"))
+
+def _normalize_note_timestamps(op, inspector):
+    # CURRENT_TIMESTAMP wrote "YYYY-MM-DD HH:MM:SS"; src.models now writes, and the keyset
+    # cursors compare against, the same with ".ffffff" appended
+    if op.get_bind().dialect.name == "sqlite":
+        op.execute(text("UPDATE notes SET updated_at = updated_at || '.000000' WHERE length(updated_at) = 19"))
+
+MIGRATIONS = [
+    (1, "create users and notes tables", _create_base_tables),
+    (2, "add users.pattern_lock and users.is_locked", _add_user_lock_columns),
+    (3, "add users.telegram_id lookup index", _add_telegram_id_index),
+    (4, "add notes.user_id foreign key and (user_id, updated_at DESC) index", _add_notes_user_index),
+    (5, "create conversation_states table", _create_conversation_states),
+    (6, "add full-text search index over notes", _create_notes_search_index),
+    (7, "add notes.preview and notes.content_length", _add_notes_preview),
+    (8, "create schema_fingerprint table", _create_schema_fingerprint),
+    (9, "add users.blocked_at and broadcast tables", _create_broadcasts),
+    (10, "add notes.idempotency_key and processed_updates table", _add_update_dedup),
+    (11, "create reminders table", _create_reminders),
+    (12, "create note_revisions table", _create_note_revisions),
+    (13, "add reminders.attempts", _add_reminder_attempts),
+    (14, "store notes.updated_at with microseconds on SQLite", _normalize_note_timestamps),
+]
+
+SCHEMA_FINGERPRINT = hashlib.sha256(
+    "\n".join(f"{version}:{description}" for version, description, _ in MIGRATIONS).encode()
+).hexdigest()[:16]
+
+def _applied_versions(sync_conn):
+    schema_migrations.create(sync_conn, checkfirst=True)
+    return set(sync_conn.execute(select(schema_migrations.c.version)).scalars())
+
+def _apply(sync_conn, version, description, migration):
+    # alembic takes longer to import than the rest of startup, and is only needed here
+    from alembic.migration import MigrationContext
+    from alembic.operations import Operations
+
+    migration(Operations(MigrationContext.configure(sync_conn)), inspect(sync_conn))
+    sync_conn.execute(schema_migrations.insert().values(version=version, description=description))
+
+def _record_fingerprint(sync_conn):
+    sync_conn.execute(schema_fingerprint.delete())
+    sync_conn.execute(schema_fingerprint.insert().values(id=1, fingerprint=SCHEMA_FINGERPRINT))
+
+async def schema_is_current():
+    """True if the database was last migrated with exactly this MIGRATIONS list"""
+    try:
+        async with engine.connect() as conn:
+            stored = await conn.scalar(select(schema_fingerprint.c.fingerprint))
+    except DBAPIError:
+        # No fingerprint table yet: a database from before migration 8, or a new one
+        return False
+    return stored == SCHEMA_FINGERPRINT
+
+async def migrate_database(force: bool = False):
+    """Apply pending migrations in order, each in its own transaction.
+
+    Returns straight away when the stored fingerprint matches, unless ``force`` is set.
+    """
+    if not force and await schema_is_current():
+        logger.info("Schema is up to date (%s).", SCHEMA_FINGERPRINT)
+        return
+
+    async with engine.begin() as conn:
+        applied = await conn.run_sync(_applied_versions)
+
+    pending = [m for m in MIGRATIONS if m[0] not in applied]
+    if not pending:
+        logger.info("No migrations are pending.")
+
+    for version, description, migration in pending:
+        async with engine.begin() as conn:
+            await conn.run_sync(_apply, version, description, migration)
+        logger.info("Applied migration %s: %s", version, description)
+
     async with engine.begin() as conn:
-        print("No migrations are pending.")
+        await conn.run_sync(_record_fingerprint)
+
+async def check_query_plans(user_id: int = 1):
+    """Print the query plan of each src.notes query"""
+    from src.notes import user_notes_query, notes_page_query, note_by_id_query
+
+    cursor = (datetime.now(timezone.utc), 1)
+    queries = {
+        "get_user_notes": user_notes_query(user_id),
+        "get_user_notes_page (first page)": notes_page_query(user_id),
+        "get_user_notes_page (next page)": notes_page_query(user_id, cursor),
+        "get_user_notes_page (prev page)": notes_page_query(user_id, cursor, before=True),
+        "get_note_by_id": note_by_id_query(1, user_id),
+    }
+    async with engine.connect() as conn:
+        explain = "EXPLAIN QUERY PLAN" if conn.dialect.name == "sqlite" else "EXPLAIN"
+        for name, stmt in queries.items():
+            sql = str(stmt.compile(conn, compile_kwargs={"literal_binds": True}))
+            result = await conn.execute(text(f"{explain} {sql}"))
+            print(f"== {name}")
+            for row in result:
+                print("   " + " ".join(str(col) for col in row))
 
 if __name__ == "__main__":
-    asyncio.run(migrate_database())
+    parser = argparse.ArgumentParser(description="Apply database migrations")
+    parser.add_argument("--check", action="store_true",
+                        help="print query plans for the src.notes queries instead of migrating")
+    parser.add_argument("--force", action="store_true",
+                        help="check every migration even if the schema fingerprint matches")
+    args = parser.parse_args()
+    setup_logging()
+    asyncio.run(check_query_plans() if args.check else migrate_database(force=args.force))
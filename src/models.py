@@ -1,21 +1,122 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, Text, func
+from datetime import datetime, timezone
+from sqlalchemy import (BigInteger, Column, Integer, String, Boolean, DateTime, Text, LargeBinary, ForeignKey, Index,
+                        false, func)
 from src.db import Base
 
+def _utcnow():
+    return datetime.now(timezone.utc)
+
 class User(Base):
     __tablename__ = "users"
 
     id = Column(Integer, primary_key=True, index=True)
-    telegram_id = Column(String, unique=True, nullable=False)
+    telegram_id = Column(String, unique=True, nullable=False, index=True)
     username = Column(String)
     is_admin = Column(Boolean, default=False)
+    pattern_lock = Column(String)
+    is_locked = Column(Boolean, default=False, server_default=false(), nullable=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+    # Set when a message to the user is refused because they blocked the bot
+    blocked_at = Column(DateTime(timezone=True))
 
 class Note(Base):
     __tablename__ = "notes"
 
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, nullable=False)  # User ID
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE", name="fk_notes_user_id_users"),
+                     nullable=False)  # User ID
     title = Column(String, nullable=False)
     content = Column(Text, nullable=False)
+    # Listings show these instead of loading content; written together with it
+    preview = Column(String, nullable=False, server_default="")
+    content_length = Column(Integer, nullable=False, server_default="0")
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    # Set here, not by the database, so every value carries microseconds: SQLite compares
+    # the stored text with the keyset cursors src.notes binds, which always have them
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), default=_utcnow, onupdate=_utcnow)
+    # Set by writes that may be retried (e.g. the message a note was created from)
+    idempotency_key = Column(String)
+
+# Serves every per-user listing in src.notes, including the keyset pages
+Index("ix_notes_user_id_updated_at", Note.user_id, Note.updated_at.desc(), Note.id.desc())
+# A retried write finds the note it already created; NULL keys never conflict
+Index("ix_notes_user_id_idempotency_key", Note.user_id, Note.idempotency_key, unique=True)
+
+PREVIEW_LENGTH = 50
+
+# What list views select; full content is only loaded for a single note
+NOTE_SUMMARY_COLUMNS = (Note.id, Note.title, Note.preview, Note.content_length, Note.updated_at)
+
+def note_body(content: str):
+    """Column values for a note's content, including its stored preview."""
+    return {"content": content, "preview": content[:PREVIEW_LENGTH], "content_length": len(content)}
+
+class ConversationState(Base):
+    __tablename__ = "conversation_states"
+
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    state = Column(String, nullable=False)
+    updated_at = Column(DateTime(timezone=True), nullable=False, index=True)
+
+class Broadcast(Base):
+    __tablename__ = "broadcasts"
+
+    id = Column(Integer, primary_key=True)
+    text = Column(Text, nullable=False)
+    created_by = Column(Integer, ForeignKey("users.id", ondelete="SET NULL"))
+    status = Column(String, nullable=False, server_default="running")  # running or done
+    # users.id of the last user handled; a restarted broadcast carries on after it
+    cursor = Column(Integer, nullable=False, server_default="0")
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    finished_at = Column(DateTime(timezone=True))
+
+class BroadcastDelivery(Base):
+    __tablename__ = "broadcast_deliveries"
+
+    broadcast_id = Column(Integer, ForeignKey("broadcasts.id", ondelete="CASCADE"), primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    status = Column(String, nullable=False)  # sent, blocked or failed
+    delivered_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class ProcessedUpdate(Base):
+    __tablename__ = "processed_updates"
+
+    # Telegram's update_id; see src.dedup
+    update_id = Column(BigInteger, primary_key=True, autoincrement=False)
+    processed_at = Column(DateTime(timezone=True), nullable=False, index=True)
+
+class Reminder(Base):
+    __tablename__ = "reminders"
+
+    id = Column(Integer, primary_key=True)
+    note_id = Column(Integer, ForeignKey("notes.id", ondelete="CASCADE"), nullable=False, index=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
+    # The user's Telegram id: where it is sent, and which worker process schedules it
+    chat_id = Column(BigInteger, nullable=False)
+    due_at = Column(DateTime(timezone=True), nullable=False)
+    # Set while a scheduler is sending it; another one may take it over once this passes
+    claimed_until = Column(DateTime(timezone=True))
+    # Sends that failed for a reason that may pass (timeouts, flood control)
+    attempts = Column(Integer, nullable=False, default=0, server_default="0")
     created_at = Column(DateTime(timezone=True), server_default=func.now())
-    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+# The scheduler reads reminders in (due_at, id) order, one time window at a time
+Index("ix_reminders_due_at_id", Reminder.due_at, Reminder.id)
+
+class NoteRevision(Base):
+    """A version of a note from before an edit; see src.revisions."""
+    __tablename__ = "note_revisions"
+
+    id = Column(Integer, primary_key=True)
+    note_id = Column(Integer, ForeignKey("notes.id", ondelete="CASCADE"), nullable=False)
+    revision = Column(Integer, nullable=False)  # 1, 2, ... per note, oldest first
+    title = Column(String, nullable=False)
+    saved_at = Column(DateTime(timezone=True))  # When this version was written
+    # Compressed: the whole content if snapshot, else a delta from the next version
+    snapshot = Column(Boolean, nullable=False)
+    data = Column(LargeBinary, nullable=False)
+    # Deltas, and their bytes, from this revision back to the previous snapshot
+    chain = Column(Integer, nullable=False)
+    chain_bytes = Column(Integer, nullable=False)
+
+Index("ix_note_revisions_note_id_revision", NoteRevision.note_id, NoteRevision.revision, unique=True)
@@ -1,46 +1,277 @@
+import gzip
+import json
+import zlib
+from datetime import datetime, timedelta, timezone
 from sqlalchemy.future import select
-from sqlalchemy import update
-from src.db import SessionLocal
-from src.models import Note
+from sqlalchemy import insert, update, delete, tuple_
+from src.config import (NOTES_PAGE_SIZE, WRITE_BATCH_WINDOW, WRITE_BATCH_MAX_OPS, NOTES_TRANSFER_BATCH,
+                        IMPORT_MAX_NOTES)
+from src.db import session_scope, after_commit, run_write, WriteBatcher
+from src.models import Note, NoteRevision, Reminder, NOTE_SUMMARY_COLUMNS, note_body
+from src.metrics import REGISTRY
+from src import revisions, search, title_index
 
-async def create_note(user_id: int, title: str, content: str):
-    async with SessionLocal() as session:
-        note = Note(user_id=user_id, title=title, content=content)
+# Note creations and updates are group-committed when WRITE_BATCH_WINDOW is set
+write_batcher = WriteBatcher(WRITE_BATCH_WINDOW, WRITE_BATCH_MAX_OPS) if WRITE_BATCH_WINDOW > 0 else None
+
+NOTE_CREATES_REPLAYED = REGISTRY.counter(
+    "note_creates_replayed_total", "create_note calls that returned the note an earlier call with the same key made")
+
+async def create_note(user_id: int, title: str, content: str, idempotency_key: str = None):
+    """Create a note; with ``idempotency_key``, a retry returns the note the first call created."""
+    async def op(session):
+        if idempotency_key is not None:
+            result = await session.execute(select(Note).filter_by(user_id=user_id, idempotency_key=idempotency_key))
+            note = result.scalar()
+            if note is not None:
+                NOTE_CREATES_REPLAYED.inc()
+                return note
+        note = Note(user_id=user_id, title=title, idempotency_key=idempotency_key, **note_body(content))
         session.add(note)
-        await session.commit()
+        await session.flush()
         await session.refresh(note)
+        await search.index_note(session, note.id, user_id, title, content)
+        after_commit(session, lambda: title_index.note_saved(user_id, note.id, note.title, note.preview))
         return note
+    return await run_write(op, write_batcher)
+
+# Statement builders are shared with `python -m src.migrate --check`, which prints
+# their query plans to confirm they are served by ix_notes_user_id_updated_at.
+# Listings select NOTE_SUMMARY_COLUMNS and return plain rows (id, title, preview,
+# content_length, updated_at), never the content.
+
+def user_notes_query(user_id: int):
+    return (
+        select(*NOTE_SUMMARY_COLUMNS)
+        .filter_by(user_id=user_id)
+        .order_by(Note.updated_at.desc(), Note.id.desc())
+    )
+
+def note_by_id_query(note_id: int, user_id: int):
+    return select(Note).filter_by(id=note_id, user_id=user_id)
+
+def notes_page_query(user_id: int, cursor=None, before: bool = False, limit: int = NOTES_PAGE_SIZE):
+    """``cursor`` is the (updated_at, id) of the note the page is anchored on."""
+    stmt = select(*NOTE_SUMMARY_COLUMNS).filter_by(user_id=user_id)
+    if cursor is not None:
+        # A row value, so the index is range-scanned from the anchor rather than from the
+        # user's newest note
+        key, anchor = tuple_(Note.updated_at, Note.id), tuple_(*cursor)
+        stmt = stmt.where(key > anchor if before else key < anchor)
+    if before:
+        stmt = stmt.order_by(Note.updated_at.asc(), Note.id.asc())
+    else:
+        stmt = stmt.order_by(Note.updated_at.desc(), Note.id.desc())
+    # One extra row tells us whether another page exists
+    return stmt.limit(limit + 1)
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+def _page_cursor(note):
+    # Microseconds since the epoch and id: two ints, so it fits in callback data
+    updated_at = note.updated_at if note.updated_at.tzinfo else note.updated_at.replace(tzinfo=timezone.utc)
+    return (updated_at - _EPOCH) // timedelta(microseconds=1), note.id
 
 async def get_user_notes(user_id: int):
-    async with SessionLocal() as session:
-        result = await session.execute(
-            select(Note).filter_by(user_id=user_id).order_by(Note.updated_at.desc())
-        )
-        return result.scalars().all()
+    async with session_scope() as session:
+        result = await session.execute(user_notes_query(user_id))
+        return result.all()
+
+async def get_user_notes_page(user_id: int, cursor=None, before: bool = False,
+                              limit: int = NOTES_PAGE_SIZE):
+    """Return one page of note summaries, newest first, using keyset pagination on (updated_at, id).
+
+    ``cursor`` is a pair of ints naming the note the page is anchored on, as returned
+    here: the page holds the notes after it, or the ones before it when ``before`` is
+    true. It keeps working if that note is edited or deleted in the meantime. Returns
+    ``(notes, prev_cursor, next_cursor)``; a cursor is None when there is no such page.
+    """
+    if cursor is not None:
+        micros, note_id = cursor
+        cursor = (_EPOCH + timedelta(microseconds=micros), note_id)
+    async with session_scope() as session:
+        result = await session.execute(notes_page_query(user_id, cursor, before, limit))
+        notes = result.all()
+
+    has_more = len(notes) > limit
+    notes = notes[:limit]
+    if before:
+        notes.reverse()
+        has_prev, has_next = has_more, True
+    else:
+        has_prev, has_next = cursor is not None, has_more
+    if not notes:
+        return notes, None, None
+    return (
+        notes,
+        _page_cursor(notes[0]) if has_prev else None,
+        _page_cursor(notes[-1]) if has_next else None,
+    )
 
 async def get_note_by_id(note_id: int, user_id: int):
-    async with SessionLocal() as session:
-        result = await session.execute(
-            select(Note).filter_by(id=note_id, user_id=user_id)
-        )
+    async with session_scope() as session:
+        result = await session.execute(note_by_id_query(note_id, user_id))
         return result.scalar()
 
 async def update_note(note_id: int, user_id: int, title: str, content: str):
-    async with SessionLocal() as session:
+    """Overwrite a note, keeping the version it replaces in its history (src.revisions)."""
+    async def op(session):
+        result = await session.execute(
+            select(Note.title, Note.content, Note.updated_at).filter_by(id=note_id, user_id=user_id)
+        )
+        old = result.one_or_none()
+        if old is None:
+            return None
+        if (old.title, old.content) != (title, content):
+            await revisions.record_revision(session, note_id, old, content)
         stmt = (
             update(Note)
             .where(Note.id == note_id, Note.user_id == user_id)
-            .values(title=title, content=content)
+            .values(title=title, **note_body(content))
+            .returning(Note)
         )
-        await session.execute(stmt)
-        await session.commit()
-        return await get_note_by_id(note_id, user_id)
+        result = await session.execute(stmt)
+        note = result.scalar()
+        if note:
+            await search.index_note(session, note.id, user_id, title, content)
+            after_commit(session, lambda: title_index.note_saved(user_id, note.id, note.title, note.preview))
+        return note
+    return await run_write(op, write_batcher)
 
 async def delete_note(note_id: int, user_id: int):
-    async with SessionLocal() as session:
-        note = await get_note_by_id(note_id, user_id)
-        if note:
-            await session.delete(note)
-            await session.commit()
-            return True
-        return False
+    async with session_scope() as session:
+        result = await session.execute(
+            delete(Note).where(Note.id == note_id, Note.user_id == user_id)
+        )
+        if result.rowcount == 0:
+            return False
+        await search.unindex_note(session, note_id)
+        # SQLite doesn't enforce the foreign keys' ON DELETE CASCADE
+        await session.execute(delete(Reminder).where(Reminder.note_id == note_id))
+        await session.execute(delete(NoteRevision).where(NoteRevision.note_id == note_id))
+        after_commit(session, lambda: title_index.note_deleted(user_id, note_id))
+        return True
+
+async def get_note_contents(user_id: int, note_ids):
+    """Return {note_id: content} for those of ``note_ids`` the user owns."""
+    if not note_ids:
+        return {}
+    async with session_scope() as session:
+        result = await session.execute(
+            select(Note.id, Note.content).where(Note.user_id == user_id, Note.id.in_(note_ids))
+        )
+        return dict(result.all())
+
+async def search_notes(user_id: int, terms: str, offset: int = 0, limit: int = NOTES_PAGE_SIZE):
+    """Full-text search over the user's notes, best match first.
+
+    Returns ``(summaries, has_more)`` for the page starting at ``offset``.
+    """
+    async with session_scope() as session:
+        notes = await search.search(session, user_id, terms, limit + 1, offset)
+    return notes[:limit], len(notes) > limit
+
+# /export and /import exchange gzip-compressed JSON lines, one note per line:
+# {"title": ..., "content": ..., "created_at": ..., "updated_at": ...}
+
+MAX_IMPORT_LINE = 1024 * 1024
+
+def _export_line(row):
+    return json.dumps({
+        "title": row.title,
+        "content": row.content,
+        "created_at": row.created_at.isoformat() if row.created_at else None,
+        "updated_at": row.updated_at.isoformat() if row.updated_at else None,
+    }, ensure_ascii=False) + "\n"
+
+async def export_notes(user_id: int, out):
+    """Write the user's notes to the binary file ``out`` as gzip JSON lines, oldest first.
+
+    Rows come from a server-side cursor NOTES_TRANSFER_BATCH at a time, so memory use
+    doesn't grow with the number of notes. Returns how many notes were written.
+    """
+    stmt = (
+        select(Note.title, Note.content, Note.created_at, Note.updated_at)
+        .filter_by(user_id=user_id)
+        .order_by(Note.updated_at.asc(), Note.id.asc())
+        .execution_options(yield_per=NOTES_TRANSFER_BATCH)
+    )
+    count = 0
+    with gzip.GzipFile(fileobj=out, mode="wb") as archive:
+        async with session_scope() as session:
+            result = await session.stream(stmt)
+            async for rows in result.partitions():
+                archive.write("".join(_export_line(row) for row in rows).encode())
+                count += len(rows)
+    return count
+
+def _parse_time(value, number):
+    if value is None:
+        return datetime.now(timezone.utc)
+    try:
+        return datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"line {number}: invalid timestamp {value!r}") from None
+
+def _read_export(fileobj):
+    """Yield (title, content, created_at, updated_at) for each line of an export.
+
+    Plain, uncompressed JSON lines are accepted too. Raises ValueError on the first
+    line that isn't a note.
+    """
+    compressed = fileobj.read(2) == b"\x1f\x8b"
+    fileobj.seek(0)
+    lines = gzip.GzipFile(fileobj=fileobj, mode="rb") if compressed else fileobj
+    number = 0
+    while True:
+        try:
+            line = lines.readline(MAX_IMPORT_LINE + 1)
+        except (OSError, EOFError, zlib.error):
+            raise ValueError("the file is not a valid gzip archive") from None
+        if not line:
+            return
+        number += 1
+        if len(line) > MAX_IMPORT_LINE:
+            raise ValueError(f"line {number} is too long")
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            raise ValueError(f"line {number} is not valid JSON") from None
+        title = record.get("title") if isinstance(record, dict) else None
+        content = record.get("content") if isinstance(record, dict) else None
+        if not isinstance(title, str) or not title.strip() or not isinstance(content, str):
+            raise ValueError(f"line {number} needs a title and content")
+        yield (title, content, _parse_time(record.get("created_at"), number),
+               _parse_time(record.get("updated_at"), number))
+
+async def _insert_notes(session, rows):
+    result = await session.execute(insert(Note).returning(Note.id), rows)
+    await search.index_notes(session, result.scalars().all())
+
+async def import_notes(user_id: int, fileobj):
+    """Add every note in an export (a binary file) to the user's notes.
+
+    Notes go in with one executemany INSERT per NOTES_TRANSFER_BATCH, all in one
+    transaction: if any line is invalid, or there are more than IMPORT_MAX_NOTES, a
+    ValueError is raised and nothing is imported. Returns the number of notes added.
+    """
+    count = 0
+    async with session_scope() as session:
+        # A savepoint, so a bad file rolls back only the import inside a handler's transaction
+        async with session.begin_nested():
+            batch = []
+            for title, content, created_at, updated_at in _read_export(fileobj):
+                count += 1
+                if count > IMPORT_MAX_NOTES:
+                    raise ValueError(f"an import may hold at most {IMPORT_MAX_NOTES} notes")
+                batch.append({"user_id": user_id, "title": title, "created_at": created_at,
+                              "updated_at": updated_at, **note_body(content)})
+                if len(batch) == NOTES_TRANSFER_BATCH:
+                    await _insert_notes(session, batch)
+                    batch = []
+            if batch:
+                await _insert_notes(session, batch)
+        after_commit(session, lambda: title_index.forget(user_id))
+    return count
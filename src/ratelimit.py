@@ -0,0 +1,327 @@
+"""Outbound Bot API rate limiting.
+
+Telegram accepts about 30 messages a second from a bot and about one a second per chat,
+and answers anything beyond that with 429 RetryAfter. OutboundRateLimiter keeps every
+chat-bound request behind a global and a per-chat token bucket, so bursts queue here
+instead of tripping flood control.
+"""
+import asyncio
+import contextlib
+import functools
+import heapq
+import itertools
+import logging
+import time
+from contextvars import ContextVar
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+from src.metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+# Pass as ``rate_limit_args`` to a Bot API call; lower values are sent first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 10
+
+# Pending edits of the same message collapse into one request carrying the latest content
+COALESCED_METHODS = frozenset({"editMessageText", "editMessageReplyMarkup"})
+
+OUTBOUND_QUEUED = REGISTRY.counter(
+    "telegram_outbound_queued_total", "Chat-bound Bot API requests queued by the rate limiter")
+OUTBOUND_COALESCED = REGISTRY.counter(
+    "telegram_outbound_coalesced_total", "Message edits merged into a pending edit of the same message")
+OUTBOUND_RETRY_AFTER = REGISTRY.counter(
+    "telegram_outbound_retry_after_total", "429 RetryAfter responses received from the Bot API")
+
+# Set by a caller around a Bot API call: ``hook(error)`` runs if the call's edit was deferred
+# (so the caller already got True back) and then failed
+on_deferred_failure = ContextVar("on_deferred_failure", default=None)
+
+class TokenBucket:
+    """``rate`` tokens a second, holding at most ``capacity``; starts full."""
+
+    __slots__ = ("rate", "capacity", "_tokens", "_updated")
+
+    def __init__(self, rate: float, capacity: float, now: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = now
+
+    def wait_time(self, now: float) -> float:
+        """Seconds until a token is available (0 if one is now)."""
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        return 0.0 if self._tokens >= 1 else (1 - self._tokens) / self.rate
+
+    def take(self):
+        self._tokens -= 1
+
+    def is_full(self, now: float) -> bool:
+        self.wait_time(now)
+        return self._tokens >= self.capacity
+
+class _Request:
+    __slots__ = ("priority", "seq", "key", "callback", "args", "kwargs", "futures", "retries")
+
+    def __init__(self, priority, seq, key, callback, args, kwargs):
+        self.priority = priority
+        self.seq = seq
+        self.key = key
+        self.callback = callback
+        self.args = args
+        self.kwargs = kwargs
+        self.futures = []
+        self.retries = 0
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+class _Chat:
+    __slots__ = ("bucket", "queue", "busy")
+
+    def __init__(self, bucket):
+        self.bucket = bucket
+        self.queue = []  # heap of _Request
+        self.busy = False  # a request to this chat is in flight; keeps the chat in order
+
+class OutboundRateLimiter(BaseRateLimiter):
+    """Token-bucket limiter for PTB's ``ApplicationBuilder.rate_limiter()``.
+
+    Requests with a ``chat_id`` are queued per chat in priority order (``rate_limit_args``,
+    default PRIORITY_INTERACTIVE) and sent one at a time per chat, each spending a token
+    from the chat's bucket and from the global bucket. Other requests (answerCallbackQuery,
+    getMe, webhooks) are sent straight away.
+
+    An edit of a message that already has an edit queued replaces that edit's content
+    instead of queueing another one. An edit that cannot be sent at once does not hold up
+    its caller: the call returns True and the edit goes out when the chat's turn comes,
+    so a burst of taps costs one request carrying the final text. Failures of such edits
+    are logged, and passed to the caller's ``on_deferred_failure`` hook if it set one.
+
+    A 429 pauses all queued sending for its ``retry_after`` and the request is retried up
+    to ``max_retries`` times. A ``global_rate`` of 0 sends everything straight away.
+
+    ``before_request``, if given, is awaited in the caller's task before each request is
+    queued or sent; src.main uses it to give back the calling handler's idle DB connection.
+    """
+
+    def __init__(self, global_rate: float = 30, chat_rate: float = 1, chat_burst: int = 3,
+                 max_retries: int = 3, clock=time.monotonic, before_request=None):
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.before_request = before_request
+        self._clock = clock
+        # No burst allowance globally: a full bucket plus the refill could exceed the limit
+        self._global = TokenBucket(global_rate, 1, clock())
+        self._chats = {}
+        self._pending_edits = {}  # (method, chat_id, message_id) -> queued _Request
+        self._ready = []  # heap of (priority, seq, chat_id) for chats that may send now
+        self._waiting = []  # heap of (time a token is due, chat_id)
+        self._paused_until = 0.0
+        self._seq = itertools.count()
+        self._wakeup = None
+        self._dispatcher = None
+        self._sending = set()
+        self._pruned_at = clock()
+
+    async def initialize(self):
+        # PTB initializes the bot once for the application and once for its updater
+        if self._dispatcher is None:
+            self._wakeup = asyncio.Event()
+            self._dispatcher = asyncio.create_task(self._dispatch())
+
+    async def drain(self, timeout: float = None):
+        """Wait until nothing is queued or in flight; False if ``timeout`` ran out first."""
+        deadline = None if timeout is None else self._clock() + timeout
+        while self.queued() or self._sending:
+            if deadline is not None and self._clock() >= deadline:
+                return False
+            await asyncio.sleep(0.05)
+        return True
+
+    async def shutdown(self):
+        # Deferred edits have already been reported as sent; give them a chance to go out
+        if self._dispatcher is not None and not await self.drain(timeout=5):
+            logger.warning("Dropping %s queued outbound requests at shutdown", self.queued())
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._dispatcher
+            self._dispatcher = None
+        for chat in self._chats.values():
+            for request in chat.queue:
+                for future in request.futures:
+                    if not future.done():
+                        future.cancel()
+        self._chats.clear()
+        self._pending_edits.clear()
+
+    def queued(self):
+        """Number of chat-bound requests waiting to be sent."""
+        return sum(len(chat.queue) for chat in self._chats.values())
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        if self.before_request is not None:
+            await self.before_request()
+        chat_id = data.get("chat_id")
+        if chat_id is None or self.global_rate <= 0:
+            return await self._send_now(callback, args, kwargs)
+
+        now = self._clock()
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            chat = self._chats[chat_id] = _Chat(TokenBucket(self.chat_rate, self.chat_burst, now))
+        future = asyncio.get_running_loop().create_future()
+
+        key = None
+        if endpoint in COALESCED_METHODS and "message_id" in data:
+            key = (endpoint, chat_id, data["message_id"])
+        request = self._pending_edits.get(key) if key is not None else None
+        if request is not None:
+            # Still queued: send the newest content in its place
+            OUTBOUND_COALESCED.inc()
+            request.args, request.kwargs = args, kwargs
+        else:
+            OUTBOUND_QUEUED.inc()
+            priority = rate_limit_args if isinstance(rate_limit_args, int) else PRIORITY_INTERACTIVE
+            request = _Request(priority, next(self._seq), key, callback, args, kwargs)
+            heapq.heappush(chat.queue, request)
+            if key is not None:
+                self._pending_edits[key] = request
+            if chat.queue[0] is request:
+                self._schedule(chat_id, chat, now)
+        request.futures.append(future)
+
+        if key is not None and (chat.busy or chat.queue[0] is not request
+                                or chat.bucket.wait_time(now) > 0 or now < self._paused_until):
+            future.add_done_callback(functools.partial(_deferred_done, on_deferred_failure.get()))
+            return True
+        return await future
+
+    async def _send_now(self, callback, args, kwargs):
+        for attempt in range(self.max_retries + 1):
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                OUTBOUND_RETRY_AFTER.inc()
+                if attempt == self.max_retries:
+                    raise
+                await asyncio.sleep(e.retry_after)
+
+    def _schedule(self, chat_id, chat, now):
+        """Queue the chat for sending once it is idle and has a token."""
+        if chat.busy or not chat.queue:
+            return
+        wait = chat.bucket.wait_time(now)
+        if wait > 0:
+            heapq.heappush(self._waiting, (now + wait, chat_id))
+        else:
+            head = chat.queue[0]
+            heapq.heappush(self._ready, (head.priority, head.seq, chat_id))
+        self._wakeup.set()
+
+    def _next_ready(self, now):
+        """Pop the best chat that can send now, skipping entries that went stale."""
+        while self._waiting and self._waiting[0][0] <= now:
+            _, chat_id = heapq.heappop(self._waiting)
+            chat = self._chats.get(chat_id)
+            if chat is not None:
+                self._schedule(chat_id, chat, now)
+        while self._ready:
+            priority, seq, chat_id = self._ready[0]
+            chat = self._chats.get(chat_id)
+            if chat is None or chat.busy or not chat.queue or chat.queue[0].seq != seq:
+                heapq.heappop(self._ready)
+                continue
+            return chat_id, chat
+        return None
+
+    async def _dispatch(self):
+        while True:
+            now = self._clock()
+            if now < self._paused_until:
+                await asyncio.sleep(self._paused_until - now)
+                continue
+            if now - self._pruned_at > 60:
+                self._prune(now)
+            ready = self._next_ready(now)
+            if ready is None:
+                self._wakeup.clear()
+                timeout = self._waiting[0][0] - now if self._waiting else None
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            wait = self._global.wait_time(now)
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+
+            heapq.heappop(self._ready)
+            chat_id, chat = ready
+            request = heapq.heappop(chat.queue)
+            if request.key is not None and self._pending_edits.get(request.key) is request:
+                del self._pending_edits[request.key]
+            chat.busy = True
+            chat.bucket.take()
+            self._global.take()
+            task = asyncio.create_task(self._send(chat_id, chat, request))
+            self._sending.add(task)
+            task.add_done_callback(self._sending.discard)
+
+    async def _send(self, chat_id, chat, request):
+        try:
+            result = await request.callback(*request.args, **request.kwargs)
+        except RetryAfter as e:
+            OUTBOUND_RETRY_AFTER.inc()
+            if request.retries < self.max_retries:
+                request.retries += 1
+                self._paused_until = max(self._paused_until, self._clock() + e.retry_after)
+                logger.info("Flood control hit; pausing outbound requests for %ss", e.retry_after)
+                newer = self._pending_edits.get(request.key) if request.key is not None else None
+                if newer is not None:
+                    # The message was edited again meanwhile; that edit carries the latest content
+                    OUTBOUND_COALESCED.inc()
+                    newer.futures.extend(request.futures)
+                else:
+                    # Same priority and sequence number, so it goes out first for its chat, and
+                    # later edits of the message coalesce into it again
+                    heapq.heappush(chat.queue, request)
+                    if request.key is not None:
+                        self._pending_edits[request.key] = request
+            else:
+                _resolve(request.futures, error=e)
+        except Exception as e:
+            _resolve(request.futures, error=e)
+        else:
+            _resolve(request.futures, result=result)
+        finally:
+            chat.busy = False
+            self._schedule(chat_id, chat, self._clock())
+
+    def _prune(self, now):
+        """Forget idle chats whose bucket has refilled; a new one starts full anyway."""
+        for chat_id in [chat_id for chat_id, chat in self._chats.items()
+                        if not chat.busy and not chat.queue and chat.bucket.is_full(now)]:
+            del self._chats[chat_id]
+        self._pruned_at = now
+
+def _resolve(futures, result=None, error=None):
+    for future in futures:
+        if future.done():
+            continue
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+def _deferred_done(hook, future):
+    if future.cancelled() or future.exception() is None:
+        return
+    logger.warning("Deferred message edit failed: %s", future.exception())
+    if hook is not None:
+        hook(future.exception())
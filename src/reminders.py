@@ -0,0 +1,369 @@
+"""Note reminders: "remind me about this note at 18:00".
+
+Reminders live in the reminders table, one row each until it has been sent, so millions
+can be pending without any of them being held in memory. The scheduler keeps only those
+due within the next REMINDER_WINDOW seconds in a heap, reading the table in (due_at, id)
+order through ix_reminders_due_at_id, and reads the next stretch once half the window
+has passed. Reminders added in this process for a time already read are pushed straight
+into the heap.
+
+Due reminders are claimed in batches with a lease (claimed_until) before they are sent,
+and deleted once sent, so neither a restart nor a second bot process fires them twice.
+Only a send that completed but whose delete didn't commit (a crash in between) is
+repeated, after its lease runs out. A send that failed for a reason that may pass
+(a timeout, flood control) keeps its row and is tried again when the lease runs out,
+up to REMINDER_MAX_ATTEMPTS times. Reminders missed while the bot was down are sent on
+start. In multi-process mode each worker schedules its own users' reminders.
+"""
+import asyncio
+import heapq
+import logging
+import re
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+from sqlalchemy import and_, delete, func, or_, true, update
+from sqlalchemy.future import select
+from telegram.error import BadRequest, Forbidden, TelegramError
+from src.auth import invalidate_user
+from src.config import (REMINDER_TIMEZONE, REMINDER_WINDOW, REMINDER_LOAD_BATCH, REMINDER_BATCH, REMINDER_RATE,
+                        REMINDER_SENDERS, REMINDER_LEASE, REMINDER_MAX_ATTEMPTS, REMINDER_MAX_PER_USER)
+from src.db import session_scope, after_commit
+from src.metrics import REGISTRY
+from src.models import Reminder, Note, User
+from src.ratelimit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+REMINDERS_SENT = REGISTRY.counter(
+    "reminders_sent_total", "Reminder sends, by outcome (retrying ones are tried again later)", ["status"])
+
+TIMEZONE = ZoneInfo(REMINDER_TIMEZONE)
+
+def utcnow():
+    return datetime.now(timezone.utc)
+
+def _utc(value):
+    # SQLite hands back naive datetimes; everything is stored in UTC
+    return value if value.tzinfo is not None else value.replace(tzinfo=timezone.utc)
+
+_RELATIVE = re.compile(r"in\s+(\d+)\s*(m|min|mins|minutes?|h|hours?|d|days?)", re.IGNORECASE)
+_UNITS = {"m": "minutes", "h": "hours", "d": "days"}
+
+def parse_reminder_time(text: str, now: datetime = None):
+    """Read "18:00", "2026-10-20 09:00" or "in 30m"/"in 2h"/"in 1d" as a UTC datetime.
+
+    Wall-clock times are in REMINDER_TIMEZONE; a bare time that has passed today means
+    tomorrow. Returns None if ``text`` isn't one of these, or is in the past.
+    """
+    now = now or utcnow()
+    text = text.strip()
+    relative = _RELATIVE.fullmatch(text)
+    if relative:
+        amount, unit = int(relative.group(1)), _UNITS[relative.group(2)[0].lower()]
+        return now + timedelta(**{unit: amount}) if amount > 0 else None
+
+    local_now = now.astimezone(TIMEZONE)
+    for fmt in ("%H:%M", "%Y-%m-%d %H:%M"):
+        try:
+            parsed = datetime.strptime(text, fmt)
+        except ValueError:
+            continue
+        if fmt == "%H:%M":
+            due = local_now.replace(hour=parsed.hour, minute=parsed.minute, second=0, microsecond=0)
+            if due <= local_now:
+                due = (due.replace(tzinfo=None) + timedelta(days=1)).replace(tzinfo=TIMEZONE)
+        else:
+            due = parsed.replace(tzinfo=TIMEZONE)
+        due = due.astimezone(timezone.utc)
+        return due if due > now else None
+    return None
+
+def format_local(due_at: datetime):
+    return _utc(due_at).astimezone(TIMEZONE).strftime("%Y-%m-%d %H:%M")
+
+async def add_reminder(user, note_id: int, due_at: datetime):
+    """Remind ``user`` about a note at ``due_at`` (aware). Raises ValueError past the per-user cap."""
+    async with session_scope() as session:
+        pending = await session.scalar(select(func.count()).select_from(Reminder).filter_by(user_id=user.id))
+        if pending >= REMINDER_MAX_PER_USER:
+            raise ValueError(f"you can have at most {REMINDER_MAX_PER_USER} reminders pending")
+        reminder = Reminder(note_id=note_id, user_id=user.id, chat_id=int(user.telegram_id), due_at=due_at)
+        session.add(reminder)
+        await session.flush()
+        after_commit(session, lambda: _scheduled(reminder.chat_id, reminder.id, due_at))
+    return reminder
+
+async def note_reminders(user_id: int, note_id: int):
+    """Return the due times of a note's pending reminders, soonest first."""
+    async with session_scope() as session:
+        result = await session.execute(
+            select(Reminder.due_at).filter_by(user_id=user_id, note_id=note_id).order_by(Reminder.due_at)
+        )
+        return [_utc(due_at) for due_at in result.scalars()]
+
+async def clear_reminders(user_id: int, note_id: int):
+    """Delete a note's pending reminders; returns how many there were."""
+    async with session_scope() as session:
+        result = await session.execute(delete(Reminder).filter_by(user_id=user_id, note_id=note_id))
+    # Any still in a scheduler's heap are skipped when they come due
+    return result.rowcount
+
+class ReminderScheduler:
+    """Sends due reminders; ``clock`` returns the current aware UTC datetime.
+
+    ``open_note(note_id)`` builds the markup sent with a reminder, if given. With
+    ``workers`` > 1 it only handles chats whose id is ``index`` modulo ``workers``, the
+    same split src.workers routes updates by. ``tick()`` does one round of work without
+    waiting: it sends what is due as far as ``rate`` allows by ``clock``, and leaves the
+    rest for a later tick, so tests can drive the scheduler with their own clock.
+    """
+
+    def __init__(self, bot, open_note=None, clock=utcnow, index: int = 0, workers: int = 1,
+                 window: float = REMINDER_WINDOW, load_batch: int = REMINDER_LOAD_BATCH, batch: int = REMINDER_BATCH,
+                 rate: float = REMINDER_RATE):
+        self.bot = bot
+        self.open_note = open_note
+        self.clock = clock
+        self.index = index
+        self.workers = workers
+        self.window = timedelta(seconds=window)
+        self.load_batch = load_batch
+        self.batch = batch
+        self._heap = []  # (due_at, reminder id)
+        self._queued = set()  # ids in the heap
+        # Every reminder due up to the horizon has been read; the cursor is the last (due_at, id) read
+        self._horizon = None
+        self._cursor = None
+        self._refilling = False
+        self._wake = asyncio.Event()
+        self._stopping = False
+        # Up to a second's worth of sends at once, timed by the same clock as everything else
+        self._bucket = TokenBucket(rate, max(rate, 1), clock().timestamp())
+        self._senders = asyncio.Semaphore(REMINDER_SENDERS)
+
+    def __len__(self):
+        return len(self._heap)
+
+    def handles(self, chat_id: int):
+        return chat_id % self.workers == self.index
+
+    def _push(self, due_at, reminder_id):
+        if reminder_id not in self._queued:
+            self._queued.add(reminder_id)
+            heapq.heappush(self._heap, (due_at, reminder_id))
+
+    def _requeue(self, reminder_ids, due_at):
+        for reminder_id in reminder_ids:
+            self._push(due_at, reminder_id)
+
+    def add(self, reminder_id: int, due_at: datetime):
+        """Take a reminder that was just committed, if its time has already been read."""
+        if self._refilling or (self._horizon is not None and due_at <= self._horizon):
+            self._push(due_at, reminder_id)
+            self._wake.set()
+
+    def _owned(self):
+        return Reminder.chat_id % self.workers == self.index if self.workers > 1 else true()
+
+    async def refill(self, now: datetime):
+        """Read reminders due up to ``now`` + window that haven't been read yet."""
+        until = now + self.window
+        limit = max(self.load_batch - len(self._heap), 1)
+        stmt = select(Reminder.id, Reminder.due_at).where(Reminder.due_at <= until, self._owned())
+        if self._cursor is not None:
+            cursor_due, cursor_id = self._cursor
+            stmt = stmt.where(or_(Reminder.due_at > cursor_due,
+                                  and_(Reminder.due_at == cursor_due, Reminder.id > cursor_id)))
+        self._refilling = True
+        try:
+            async with session_scope() as session:
+                result = await session.execute(stmt.order_by(Reminder.due_at, Reminder.id).limit(limit))
+                rows = [(_utc(due_at), reminder_id) for reminder_id, due_at in result]
+        finally:
+            self._refilling = False
+        for due_at, reminder_id in rows:
+            self._push(due_at, reminder_id)
+        if rows:
+            self._cursor = rows[-1]
+        # A full batch may have stopped partway through the window
+        self._horizon = rows[-1][0] if len(rows) == limit else until
+
+    def _needs_refill(self, now):
+        # Once half the window has passed, unless the heap is already full
+        return self._horizon is None or (
+            now + self.window / 2 >= self._horizon and len(self._heap) < self.load_batch)
+
+    async def tick(self):
+        """Read the next window if it's time, then send what is due, as far as the rate allows."""
+        now = self.clock()
+        if self._needs_refill(now):
+            await self.refill(now)
+        while self._heap and self._heap[0][0] <= now and not self._stopping:
+            due = []
+            while (self._heap and self._heap[0][0] <= now and len(due) < self.batch
+                   and self._bucket.wait_time(now.timestamp()) == 0):
+                self._bucket.take()
+                _, reminder_id = heapq.heappop(self._heap)
+                self._queued.discard(reminder_id)
+                due.append(reminder_id)
+            if not due:
+                # Out of sends for now; run() waits for the bucket to refill
+                break
+            try:
+                await self._fire(due, now)
+            except Exception:
+                # Back in the heap for the next tick; any claimed already wait for their lease
+                for reminder_id in due:
+                    self._push(now, reminder_id)
+                raise
+
+    async def _claim(self, reminder_ids, now):
+        lease = now + timedelta(seconds=REMINDER_LEASE)
+        async with session_scope() as session:
+            result = await session.execute(
+                update(Reminder)
+                .where(Reminder.id.in_(reminder_ids),
+                       or_(Reminder.claimed_until.is_(None), Reminder.claimed_until <= now))
+                .values(claimed_until=lease)
+                .returning(Reminder.id)
+            )
+            claimed = set(result.scalars())
+            # Leased by another scheduler: try again when the lease runs out, in case it died
+            result = await session.execute(
+                select(Reminder.id, Reminder.claimed_until)
+                .where(Reminder.id.in_([i for i in reminder_ids if i not in claimed]))
+            )
+            for reminder_id, claimed_until in result:
+                self._push(_utc(claimed_until), reminder_id)
+            if not claimed:
+                return []
+            result = await session.execute(
+                select(Reminder.id, Reminder.note_id, Reminder.attempts, Note.title, Note.preview,
+                       Note.content_length, Reminder.user_id, Reminder.chat_id, User.telegram_id, User.is_locked)
+                .join(Note, Note.id == Reminder.note_id)
+                .join(User, User.id == Reminder.user_id)
+                .where(Reminder.id.in_(claimed))
+            )
+            found = result.all()
+            # Reminders whose note is gone are dropped without a message
+            orphans = claimed - {row.id for row in found}
+            if orphans:
+                await session.execute(delete(Reminder).where(Reminder.id.in_(orphans)))
+        return found
+
+    async def _fire(self, reminder_ids, now):
+        reminders = await self._claim(reminder_ids, now)
+
+        async def deliver(reminder):
+            async with self._senders:
+                markup = self.open_note(reminder.note_id) if self.open_note else None
+                return await _send(self.bot, reminder, markup)
+
+        statuses = await asyncio.gather(*(deliver(reminder) for reminder in reminders))
+        if not reminders:
+            return
+        retry = []
+        for i, (reminder, status) in enumerate(zip(reminders, statuses)):
+            if status == "failed" and reminder.attempts + 1 < REMINDER_MAX_ATTEMPTS:
+                retry.append(reminder.id)
+                statuses[i] = "retrying"
+        blocked = [(r.user_id, r.telegram_id) for r, status in zip(reminders, statuses) if status == "blocked"]
+        async with session_scope() as session:
+            await session.execute(delete(Reminder).where(Reminder.id.in_(
+                [r.id for r, status in zip(reminders, statuses) if status != "retrying"])))
+            if retry:
+                # Still leased; sent again once the lease runs out, here or by whoever is running then
+                await session.execute(
+                    update(Reminder).where(Reminder.id.in_(retry)).values(attempts=Reminder.attempts + 1)
+                )
+                lease = now + timedelta(seconds=REMINDER_LEASE)
+                after_commit(session, lambda: self._requeue(retry, lease))
+            if blocked:
+                await session.execute(
+                    update(User).where(User.id.in_([user_id for user_id, _ in blocked])).values(blocked_at=func.now())
+                )
+                after_commit(session, lambda: _invalidate_users(blocked))
+        for status in statuses:
+            REMINDERS_SENT.inc(status=status)
+
+    def _next_wake(self, now):
+        waits = [self.window.total_seconds() / 2]
+        if self._heap and self._heap[0][0] <= now:
+            # Still due after a tick: the send rate ran out, so wait for the bucket to refill
+            waits.append(self._bucket.capacity / self._bucket.rate)
+        elif self._heap:
+            waits.append((self._heap[0][0] - now).total_seconds())
+        if self._horizon is not None:
+            waits.append((self._horizon - self.window / 2 - now).total_seconds())
+        return max(min(waits), 0)
+
+    async def run(self):
+        """Send reminders as they come due until stop() is called."""
+        while not self._stopping:
+            try:
+                await self.tick()
+            except Exception:
+                logger.exception("Reminder scheduler failed; retrying")
+                await asyncio.sleep(5)
+            if self._stopping:
+                break
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), self._next_wake(self.clock()))
+            except asyncio.TimeoutError:
+                pass
+
+    def stop(self):
+        self._stopping = True
+        self._wake.set()
+
+def _invalidate_users(users):
+    for _, telegram_id in users:
+        invalidate_user(telegram_id)
+
+async def _send(bot, reminder, markup):
+    text = f"⏰ Reminder: {reminder.title}"
+    if not reminder.is_locked:
+        # A locked NotePad doesn't show note contents in chat
+        text += f"\n\n{reminder.preview}{'...' if reminder.content_length > len(reminder.preview) else ''}"
+    try:
+        await bot.send_message(reminder.chat_id, text, reply_markup=markup)
+        return "sent"
+    except Forbidden:
+        return "blocked"
+    except BadRequest as e:
+        # Retrying won't help (chat not found, ...)
+        logger.info("Reminder %s to %s rejected: %s", reminder.id, reminder.chat_id, e)
+        return "rejected"
+    except TelegramError as e:
+        # Timeouts, network errors, flood control the limiter gave up on
+        logger.info("Reminder %s to %s failed (attempt %s): %s", reminder.id, reminder.chat_id,
+                    reminder.attempts + 1, e)
+        return "failed"
+
+_scheduler = None
+_task = None
+REGISTRY.gauge("reminders_queued", "Reminders due soon, held in memory", lambda: len(_scheduler or ()))
+
+def _scheduled(chat_id, reminder_id, due_at):
+    if _scheduler is not None and _scheduler.handles(chat_id):
+        _scheduler.add(reminder_id, due_at)
+
+def start_reminders(bot, open_note=None, index: int = 0, workers: int = 1):
+    """Start sending reminders in the background."""
+    global _scheduler, _task
+    _scheduler = ReminderScheduler(bot, open_note, index=index, workers=workers)
+    _task = asyncio.create_task(_scheduler.run())
+
+async def stop_reminders(timeout: float = 10):
+    """Stop the scheduler, letting a batch being sent finish and be recorded first."""
+    global _scheduler, _task
+    if _task is None:
+        return
+    _scheduler.stop()
+    try:
+        await asyncio.wait_for(_task, timeout)
+    except asyncio.TimeoutError:
+        # wait_for has cancelled it; what it was sending is retried once the lease passes
+        pass
+    _scheduler = _task = None
@@ -0,0 +1,83 @@
+"""Skip message edits that would not change anything.
+
+Telegram rejects an edit whose text and keyboard equal what the message already shows
+("message is not modified"), after a full round trip. RenderCache remembers a hash of
+what was last rendered into each (chat, message) so such edits are dropped locally.
+An edit the rate limiter deferred is remembered when it is queued, and forgotten again
+if it fails once sent.
+"""
+import logging
+from telegram.error import BadRequest
+from src.cache import TTLCache
+from src.config import RENDER_CACHE_SIZE, RENDER_CACHE_TTL
+from src.metrics import REGISTRY
+from src.ratelimit import on_deferred_failure
+
+logger = logging.getLogger(__name__)
+
+EDITS_SUPPRESSED = REGISTRY.counter(
+    "telegram_edits_suppressed_total",
+    "Message edits skipped because the message already showed that content, by how it was known",
+    ["reason"])
+
+def _fingerprint(text, reply_markup):
+    # Markup objects compare and hash by their buttons
+    return hash((text, reply_markup))
+
+def _not_modified(error):
+    return isinstance(error, BadRequest) and "not modified" in str(error)
+
+class RenderCache:
+    def __init__(self, maxsize: int = RENDER_CACHE_SIZE, ttl: float = RENDER_CACHE_TTL):
+        self._rendered = TTLCache(maxsize, ttl)
+
+    def remember(self, message, text, reply_markup=None):
+        """Record what ``message`` (a telegram.Message) now shows."""
+        self._rendered.set((message.chat_id, message.message_id), _fingerprint(text, reply_markup))
+
+    async def edit(self, query, text, reply_markup=None):
+        """``query.edit_message_text(text, reply_markup=...)`` unless the message already shows it.
+
+        Returns False when the edit was skipped.
+        """
+        message = query.message
+        if message is None:
+            # Inline messages have no chat to key on
+            await query.edit_message_text(text, reply_markup=reply_markup)
+            return True
+
+        key = (message.chat_id, message.message_id)
+        fingerprint = _fingerprint(text, reply_markup)
+        if self._rendered.get(key) == fingerprint:
+            EDITS_SUPPRESSED.inc(reason="cached")
+            return False
+
+        def forget(error):
+            # A deferred edit failed after we returned; unless a later render replaced it
+            if not _not_modified(error) and self._rendered.get(key) == fingerprint:
+                self._rendered.pop(key)
+
+        token = on_deferred_failure.set(forget)
+        try:
+            await query.edit_message_text(text, reply_markup=reply_markup)
+        except BadRequest as e:
+            if not _not_modified(e):
+                self._rendered.pop(key)
+                raise
+            # We didn't know, but Telegram did (e.g. after a restart)
+            EDITS_SUPPRESSED.inc(reason="not_modified")
+        finally:
+            on_deferred_failure.reset(token)
+        self._rendered.set(key, fingerprint)
+        return True
+
+    def stats(self):
+        return self._rendered.stats()
+
+    def __len__(self):
+        return len(self._rendered)
+
+render_cache = RenderCache()
+
+REGISTRY.gauge("telegram_render_cache_size", "Messages whose rendered content is remembered",
+               lambda: len(render_cache))
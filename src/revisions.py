@@ -0,0 +1,137 @@
+import json
+import re
+import zlib
+from difflib import SequenceMatcher
+from sqlalchemy import delete, func
+from sqlalchemy.future import select
+from src.config import REVISION_MAX_CHAIN, REVISIONS_PER_NOTE
+from src.db import session_scope
+from src.models import Note, NoteRevision
+
+# Note history. Before an edit overwrites a note, the version it replaces is stored as a
+# revision: its title, and its content as a reverse delta, i.e. how to turn the new
+# content back into the old one. Both sides are in hand at that point, so writing a
+# revision never reads older ones. A version is rebuilt by starting from the note as it
+# is now and applying deltas from the newest revision back.
+#
+# To keep that bounded, a revision is stored whole (a snapshot) instead once the deltas
+# since the previous snapshot reach REVISION_MAX_CHAIN, or outweigh the version itself;
+# rebuilding then starts from the nearest snapshot above. Deltas are sized by the edit,
+# and snapshots only come after about their own size in deltas, so history grows with
+# the edits rather than with note size times edits.
+
+_TOKENS = re.compile(r"\S+\s*|\s+")
+
+def _tokens(text: str):
+    # Words with their trailing whitespace; joined back they give exactly ``text``
+    return _TOKENS.findall(text)
+
+def make_delta(new: str, old: str):
+    """Return ops that turn ``new`` into ``old``: n > 0 copies n tokens of ``new``, n < 0
+    skips n, a string is inserted."""
+    new_tokens, old_tokens = _tokens(new), _tokens(old)
+    ops = []
+    for tag, i1, i2, j1, j2 in SequenceMatcher(None, new_tokens, old_tokens, autojunk=False).get_opcodes():
+        if tag == "equal":
+            ops.append(i2 - i1)
+            continue
+        if i2 > i1:
+            ops.append(i1 - i2)
+        if j2 > j1:
+            ops.append("".join(old_tokens[j1:j2]))
+    return ops
+
+def apply_delta(new: str, ops):
+    tokens, pos, out = _tokens(new), 0, []
+    for op in ops:
+        if isinstance(op, str):
+            out.append(op)
+        elif op > 0:
+            out.extend(tokens[pos:pos + op])
+            pos += op
+        else:
+            pos -= op
+    return "".join(out)
+
+def _pack(value) -> bytes:
+    return zlib.compress(json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode())
+
+def _unpack(data: bytes):
+    return json.loads(zlib.decompress(data))
+
+async def record_revision(session, note_id: int, old, new_content: str):
+    """Store ``old`` (a row with the note's title, content and updated_at before this edit)
+    as the note's next revision. Runs in the edit's transaction."""
+    result = await session.execute(
+        select(NoteRevision.revision, NoteRevision.chain, NoteRevision.chain_bytes)
+        .filter_by(note_id=note_id)
+        .order_by(NoteRevision.revision.desc())
+        .limit(1)
+    )
+    newest = result.one_or_none()
+    revision = newest.revision + 1 if newest else 1
+    chain = newest.chain if newest else 0
+    chain_bytes = newest.chain_bytes if newest else 0
+
+    data = _pack(make_delta(new_content, old.content))
+    full = _pack(old.content)
+    snapshot = chain + 1 > REVISION_MAX_CHAIN or chain_bytes + len(data) > len(full)
+    if snapshot:
+        data, chain, chain_bytes = full, 0, 0
+    else:
+        chain, chain_bytes = chain + 1, chain_bytes + len(data)
+
+    session.add(NoteRevision(note_id=note_id, revision=revision, title=old.title, saved_at=old.updated_at,
+                             snapshot=snapshot, data=data, chain=chain, chain_bytes=chain_bytes))
+    if revision > REVISIONS_PER_NOTE:
+        # Oldest first; newer versions never depend on older revisions
+        await session.execute(delete(NoteRevision).where(
+            NoteRevision.note_id == note_id, NoteRevision.revision <= revision - REVISIONS_PER_NOTE))
+
+async def list_revisions(user_id: int, note_id: int, before: int = None, limit: int = 8):
+    """Return ``(revisions, has_more)``: the note's revisions, newest first, below ``before``."""
+    stmt = (
+        select(NoteRevision.id, NoteRevision.revision, NoteRevision.title, NoteRevision.saved_at,
+               func.length(NoteRevision.data).label("size"))
+        .join(Note, Note.id == NoteRevision.note_id)
+        .where(NoteRevision.note_id == note_id, Note.user_id == user_id)
+    )
+    if before is not None:
+        stmt = stmt.where(NoteRevision.revision < before)
+    async with session_scope() as session:
+        result = await session.execute(stmt.order_by(NoteRevision.revision.desc()).limit(limit + 1))
+        rows = result.all()
+    return rows[:limit], len(rows) > limit
+
+async def get_revision(user_id: int, revision_id: int):
+    """Rebuild a revision as a dict of note_id, revision, title, saved_at and content, or
+    return None if it isn't one of the user's."""
+    async with session_scope() as session:
+        result = await session.execute(
+            select(NoteRevision.note_id, NoteRevision.revision, NoteRevision.title, NoteRevision.saved_at,
+                   Note.content)
+            .join(Note, Note.id == NoteRevision.note_id)
+            .where(NoteRevision.id == revision_id, Note.user_id == user_id)
+        )
+        target = result.one_or_none()
+        if target is None:
+            return None
+        # The nearest snapshot at or above it, else the note itself, is where rebuilding starts
+        snapshot = await session.scalar(
+            select(func.min(NoteRevision.revision))
+            .where(NoteRevision.note_id == target.note_id, NoteRevision.snapshot.is_(True),
+                   NoteRevision.revision >= target.revision)
+        )
+        stmt = select(NoteRevision.snapshot, NoteRevision.data).where(
+            NoteRevision.note_id == target.note_id, NoteRevision.revision >= target.revision)
+        if snapshot is not None:
+            stmt = stmt.where(NoteRevision.revision <= snapshot)
+        result = await session.execute(stmt.order_by(NoteRevision.revision.desc()))
+        chain = result.all()
+
+    content = target.content
+    for is_snapshot, data in chain:
+        value = _unpack(data)
+        content = value if is_snapshot else apply_delta(content, value)
+    return {"note_id": target.note_id, "revision": target.revision, "title": target.title,
+            "saved_at": target.saved_at, "content": content}
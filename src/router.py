@@ -0,0 +1,121 @@
+from src.metrics import CALLBACK_LATENCY
+
+# Compact callback_data: the action code in decimal, then each field after a ":", e.g.
+# "12:1234567". Codes are all digits and legacy names never are, so the first part alone
+# tells the formats apart. Decoding is one partition, one dict lookup and an int() per field.
+SEPARATOR = ":"
+MAX_CALLBACK_DATA = 64  # Telegram's limit, in bytes
+
+class Action:
+    __slots__ = ("code", "name", "fields", "handler")
+
+    def __init__(self, code, name, fields, handler):
+        self.code = code
+        self.name = name
+        self.fields = fields
+        self.handler = handler
+
+class CallbackRouter:
+    """Table-driven dispatch for inline keyboard callbacks.
+
+    Each action has a stable code, a name and typed fields (int or str). Buttons carry
+    the compact encoding from ``encode()``; ``dispatch()`` resolves it with one dict
+    lookup on the code. Field-less actions, and single-field ones registered with
+    ``choices``, resolve from a precomputed table. Legacy "name" / "name_<value>" strings
+    from buttons sent before the router still resolve.
+    """
+
+    def __init__(self):
+        self._by_code = {}
+        self._by_tag = {}  # str(code) -> Action
+        self._by_name = {}
+        # Whole callback data -> route: field-less actions, and each of the choices of
+        # small-domain ones, in both formats
+        self._fixed = {}
+
+    def action(self, code: int, name: str, *fields, choices=()):
+        """Decorator registering ``handler(update, context, user, *values)`` for an action.
+
+        ``choices`` lists every value a single-field action can carry (e.g. the digits of
+        a keypad), so each one's data is routed by a single lookup.
+        """
+        if code < 0:
+            raise ValueError("action codes are non-negative")
+        if code in self._by_code or name in self._by_name:
+            raise ValueError(f"Callback action {code}/{name!r} is already registered")
+        if choices and len(fields) != 1:
+            raise ValueError("choices are for single-field actions")
+
+        def register(handler):
+            action = Action(code, name, fields, handler)
+            self._by_code[code] = action
+            self._by_tag[str(code)] = action
+            self._by_name[name] = action
+            if not fields:
+                self._fixed[name] = self._fixed[self.encode(name)] = (action, ())
+            for value in choices:
+                self._fixed[f"{name}_{value}"] = self._fixed[self.encode(name, value)] = (action, (value,))
+            return handler
+        return register
+
+    def encode(self, name: str, *values) -> str:
+        action = self._by_name[name]
+        if len(values) != len(action.fields):
+            raise TypeError(f"{name} takes {len(action.fields)} field(s), got {len(values)}")
+        parts = [str(action.code)]
+        for kind, value in zip(action.fields, values):
+            if kind is int:
+                parts.append(str(int(value)))
+            elif kind is str:
+                if SEPARATOR in value:
+                    raise ValueError(f"callback fields can't contain {SEPARATOR!r}")
+                parts.append(value)
+            else:
+                raise TypeError(f"Unsupported callback field type {kind!r}")
+        data = SEPARATOR.join(parts)
+        if len(data.encode()) > MAX_CALLBACK_DATA:
+            raise ValueError(f"callback_data for {name} exceeds {MAX_CALLBACK_DATA} bytes")
+        return data
+
+    def decode(self, data: str):
+        """Return ``(action, values)`` for callback data, or None if it matches no action."""
+        route = self._fixed.get(data)
+        if route is not None:
+            return route
+        tag, _, rest = data.partition(SEPARATOR)
+        action = self._by_tag.get(tag)
+        if action is None:
+            return self._decode_legacy(data)
+        fields = action.fields
+        try:
+            if len(fields) == 1:
+                return action, (fields[0](rest),)
+            values = rest.split(SEPARATOR)
+            if len(values) != len(fields):
+                return None
+            return action, tuple(kind(value) for kind, value in zip(fields, values))
+        except ValueError:
+            return None
+
+    def _decode_legacy(self, data: str):
+        name, _, value = data.rpartition("_")
+        action = self._by_name.get(name)
+        if action is None or len(action.fields) != 1:
+            return None
+        try:
+            return action, (action.fields[0](value),)
+        except ValueError:
+            return None
+
+    async def dispatch(self, update, context, user, allow=None) -> bool:
+        """Run the handler for the update's callback data; False if no action matches, or
+        if ``allow`` is given and the action's name is not in it."""
+        route = self.decode(update.callback_query.data or "")
+        if route is None:
+            return False
+        action, values = route
+        if allow is not None and action.name not in allow:
+            return False
+        with CALLBACK_LATENCY.time(action=action.name):
+            await action.handler(update, context, user, *values)
+        return True
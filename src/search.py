@@ -0,0 +1,100 @@
+import re
+from sqlalchemy import bindparam, text, or_
+from sqlalchemy.future import select
+from src.models import Note, NOTE_SUMMARY_COLUMNS
+
+# Full-text index over notes. SQLite keeps a separate FTS5 table (notes_fts) whose rowid
+# is the note id and whose `owner` column holds "u<user_id>", so the owner filter is
+# answered by the index too. PostgreSQL keeps a weighted tsvector on notes itself with
+# a GIN index. Both are created by migration 6 and maintained here, inside the same
+# transaction as the note write.
+
+_SUMMARY_SQL = ", ".join(f"notes.{column.key}" for column in NOTE_SUMMARY_COLUMNS)
+
+def _terms(query: str):
+    # Word characters only, so nothing in a query is read as FTS5 or tsquery syntax
+    return re.findall(r"\w+", query.lower())
+
+def _contains(term: str):
+    # "_" is a word character but a LIKE wildcard
+    return "%" + term.replace("_", "\\_") + "%"
+
+def like_query(user_id: int, terms, limit: int, offset: int = 0):
+    """Substring scan of the user's notes for databases without full-text support."""
+    stmt = select(*NOTE_SUMMARY_COLUMNS).filter_by(user_id=user_id)
+    for term in terms:
+        pattern = _contains(term)
+        stmt = stmt.where(or_(Note.title.ilike(pattern, escape="\\"),
+                              Note.content.ilike(pattern, escape="\\")))
+    return stmt.order_by(Note.updated_at.desc(), Note.id.desc()).limit(limit).offset(offset)
+
+async def index_note(session, note_id: int, user_id: int, title: str, content: str):
+    """Add or refresh a note in the full-text index."""
+    dialect = session.bind.dialect.name
+    if dialect == "sqlite":
+        await session.execute(text("DELETE FROM notes_fts WHERE rowid = :id"), {"id": note_id})
+        await session.execute(
+            text("INSERT INTO notes_fts (rowid, title, content, owner) "
+                 "VALUES (:id, :title, :content, :owner)"),
+            {"id": note_id, "title": title, "content": content, "owner": f"u{user_id}"},
+        )
+    elif dialect == "postgresql":
+        await session.execute(
+            text("UPDATE notes SET search_vector = "
+                 "setweight(to_tsvector('simple', :title), 'A') || "
+                 "setweight(to_tsvector('simple', :content), 'B') "
+                 "WHERE id = :id"),
+            {"id": note_id, "title": title, "content": content},
+        )
+
+async def index_notes(session, note_ids):
+    """Add notes that were just inserted in bulk to the full-text index."""
+    dialect = session.bind.dialect.name
+    if dialect == "sqlite":
+        stmt = text("INSERT INTO notes_fts (rowid, title, content, owner) "
+                    "SELECT id, title, content, 'u' || user_id FROM notes WHERE id IN :ids")
+    elif dialect == "postgresql":
+        stmt = text("UPDATE notes SET search_vector = "
+                    "setweight(to_tsvector('simple', title), 'A') || "
+                    "setweight(to_tsvector('simple', content), 'B') "
+                    "WHERE id IN :ids")
+    else:
+        return
+    await session.execute(stmt.bindparams(bindparam("ids", expanding=True)), {"ids": list(note_ids)})
+
+async def unindex_note(session, note_id: int):
+    """Remove a deleted note from the full-text index."""
+    if session.bind.dialect.name == "sqlite":
+        await session.execute(text("DELETE FROM notes_fts WHERE rowid = :id"), {"id": note_id})
+    # On PostgreSQL the vector lives on the notes row and goes with it
+
+async def search(session, user_id: int, query: str, limit: int, offset: int = 0):
+    """Return summary rows of the user's notes matching every term of ``query``, best
+    match first.
+
+    Each term also matches as a prefix, so "shop" finds "shopping".
+    """
+    terms = _terms(query)
+    if not terms:
+        return []
+
+    dialect = session.bind.dialect.name
+    if dialect == "sqlite":
+        match = f"owner:u{user_id} AND {{title content}} : (" + " AND ".join(f'"{t}"*' for t in terms) + ")"
+        stmt = text(f"SELECT {_SUMMARY_SQL} FROM notes_fts JOIN notes ON notes.id = notes_fts.rowid "
+                    "WHERE notes_fts MATCH :match "
+                    "ORDER BY bm25(notes_fts, 10.0, 1.0, 0.0), notes.id DESC "
+                    "LIMIT :limit OFFSET :offset").columns(*NOTE_SUMMARY_COLUMNS)
+        params = {"match": match, "limit": limit, "offset": offset}
+    elif dialect == "postgresql":
+        stmt = text(f"SELECT {_SUMMARY_SQL} FROM notes, to_tsquery('simple', :tsquery) AS q "
+                    "WHERE notes.user_id = :user_id AND notes.search_vector @@ q "
+                    "ORDER BY ts_rank(notes.search_vector, q) DESC, notes.id DESC "
+                    "LIMIT :limit OFFSET :offset").columns(*NOTE_SUMMARY_COLUMNS)
+        params = {"tsquery": " & ".join(f"{t}:*" for t in terms), "user_id": user_id,
+                  "limit": limit, "offset": offset}
+    else:
+        stmt, params = like_query(user_id, terms, limit, offset), {}
+
+    result = await session.execute(stmt, params)
+    return result.all()
@@ -0,0 +1,148 @@
+import time
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import delete
+from sqlalchemy.future import select
+from src.cache import TTLCache
+from src.config import STATE_BACKEND, STATE_TTL, STATE_CACHE_SIZE
+from src.db import session_scope, after_commit
+from src.models import ConversationState
+
+class StateStore(ABC):
+    """Where each user's conversation state (e.g. "creating_note") lives between updates."""
+
+    @abstractmethod
+    async def get(self, user_id: int):
+        """The user's state, or None."""
+
+    @abstractmethod
+    async def set(self, user_id: int, state: str):
+        """Record the user's state, resetting its idle time."""
+
+    @abstractmethod
+    async def delete(self, user_id: int):
+        """Forget the user's state, if any."""
+
+    @abstractmethod
+    async def evict_idle(self):
+        """Drop sessions idle for longer than the TTL; returns how many were dropped."""
+
+class MemoryStateStore(StateStore):
+    """Process-local store. Fine for a single bot process; lost on restart."""
+
+    def __init__(self, ttl: float = STATE_TTL, clock=time.monotonic):
+        self.ttl = ttl
+        self._clock = clock
+        self._states = {}
+
+    async def get(self, user_id: int):
+        entry = self._states.get(user_id)
+        if entry is None:
+            return None
+        state, touched_at = entry
+        if self._clock() - touched_at > self.ttl:
+            del self._states[user_id]
+            return None
+        return state
+
+    async def set(self, user_id: int, state: str):
+        self._states[user_id] = (state, self._clock())
+
+    async def delete(self, user_id: int):
+        self._states.pop(user_id, None)
+
+    async def evict_idle(self):
+        cutoff = self._clock() - self.ttl
+        idle = [user_id for user_id, (_, touched_at) in self._states.items() if touched_at < cutoff]
+        for user_id in idle:
+            del self._states[user_id]
+        return len(idle)
+
+    def __len__(self):
+        return len(self._states)
+
+# Cached marker for "this user has no state", so misses don't hit the database either
+_NO_STATE = object()
+
+def _utc(value):
+    # SQLite hands back naive datetimes; everything is stored in UTC
+    return value if value.tzinfo is not None else value.replace(tzinfo=timezone.utc)
+
+class DBStateStore(StateStore):
+    """Store backed by the conversation_states table, shared by every bot process.
+
+    Writes go to the database first and reach the local cache once they commit; the
+    cache then serves all reads. It assumes a user's updates are handled by one process
+    at a time. Writes join the update's transaction (see src.db.session_scope).
+    """
+
+    def __init__(self, ttl: float = STATE_TTL, cache_size: int = STATE_CACHE_SIZE):
+        self.ttl = ttl
+        self.cache = TTLCache(cache_size, ttl)
+
+    def _upsert(self, dialect_name):
+        if dialect_name == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+        stmt = insert(ConversationState)
+        return stmt.on_conflict_do_update(
+            index_elements=[ConversationState.user_id],
+            set_={"state": stmt.excluded.state, "updated_at": stmt.excluded.updated_at},
+        )
+
+    async def get(self, user_id: int):
+        state = self.cache.get(user_id)
+        if state is not None:
+            return None if state is _NO_STATE else state
+
+        now = datetime.now(timezone.utc)
+        async with session_scope() as session:
+            result = await session.execute(
+                select(ConversationState.state, ConversationState.updated_at).where(
+                    ConversationState.user_id == user_id,
+                    ConversationState.updated_at >= now - timedelta(seconds=self.ttl),
+                )
+            )
+            row = result.one_or_none()
+        if row is None:
+            self.cache.set(user_id, _NO_STATE)
+            return None
+        # Cached only for what is left of the row's TTL, so it expires when the row does
+        updated_at = _utc(row.updated_at)
+        self.cache.set(user_id, row.state, (updated_at - now).total_seconds() + self.ttl)
+        return row.state
+
+    async def set(self, user_id: int, state: str):
+        self.cache.pop(user_id)
+        async with session_scope() as session:
+            await session.execute(
+                self._upsert(session.bind.dialect.name),
+                {"user_id": user_id, "state": state, "updated_at": datetime.now(timezone.utc)},
+            )
+            after_commit(session, lambda: self.cache.set(user_id, state))
+
+    async def delete(self, user_id: int):
+        self.cache.pop(user_id)
+        async with session_scope() as session:
+            await session.execute(
+                delete(ConversationState).where(ConversationState.user_id == user_id)
+            )
+            after_commit(session, lambda: self.cache.set(user_id, _NO_STATE))
+
+    async def evict_idle(self):
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=self.ttl)
+        async with session_scope() as session:
+            result = await session.execute(
+                delete(ConversationState).where(ConversationState.updated_at < cutoff)
+            )
+        # Cached entries expire on their own after the same TTL
+        return result.rowcount
+
+def create_state_store(backend: str = STATE_BACKEND):
+    """Build the configured state store."""
+    if backend == "memory":
+        return MemoryStateStore()
+    if backend == "db":
+        return DBStateStore()
+    raise ValueError(f"Unknown STATE_BACKEND {backend!r}, expected 'memory' or 'db'")
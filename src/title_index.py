@@ -0,0 +1,112 @@
+from bisect import bisect_left, insort
+from sqlalchemy.future import select
+from src.cache import TTLCache
+from src.config import INLINE_INDEX_USERS, INLINE_INDEX_TTL
+from src.db import session_scope
+from src.metrics import REGISTRY
+from src.models import Note
+
+# In-memory title prefix index per user, serving inline queries (@bot <prefix>) on every
+# keystroke without a LIKE scan. A user's index is built from one query the first time
+# they need it, then kept current by src.notes once each note write commits. Notes match
+# on the start of their title or of any later word in it, case-insensitively.
+
+INDEX_BUILDS = REGISTRY.counter("title_index_builds_total", "Per-user title indexes loaded from the database")
+
+def _keys(title: str):
+    words = title.casefold().split()
+    return [" ".join(words[i:]) for i in range(len(words))]
+
+class TitleIndex:
+    """One user's notes, as a sorted array of (title key, note id) searched with bisect."""
+
+    def __init__(self, notes=()):
+        self._notes = {}
+        self._keys = []
+        for note_id, title, preview in notes:
+            self._notes[note_id] = (title, preview)
+            self._keys.extend((key, note_id) for key in _keys(title))
+        self._keys.sort()
+
+    def __len__(self):
+        return len(self._notes)
+
+    def add(self, note_id: int, title: str, preview: str):
+        self.remove(note_id)
+        self._notes[note_id] = (title, preview)
+        for key in _keys(title):
+            insort(self._keys, (key, note_id))
+
+    def remove(self, note_id: int):
+        entry = self._notes.pop(note_id, None)
+        if entry is None:
+            return
+        for key in _keys(entry[0]):
+            i = bisect_left(self._keys, (key, note_id))
+            if i < len(self._keys) and self._keys[i] == (key, note_id):
+                del self._keys[i]
+
+    def find(self, prefix: str, offset: int = 0, limit: int = 20):
+        """Return ``([(note_id, title, preview)], has_more)`` from ``offset``, ordered by the
+        matched words (the title from the matching word on)."""
+        prefix = " ".join(prefix.casefold().split())
+        found, seen = [], set()
+        for i in range(bisect_left(self._keys, (prefix,)), len(self._keys)):
+            key, note_id = self._keys[i]
+            if not key.startswith(prefix):
+                break
+            if note_id in seen:
+                continue
+            seen.add(note_id)
+            if len(seen) > offset + limit:
+                return found, True
+            if len(seen) > offset:
+                found.append((note_id, *self._notes[note_id]))
+        return found, False
+
+_indexes = TTLCache(INLINE_INDEX_USERS, INLINE_INDEX_TTL)
+# Loads in progress by user; a write that commits meanwhile marks its load stale
+_loads = {}
+REGISTRY.gauge("title_indexes_loaded", "Users whose title index is in memory", lambda: len(_indexes))
+
+async def get_index(user_id: int) -> TitleIndex:
+    """Return the user's title index, loading it if it isn't in memory."""
+    index = _indexes.get(user_id)
+    if index is not None:
+        return index
+    load = _loads[user_id] = {"stale": False}
+    try:
+        async with session_scope() as session:
+            result = await session.execute(
+                select(Note.id, Note.title, Note.preview).filter_by(user_id=user_id)
+            )
+            index = TitleIndex(result.all())
+    finally:
+        if _loads.get(user_id) is load:
+            del _loads[user_id]
+    INDEX_BUILDS.inc()
+    if not load["stale"]:
+        # Otherwise answer from it this once, and load again next time
+        _indexes.set(user_id, index)
+    return index
+
+def _changed(user_id):
+    if user_id in _loads:
+        _loads[user_id]["stale"] = True
+    return _indexes.get(user_id)
+
+def note_saved(user_id: int, note_id: int, title: str, preview: str):
+    """Add or refresh a note in its owner's index, if that index is loaded."""
+    index = _changed(user_id)
+    if index is not None:
+        index.add(note_id, title, preview)
+
+def note_deleted(user_id: int, note_id: int):
+    index = _changed(user_id)
+    if index is not None:
+        index.remove(note_id)
+
+def forget(user_id: int):
+    """Drop the user's index, e.g. after a bulk import; it is loaded again when needed."""
+    _changed(user_id)
+    _indexes.pop(user_id)
@@ -0,0 +1,65 @@
+import asyncio
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+def update_routing_key(update):
+    """Return the id that orders an update: the sending user, else the chat, else None."""
+    if not isinstance(update, Update):
+        return None
+    if update.effective_user:
+        return update.effective_user.id
+    if update.effective_chat:
+        return update.effective_chat.id
+    return None
+
+class _Lane:
+    __slots__ = ("lock", "users")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.users = 0
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Handle updates from different users concurrently, but each user's strictly in order.
+
+    The base class semaphore only bounds how many updates may be waiting in lanes; the
+    ``max_concurrent_updates`` limit is applied after an update reaches the head of its
+    user's lane, so a user with a backlog never holds slots other users could run in.
+
+    Inline queries skip the lanes: they change nothing, and a newer one supersedes the
+    one still running (see src.handlers.handle_inline_query) rather than queueing behind it.
+    """
+
+    __slots__ = ("_active", "_lanes")
+
+    def __init__(self, max_concurrent_updates: int, max_pending_updates: int = None):
+        super().__init__(max_pending_updates or max_concurrent_updates * 16)
+        self._active = asyncio.BoundedSemaphore(max_concurrent_updates)
+        self._lanes = {}
+
+    async def do_process_update(self, update, coroutine):
+        key = update_routing_key(update)
+        if key is None or update.inline_query is not None:
+            async with self._active:
+                await coroutine
+            return
+
+        lane = self._lanes.get(key)
+        if lane is None:
+            lane = self._lanes[key] = _Lane()
+        lane.users += 1
+        try:
+            # asyncio.Lock wakes waiters first-in first-out, which keeps arrival order
+            async with lane.lock:
+                async with self._active:
+                    await coroutine
+        finally:
+            lane.users -= 1
+            if not lane.users:
+                del self._lanes[key]
+
+    async def initialize(self):
+        """Nothing to allocate."""
+
+    async def shutdown(self):
+        """Nothing to free."""
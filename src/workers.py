@@ -0,0 +1,229 @@
+"""Multi-process mode: one ingress process routing updates to N worker processes.
+
+The ingress receives updates by polling or webhook, as the single-process bot does, and
+hands each one to the worker chosen by its routing key (src.updates.update_routing_key).
+All of a user's updates therefore reach the same worker, in the order they arrived, and
+that worker's per-user lanes keep them in order from there.
+
+    WORKERS=4 python -m src.main
+
+Workers run the normal application (handlers, caches, conversation states, outbound
+rate limiter) and share only the database. Caches and memory-backed states stay
+per-process; that's safe because a user is always served by the same worker. Each
+worker's rate limiter gets RATE_LIMIT_GLOBAL / WORKERS, so together they stay under
+Telegram's global limit; per-chat limits need no sharing for the same reason.
+
+Updates travel to a worker as JSON lines on its stdin. A worker prints "ready" once it
+can take updates and, when its stdin closes, finishes what it has, prints a JSON line
+of counts and exits. Worker processes are fed through pipes, so this mode needs a POSIX
+event loop.
+"""
+import argparse
+import asyncio
+import contextlib
+import itertools
+import json
+import logging
+import os
+import sys
+from telegram import Update
+from telegram.ext import ApplicationBuilder
+from src.config import BOT_TOKEN, LOG_LEVEL, METRICS_HOST, METRICS_PORT, RATE_LIMIT_GLOBAL
+from src.log import setup_logging
+from src.updates import update_routing_key
+
+logger = logging.getLogger(__name__)
+
+# Largest update line a worker accepts; real updates are a few KB
+MAX_UPDATE_BYTES = 16 * 1024 * 1024
+
+def worker_for(key: int, workers: int) -> int:
+    """Index of the worker that handles updates with routing key ``key``."""
+    return key % workers
+
+class WorkerPool:
+    """Runs the worker processes and routes updates to them, restarting any that die."""
+
+    def __init__(self, workers: int, worker_args=()):
+        self.workers = workers
+        self._worker_args = [str(arg) for arg in worker_args]
+        self._procs = [None] * workers
+        self._ready = [asyncio.Event() for _ in range(workers)]
+        self._supervisors = []
+        self._round_robin = itertools.count()
+        self._stopping = False
+
+    async def start(self):
+        """Start every worker and wait until each can take updates."""
+        await asyncio.gather(*(self._spawn(index) for index in range(self.workers)))
+        self._supervisors = [asyncio.create_task(self._supervise(index)) for index in range(self.workers)]
+
+    async def _spawn(self, index):
+        env = dict(os.environ)
+        if METRICS_PORT:
+            # Each worker serves its own /metrics on the ports after the ingress's
+            env["METRICS_PORT"] = str(METRICS_PORT + 1 + index)
+        proc = await asyncio.create_subprocess_exec(
+            sys.executable, "-m", "src.workers", "--worker", str(index), "--workers", str(self.workers),
+            *self._worker_args, stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, env=env,
+        )
+        if (await proc.stdout.readline()).strip() != b"ready":
+            await proc.wait()
+            raise RuntimeError(f"Worker {index} exited with {proc.returncode} before it was ready")
+        self._procs[index] = proc
+        self._ready[index].set()
+
+    async def _supervise(self, index):
+        while True:
+            returncode = await self._procs[index].wait()
+            if self._stopping:
+                return
+            self._ready[index].clear()
+            logger.error("Worker %s exited with %s; restarting it", index, returncode)
+            await asyncio.sleep(1)
+            try:
+                await self._spawn(index)
+            except (OSError, RuntimeError):
+                logger.exception("Could not restart worker %s", index)
+
+    async def dispatch(self, payload: bytes, key=None):
+        """Send one serialized update to the worker for ``key`` (any worker if None)."""
+        index = worker_for(key, self.workers) if key is not None else next(self._round_robin) % self.workers
+        await self._ready[index].wait()
+        proc = self._procs[index]
+        try:
+            proc.stdin.write(payload + b"\n")
+            # Lets a worker that falls behind slow the ingress down
+            await proc.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            logger.warning("Worker %s is gone; dropped an update for %s", index, key)
+
+    async def stop(self, timeout: float = 30):
+        """Close the workers' input, let them finish what they have and return their counts."""
+        self._stopping = True
+        for supervisor in self._supervisors:
+            supervisor.cancel()
+        for proc in self._procs:
+            proc.stdin.close()
+
+        async def finish(index, proc):
+            try:
+                output = await asyncio.wait_for(proc.stdout.read(), timeout)
+                await proc.wait()
+            except asyncio.TimeoutError:
+                logger.warning("Worker %s did not finish in %ss; killing it", index, timeout)
+                proc.kill()
+                await proc.wait()
+                return None
+            lines = output.decode().strip().splitlines()
+            return json.loads(lines[-1]) if lines else None
+
+        return await asyncio.gather(*(finish(index, proc) for index, proc in enumerate(self._procs)))
+
+async def _route(queue, pool):
+    while True:
+        update = await queue.get()
+        await pool.dispatch(update.to_json().encode(), update_routing_key(update))
+
+async def run_ingress(workers: int, request=None, worker_args=()):
+    """Receive updates in this process and have ``workers`` worker processes handle them.
+
+    ``request`` and ``worker_args`` let the fake Telegram harness stand in for the Bot API.
+    """
+    from src.db import engine
+    from src.main import start_ingress
+    from src.metrics import start_metrics_server
+    from src.migrate import migrate_database
+
+    setup_logging(LOG_LEVEL)
+    if engine.dialect.name == "sqlite":
+        # Within one process the small pool queues writers; across processes nothing does
+        logger.warning("Workers sharing a SQLite file will see 'database is locked' when a handler reads "
+                       "and then writes while another process commits; use PostgreSQL for this mode")
+    # Once, before any worker opens the database
+    await migrate_database()
+    pool = WorkerPool(workers, worker_args)
+    await pool.start()
+    logger.info("Started %s workers", workers)
+
+    # Only the bot and the updater are used: updates are handled by the workers
+    builder = ApplicationBuilder().token(BOT_TOKEN)
+    if request is not None:
+        builder = builder.request(request).get_updates_request(request)
+    app = builder.build()
+    metrics_server = await start_metrics_server(METRICS_HOST, METRICS_PORT) if METRICS_PORT else None
+    await app.initialize()
+    await start_ingress(app)
+    router = asyncio.create_task(_route(app.update_queue, pool))
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await app.updater.stop()
+        router.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await router
+        # Hand over whatever the updater had already fetched
+        while not app.update_queue.empty():
+            update = app.update_queue.get_nowait()
+            await pool.dispatch(update.to_json().encode(), update_routing_key(update))
+        await pool.stop()
+        if metrics_server is not None:
+            metrics_server.close()
+        await app.shutdown()
+
+async def _stdin_reader():
+    reader = asyncio.StreamReader(limit=MAX_UPDATE_BYTES)
+    await asyncio.get_running_loop().connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+    return reader
+
+async def run_worker(index: int, workers: int, fake_api_latency: float = None):
+    """Handle the updates the ingress writes to stdin until it closes."""
+    from src.broadcast import resume_broadcasts, stop_broadcasts
+    from src.handlers import keyboards
+    from src.main import build_application, sweep_idle_states
+    from src.reminders import start_reminders, stop_reminders
+    from src.metrics import HANDLER_ERRORS, start_metrics_server
+
+    setup_logging(LOG_LEVEL)
+    request = None
+    if fake_api_latency is not None:
+        # For benchmarks: answer Bot API calls in-process instead of over the network
+        from bench.fake_telegram import FakeTelegram
+        request = FakeTelegram(latency=fake_api_latency).request()
+    app = build_application(request=request, global_rate=RATE_LIMIT_GLOBAL / workers)
+    metrics_server = await start_metrics_server(METRICS_HOST, METRICS_PORT) if METRICS_PORT else None
+    await app.initialize()
+    await app.start()
+    if index == 0:
+        # One process owns broadcasts, so a resumed one never runs twice
+        await resume_broadcasts(app.bot)
+    # Each worker sends its own users' reminders
+    start_reminders(app.bot, keyboards.open_note, index, workers)
+    sweeper = asyncio.create_task(sweep_idle_states())
+    reader = await _stdin_reader()
+    print("ready", flush=True)
+
+    received = 0
+    while line := await reader.readline():
+        await app.update_queue.put(Update.de_json(json.loads(line), app.bot))
+        received += 1
+    # Wait until every update received has been handled
+    await app.update_queue.join()
+
+    sweeper.cancel()
+    await stop_broadcasts()
+    await stop_reminders()
+    if metrics_server is not None:
+        metrics_server.close()
+    await app.stop()
+    await app.shutdown()
+    print(json.dumps({"worker": index, "updates": received,
+                      "handler_errors": HANDLER_ERRORS.total()}), flush=True)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run one worker process (started by the ingress)")
+    parser.add_argument("--worker", type=int, required=True)
+    parser.add_argument("--workers", type=int, required=True)
+    parser.add_argument("--fake-api-latency", type=float, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    asyncio.run(run_worker(args.worker, args.workers, args.fake_api_latency))
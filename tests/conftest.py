@@ -0,0 +1,62 @@
+"""Shared test setup: a throwaway SQLite database and the fake Bot API, no network.
+
+src.config reads the environment when it is first imported, so it is set here first.
+Tests drive async code with the ``run`` fixture rather than a pytest plugin.
+"""
+import asyncio
+import os
+import tempfile
+from contextlib import asynccontextmanager
+import pytest
+
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{tempfile.mkdtemp(prefix='tgcrud-test-')}/test.db"
+os.environ["BOT_TOKEN"] = "123:test"
+os.environ["METRICS_PORT"] = "0"
+os.environ["PATTERN_BCRYPT_ROUNDS"] = "4"
+# Outbound rate limits are off unless a test turns them on (see bot_app); when on, a chat
+# gets one message at once and then one every 0.2s
+os.environ["RATE_LIMIT_GLOBAL"] = "0"
+os.environ["RATE_LIMIT_PER_CHAT"] = "5"
+os.environ["RATE_LIMIT_CHAT_BURST"] = "1"
+
+@pytest.fixture(scope="session")
+def run():
+    """``run(coro)``: run a coroutine on a fresh event loop against the migrated database."""
+    from src.db import engine
+    from src.migrate import migrate_database
+
+    def run(coro):
+        async def main():
+            try:
+                return await coro
+            finally:
+                # Pooled connections belong to this loop
+                await engine.dispose()
+        return asyncio.run(main())
+
+    run(migrate_database())
+    return run
+
+@pytest.fixture
+def bot_app():
+    """``async with bot_app(global_rate=0, **fake_options) as (app, telegram)``: the real
+    application, started, answering Bot API calls from a FakeTelegram."""
+    from bench.fake_telegram import FakeTelegram
+    from src.dedup import deduplicator
+    from src.main import build_application
+
+    # Each FakeTelegram numbers its updates from 1
+    deduplicator.seen.clear()
+
+    @asynccontextmanager
+    async def start(global_rate=0, **fake_options):
+        telegram = FakeTelegram(**fake_options)
+        app = build_application(request=telegram.request(), global_rate=global_rate)
+        await app.initialize()
+        await app.start()
+        try:
+            yield app, telegram
+        finally:
+            await app.stop()
+            await app.shutdown()
+    return start
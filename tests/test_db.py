@@ -0,0 +1,91 @@
+import asyncio
+from sqlalchemy import func, insert
+from sqlalchemy.future import select
+from telegram import Update
+from telegram.ext import CommandHandler
+from src.auth import create_user
+from src.db import WriteBatcher, _current_session, after_commit, session_scope, with_session
+from src.models import Note, note_body
+from src.notes import create_note
+
+async def deliver(app, *payloads):
+    for payload in payloads:
+        await app.update_queue.put(Update.de_json(payload, app.bot))
+    await app.update_queue.join()
+
+async def _notes(user_id):
+    async with session_scope() as session:
+        return await session.scalar(select(func.count()).select_from(Note).filter_by(user_id=user_id))
+
+def test_handler_failing_after_a_reply_rolls_back_all_its_writes(run, bot_app):
+    async def scenario():
+        user = await create_user("70000", "user70000")
+
+        async def save_twice_then_fail(update, context):
+            await create_note(user.id, "First", "written before the reply")
+            await update.message.reply_text("Saving…")
+            await create_note(user.id, "Second", "written after it")
+            raise RuntimeError("handler failed halfway")
+
+        async with bot_app() as (app, telegram):
+            app.add_handler(CommandHandler("halfway", with_session(save_twice_then_fail)))
+            await deliver(app, telegram.message_update(70_000, "/halfway"))
+            replies = [params["text"] for params in telegram.calls_for("sendMessage")]
+        return replies, await _notes(user.id)
+
+    replies, notes = run(scenario())
+    # The reply went out, but none of the update's writes were kept
+    assert replies == ["Saving…"]
+    assert notes == 0
+
+def test_only_a_handler_that_has_not_written_gives_back_its_connection(run, bot_app):
+    async def scenario():
+        user = await create_user("70001", "user70001")
+        open_after_reply = []
+
+        async def read_reply_write_reply(update, context):
+            session = _current_session.get()
+            await _notes(user.id)
+            await update.message.reply_text("Read")
+            open_after_reply.append(session.in_transaction())
+            await create_note(user.id, "Note", "content")
+            await update.message.reply_text("Written")
+            open_after_reply.append(session.in_transaction())
+
+        async with bot_app() as (app, telegram):
+            app.add_handler(CommandHandler("mixed", with_session(read_reply_write_reply)))
+            await deliver(app, telegram.message_update(70_001, "/mixed"))
+        return open_after_reply
+
+    assert run(scenario()) == [False, True]
+
+def test_a_failing_write_in_a_batch_rolls_back_alone(run):
+    async def scenario():
+        user = await create_user("70002", "user70002")
+        batcher = WriteBatcher(window=0.05)
+        sessions, committed = set(), []
+
+        def write(title, fail=False):
+            async def op(session):
+                sessions.add(session)
+                await session.execute(insert(Note).values(user_id=user.id, title=title, **note_body("")))
+                after_commit(session, lambda: committed.append(title))
+                if fail:
+                    raise ValueError(f"{title} failed")
+                return title
+            return op
+
+        results = await asyncio.gather(
+            batcher.submit(write("First")), batcher.submit(write("Second", fail=True)),
+            batcher.submit(write("Third")), return_exceptions=True)
+        async with session_scope() as session:
+            titles = (await session.scalars(select(Note.title).filter_by(user_id=user.id).order_by(Note.id))).all()
+        return len(sessions), results, committed, titles
+
+    batches, results, committed, titles = run(scenario())
+    assert batches == 1
+    assert results[0] == "First" and results[2] == "Third"
+    assert isinstance(results[1], ValueError)
+    # Only the failed write's savepoint was rolled back, after-commit hooks included
+    assert titles == ["First", "Third"]
+    assert committed == ["First", "Third"]
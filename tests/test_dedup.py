@@ -0,0 +1,62 @@
+from sqlalchemy import func
+from sqlalchemy.future import select
+from telegram import Update
+from src.auth import get_user_by_telegram_id
+from src.db import session_scope
+from src.dedup import deduplicator
+from src.handlers import router
+from src.models import Note
+
+async def deliver(app, *payloads):
+    for payload in payloads:
+        await app.update_queue.put(Update.de_json(payload, app.bot))
+    await app.update_queue.join()
+
+async def _notes(telegram_id):
+    user = await get_user_by_telegram_id(str(telegram_id))
+    async with session_scope() as session:
+        return await session.scalar(select(func.count()).select_from(Note).filter_by(user_id=user.id))
+
+def _note_message(telegram, user_id, message_id=None):
+    payload = telegram.message_update(user_id, "title: Groceries\ncontent: milk, eggs")
+    if message_id is not None:
+        payload["message"]["message_id"] = message_id
+    return payload
+
+def test_redelivered_update_is_handled_once(run, bot_app):
+    async def scenario():
+        async with bot_app() as (app, telegram):
+            await deliver(app, telegram.message_update(50_000, "/start"))
+            tap = telegram.callback_update(50_000, router.encode("pattern", 5))
+            await deliver(app, tap, tap)
+            # A redelivery after the first was handled, e.g. following a polling restart
+            await deliver(app, tap)
+            return tap["update_id"], [int(params["callback_query_id"])
+                                      for params in telegram.calls_for("answerCallbackQuery")]
+
+    update_id, answered = run(scenario())
+    assert answered.count(update_id) == 1
+
+def test_redelivered_message_creates_one_note(run, bot_app):
+    async def scenario():
+        async with bot_app() as (app, telegram):
+            await deliver(app, telegram.message_update(50_100, "/start"))
+            message = _note_message(telegram, 50_100)
+            for _ in range(2):
+                await deliver(app, telegram.callback_update(50_100, router.encode("new_note")), message)
+                # As if the process restarted before the update was confirmed
+                deduplicator.seen.clear()
+            return await _notes(50_100)
+
+    assert run(scenario()) == 1
+
+def test_same_message_id_in_different_chats_creates_a_note_each(run, bot_app):
+    async def scenario():
+        async with bot_app() as (app, telegram):
+            for user_id in (50_200, 50_201):
+                await deliver(app, telegram.message_update(user_id, "/start"),
+                              telegram.callback_update(user_id, router.encode("new_note")),
+                              _note_message(telegram, user_id, message_id=7))
+            return [await _notes(user_id) for user_id in (50_200, 50_201)]
+
+    assert run(scenario()) == [1, 1]
@@ -0,0 +1,87 @@
+from datetime import datetime, timezone
+from sqlalchemy import update
+from src.auth import create_user
+from src.db import session_scope
+from src.models import Note
+from src.notes import create_note, delete_note, get_user_notes_page, update_note
+
+PAGE = 3
+
+async def _user_with_notes(telegram_id, count):
+    user = await create_user(str(telegram_id), f"user{telegram_id}")
+    notes = [await create_note(user.id, f"Note {n}", f"content {n}") for n in range(count)]
+    # Newest first, as listed
+    return user, [note.id for note in reversed(notes)]
+
+async def _walk(user_id):
+    """Follow Next from the first page to the last, then Prev back; return both page lists."""
+    forward, cursor = [], None
+    while True:
+        notes, prev_cursor, next_cursor = await get_user_notes_page(user_id, cursor, limit=PAGE)
+        forward.append(([note.id for note in notes], prev_cursor is not None, next_cursor is not None))
+        if next_cursor is None:
+            break
+        cursor = next_cursor
+    backward = []
+    while prev_cursor is not None:
+        notes, prev_cursor, next_cursor = await get_user_notes_page(user_id, prev_cursor, before=True, limit=PAGE)
+        backward.append(([note.id for note in notes], prev_cursor is not None, next_cursor is not None))
+    return forward, backward
+
+def test_no_notes_is_one_empty_page(run):
+    async def scenario():
+        user, _ = await _user_with_notes(80_000, 0)
+        return await get_user_notes_page(user.id, limit=PAGE)
+
+    assert run(scenario()) == ([], None, None)
+
+def test_exactly_one_page_has_neither_prev_nor_next(run):
+    async def scenario():
+        user, ids = await _user_with_notes(80_001, PAGE)
+        return ids, await _walk(user.id)
+
+    ids, (forward, backward) = run(scenario())
+    assert forward == [(ids, False, False)]
+    assert backward == []
+
+def test_prev_and_next_stop_at_the_edges(run):
+    async def scenario():
+        user, ids = await _user_with_notes(80_002, 2 * PAGE + 1)
+        return ids, await _walk(user.id)
+
+    ids, (forward, backward) = run(scenario())
+    assert forward == [(ids[0:3], False, True), (ids[3:6], True, True), (ids[6:7], True, False)]
+    assert backward == [(ids[3:6], True, True), (ids[0:3], False, True)]
+
+def test_notes_updated_in_the_same_instant_are_each_listed_once(run):
+    async def scenario():
+        user, ids = await _user_with_notes(80_003, 2 * PAGE + 2)
+        async with session_scope() as session:
+            await session.execute(update(Note).filter_by(user_id=user.id)
+                                  .values(updated_at=datetime(2026, 1, 1, tzinfo=timezone.utc)))
+        return await _walk(user.id)
+
+    forward, backward = run(scenario())
+    listed = [note_id for page, _, _ in forward for note_id in page]
+    # Ties are ordered by id, newest first
+    assert listed == sorted(listed, reverse=True) and len(listed) == 2 * PAGE + 2
+    assert [page for page, _, _ in backward] == [page for page, _, _ in forward[-2::-1]]
+
+def test_editing_or_deleting_the_anchor_between_pages_neither_skips_nor_repeats(run):
+    async def scenario():
+        user, ids = await _user_with_notes(80_004, 3 * PAGE)
+        first, _, next_cursor = await get_user_notes_page(user.id, limit=PAGE)
+        anchor = first[-1].id
+        # The note the Next button is anchored on moves to the top...
+        await update_note(anchor, user.id, "Edited", "new content")
+        second, _, next_cursor = await get_user_notes_page(user.id, next_cursor, limit=PAGE)
+        # ...and the next anchor is deleted
+        await delete_note(second[-1].id, user.id)
+        third, _, last_cursor = await get_user_notes_page(user.id, next_cursor, limit=PAGE)
+        return ids, [n.id for n in first], [n.id for n in second], [n.id for n in third], last_cursor
+
+    ids, first, second, third, last_cursor = run(scenario())
+    assert first == ids[0:3]
+    assert second == ids[3:6]
+    assert third == ids[6:9]
+    assert last_cursor is None
@@ -0,0 +1,97 @@
+import asyncio
+import time
+from telegram import Update
+from src.handlers import router
+
+# Outbound limits on, per chat as set in conftest
+GLOBAL_RATE = 30
+
+async def deliver(app, *payloads):
+    for payload in payloads:
+        await app.update_queue.put(Update.de_json(payload, app.bot))
+    await app.update_queue.join()
+
+def _timed(telegram):
+    """Record when each accepted chat-bound call reached the fake API."""
+    sent = []
+    handle = telegram.handle
+
+    async def timed_handle(api_method, params):
+        status, result = await handle(api_method, params)
+        if status == 200 and "chat_id" in params:
+            sent.append((time.monotonic(), api_method, int(params["chat_id"]), params.get("text")))
+        return status, result
+    telegram.handle = timed_handle
+    return sent
+
+def _edits(telegram, chat_id):
+    return [params["text"] for params in telegram.calls_for("editMessageText") if int(params["chat_id"]) == chat_id]
+
+def _tap(telegram, user_id, name, *values):
+    return telegram.callback_update(user_id, router.encode(name, *values))
+
+def test_queued_edits_of_a_message_coalesce_into_the_latest(run, bot_app):
+    async def scenario():
+        async with bot_app(global_rate=GLOBAL_RATE) as (app, telegram):
+            await deliver(app, telegram.message_update(40_000, "/start"))
+            # The chat's token went on /start, so these edits queue and merge
+            await deliver(app, *(_tap(telegram, 40_000, "pattern", digit) for digit in range(1, 10)))
+            await app.bot.rate_limiter.drain()
+            return _edits(telegram, 40_000)
+
+    edits = run(scenario())
+    assert 1 <= len(edits) < 9
+    assert edits[-1].endswith("Current pattern: 123456789")
+
+def test_flood_control_pauses_every_chat_then_retries(run, bot_app):
+    async def scenario():
+        async with bot_app(global_rate=GLOBAL_RATE, retry_after=1) as (app, telegram):
+            sent = _timed(telegram)
+            telegram.fail_next()
+            started = time.monotonic()
+            await deliver(app, telegram.message_update(40_100, "/start"), telegram.message_update(40_101, "/start"))
+            await app.bot.rate_limiter.drain()
+            return started, sent, telegram.flood_errors
+
+    started, sent, flood_errors = run(scenario())
+    assert flood_errors == 1
+    # Nothing went out to either chat until the retry_after had passed, then both got everything
+    assert all(at - started >= 1 for at, *_ in sent)
+    for chat_id in (40_100, 40_101):
+        texts = [text for _, method, chat, text in sent if chat == chat_id]
+        assert len(texts) == 2 and texts[-1].startswith("📱 Welcome to NotePad!")
+
+def test_edit_put_back_after_flood_control_still_coalesces(run, bot_app):
+    async def scenario():
+        async with bot_app(global_rate=GLOBAL_RATE, retry_after=1) as (app, telegram):
+            await deliver(app, telegram.message_update(40_200, "/start"))
+            telegram.fail_next()
+            await deliver(app, _tap(telegram, 40_200, "list_notes"))
+            # Its first try got the 429; it waits out the pause back in the queue
+            await asyncio.sleep(0.5)
+            await deliver(app, _tap(telegram, 40_200, "settings"))
+            await app.bot.rate_limiter.drain()
+            return telegram.flood_errors, _edits(telegram, 40_200)
+
+    flood_errors, edits = run(scenario())
+    assert flood_errors == 1
+    assert edits == ["⚙️ Settings\n\nManage your NotePad settings:"]
+
+def test_coalesced_edit_that_fails_is_not_remembered_as_rendered(run, bot_app):
+    async def scenario():
+        async with bot_app(global_rate=GLOBAL_RATE) as (app, telegram):
+            await deliver(app, telegram.message_update(40_300, "/start"))
+            # The user deleted the message the buttons were on
+            telegram.deleted.add((40_300, 1))
+            await deliver(app, _tap(telegram, 40_300, "list_notes"), _tap(telegram, 40_300, "settings"))
+            await app.bot.rate_limiter.drain()
+            failed = _edits(telegram, 40_300)
+            telegram.deleted.clear()
+            # Same content as the edit that failed: it must be sent, not skipped as already shown
+            await deliver(app, _tap(telegram, 40_300, "settings"))
+            await app.bot.rate_limiter.drain()
+            return failed, _edits(telegram, 40_300)
+
+    failed, edits = run(scenario())
+    assert failed == []
+    assert edits == ["⚙️ Settings\n\nManage your NotePad settings:"]
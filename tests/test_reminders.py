@@ -0,0 +1,99 @@
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import delete
+from sqlalchemy.future import select
+from telegram.error import TimedOut
+from src.auth import create_user
+from src.config import REMINDER_LEASE
+from src.db import session_scope
+from src.models import Reminder
+from src.notes import create_note
+from src.reminders import ReminderScheduler, add_reminder
+
+class FakeClock:
+    def __init__(self):
+        self.now = datetime(2026, 10, 20, 9, 0, tzinfo=timezone.utc)
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += timedelta(seconds=seconds)
+
+class FakeBot:
+    """Records reminder messages; ``failures`` sends fail with a timeout first."""
+
+    def __init__(self, failures=0):
+        self.sent = []
+        self.failures = failures
+
+    async def send_message(self, chat_id, text, reply_markup=None):
+        if self.failures:
+            self.failures -= 1
+            raise TimedOut()
+        self.sent.append((chat_id, text))
+
+async def _setup(telegram_id, clock, count=1, minutes=5):
+    """A user with a note and ``count`` reminders of it due in ``minutes``."""
+    async with session_scope() as session:
+        await session.execute(delete(Reminder))
+    user = await create_user(str(telegram_id), f"user{telegram_id}")
+    note = await create_note(user.id, "Call mom", "Ask about the weekend")
+    for _ in range(count):
+        await add_reminder(user, note.id, clock.now + timedelta(minutes=minutes))
+    return user
+
+async def _pending():
+    async with session_scope() as session:
+        return (await session.execute(select(Reminder.attempts))).scalars().all()
+
+def test_tick_sends_reminders_once_they_are_due(run):
+    async def scenario():
+        clock, bot = FakeClock(), FakeBot()
+        await _setup(30_000, clock)
+        scheduler = ReminderScheduler(bot, clock=clock)
+        await scheduler.tick()
+        early = list(bot.sent)
+        clock.advance(5 * 60)
+        await scheduler.tick()
+        await scheduler.tick()
+        return early, bot.sent, await _pending()
+
+    early, sent, pending = run(scenario())
+    assert early == []
+    assert sent == [(30_000, "⏰ Reminder: Call mom\n\nAsk about the weekend")]
+    assert pending == []
+
+def test_tick_paces_sends_by_the_clock(run):
+    async def scenario():
+        clock, bot = FakeClock(), FakeBot()
+        await _setup(30_001, clock, count=5, minutes=0)
+        scheduler = ReminderScheduler(bot, clock=clock, rate=2)
+        sent = []
+        for _ in range(3):
+            await scheduler.tick()
+            await scheduler.tick()
+            sent.append(len(bot.sent))
+            clock.advance(1)
+        return sent
+
+    # Two a second, however often it ticks
+    assert run(scenario()) == [2, 4, 5]
+
+def test_reminder_whose_send_failed_is_retried_after_its_lease(run):
+    async def scenario():
+        clock, bot = FakeClock(), FakeBot(failures=1)
+        await _setup(30_002, clock, minutes=0)
+        scheduler = ReminderScheduler(bot, clock=clock)
+        await scheduler.tick()
+        after_failure = await _pending()
+        await scheduler.tick()
+        within_lease = list(bot.sent)
+        clock.advance(REMINDER_LEASE)
+        await scheduler.tick()
+        return after_failure, within_lease, bot.sent, await _pending()
+
+    after_failure, within_lease, sent, pending = run(scenario())
+    assert after_failure == [1]
+    assert within_lease == []
+    assert [chat_id for chat_id, _ in sent] == [30_002]
+    assert pending == []
@@ -0,0 +1,60 @@
+from sqlalchemy.future import select
+from src import revisions
+from src.auth import create_user
+from src.db import session_scope
+from src.models import NoteRevision
+from src.notes import create_note, update_note
+from src.revisions import apply_delta, get_revision, list_revisions, make_delta
+
+async def _edit_through(telegram_id, versions):
+    """Create a note at versions[0], edit it through the rest; return its rebuilt history."""
+    user = await create_user(str(telegram_id), f"user{telegram_id}")
+    title, content = versions[0]
+    note = await create_note(user.id, title, content)
+    for title, content in versions[1:]:
+        await update_note(note.id, user.id, title, content)
+    rows, has_more = await list_revisions(user.id, note.id, limit=len(versions))
+    rebuilt = {}
+    for row in rows:
+        revision = await get_revision(user.id, row.id)
+        rebuilt[revision["revision"]] = (revision["title"], revision["content"])
+    async with session_scope() as session:
+        snapshots = (await session.execute(
+            select(NoteRevision.revision).filter_by(note_id=note.id, snapshot=True))).scalars().all()
+    return rebuilt, has_more, snapshots
+
+def test_every_earlier_version_is_rebuilt_exactly(run):
+    base = "Buy milk and eggs before the meeting with Anna on Friday"
+    versions = [("Shopping", base)]
+    for n, edit in enumerate([
+        lambda s: s.replace("milk", "oat milk"),
+        lambda s: s + "\nAlso call the plumber.",
+        lambda s: s.replace("Anna", "the whole team"),
+        lambda s: "Urgent: " + s,
+        lambda s: s.replace("eggs ", ""),
+        lambda s: s.replace("\n", "\n\n  "),
+        lambda s: s.upper(),
+    ]):
+        versions.append((f"Shopping v{n + 2}", edit(versions[-1][1])))
+
+    rebuilt, has_more, _ = run(_edit_through(60_000, versions))
+    assert not has_more
+    # Revision n holds the version the n-th edit replaced
+    assert rebuilt == {n: versions[n - 1] for n in range(1, len(versions))}
+
+def test_empty_unicode_and_chains_past_the_snapshot_interval(run, monkeypatch):
+    monkeypatch.setattr(revisions, "REVISION_MAX_CHAIN", 3)
+    contents = ["", "naïve café 🙂", "naïve café 🙂 日本語のメモ", "", "   \n\t ", "🙂" * 50,
+                "🙂" * 49 + " ✓", "Zeile eins\nZeile zwei\n", "Zeile eins\nZeile 2\n", "",
+                "x", "x y", "x y z", "über straße ß"]
+    versions = [(f"Título {n} ✍️", content) for n, content in enumerate(contents)]
+
+    rebuilt, _, snapshots = run(_edit_through(60_001, versions))
+    assert rebuilt == {n: versions[n - 1] for n in range(1, len(versions))}
+    # 13 revisions with a delta chain of at most 3 needs several snapshots in between
+    assert len(snapshots) >= 3
+
+def test_delta_round_trips_whitespace_exactly():
+    for new, old in [("", ""), ("", "a b"), ("a b", ""), ("a  b\n", "a b"), (" lead", "lead "),
+                     ("日本 語", "日本語"), ("a\r\nb", "a\nb")]:
+        assert apply_delta(new, make_delta(new, old)) == old
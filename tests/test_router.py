@@ -0,0 +1,65 @@
+import pytest
+from src.handlers import router as app_router
+from src.router import MAX_CALLBACK_DATA, CallbackRouter
+
+async def _handler(update, context, user, *values):
+    pass
+
+def _router():
+    router = CallbackRouter()
+    router.action(0, "menu")(_handler)
+    router.action(1, "digit", int, choices=range(1, 10))(_handler)
+    router.action(2, "page", int, int)(_handler)
+    router.action(3, "tag", str)(_handler)
+    return router
+
+def test_every_registered_action_round_trips():
+    samples = {0: (), 1: (0,), 2: (2**40, 7), 3: (-5, 123456)}
+    for name, action in app_router._by_name.items():
+        values = samples[len(action.fields)][:len(action.fields)]
+        data = app_router.encode(name, *values)
+        assert len(data.encode()) <= MAX_CALLBACK_DATA
+        decoded, decoded_values = app_router.decode(data)
+        assert (decoded.name, decoded_values) == (name, values)
+
+def test_typed_fields_round_trip():
+    router = _router()
+    for name, values in [("menu", ()), ("digit", (7,)), ("digit", (12,)), ("page", (1_700_000_000_123, 42)),
+                         ("tag", ("café 🙂",)), ("tag", ("",))]:
+        action, decoded = router.decode(router.encode(name, *values))
+        assert (action.name, decoded) == (name, values)
+
+def test_baseline_callback_data_still_resolves():
+    for data, name, values in [("list_notes", "list_notes", ()), ("pattern_5", "pattern", (5,)),
+                               ("view_note_1234567", "view_note", (1234567,)),
+                               ("delete_note_8", "delete_note", (8,)), ("change_pattern", "change_pattern", ())]:
+        action, decoded = app_router.decode(data)
+        assert (action.name, decoded) == (name, values)
+
+@pytest.mark.parametrize("data", ["", "99", "99:1", "1:", "1:x", "2:1", "2:1:2:3", "0:1", "view_note_x",
+                                  "nothing_5", "~AQEF"])
+def test_malformed_data_matches_nothing(data):
+    router = _router()
+    router.action(12, "view_note", int)(_handler)
+    assert router.decode(data) is None
+
+def test_callback_data_limit_is_enforced():
+    router = _router()
+    # "3:" plus the field: exactly at the limit is fine, one byte over is not
+    assert len(router.encode("tag", "x" * (MAX_CALLBACK_DATA - 2)).encode()) == MAX_CALLBACK_DATA
+    with pytest.raises(ValueError):
+        router.encode("tag", "x" * (MAX_CALLBACK_DATA - 1))
+    # Bytes, not characters
+    with pytest.raises(ValueError):
+        router.encode("tag", "é" * (MAX_CALLBACK_DATA // 2))
+    with pytest.raises(ValueError):
+        router.encode("page", 10**40, 10**40)
+
+def test_encode_checks_arity_and_separator():
+    router = _router()
+    with pytest.raises(TypeError):
+        router.encode("page", 1)
+    with pytest.raises(ValueError):
+        router.encode("tag", "a:b")
+    with pytest.raises(ValueError):
+        router.action(4, "menu")(_handler)
@@ -0,0 +1,59 @@
+from src import search
+from src.auth import create_user
+from src.db import session_scope
+from src.notes import create_note, search_notes
+
+NOTES = [
+    ("Shopping", "eggs and milk"),
+    ("Ideas", "an AND-gate, a NOT-gate"),
+    ("snake_case", "user_id"),
+    ("Typo", "userXid"),
+]
+
+async def _user_with_notes(telegram_id):
+    user = await create_user(str(telegram_id), f"user{telegram_id}")
+    for title, content in NOTES:
+        await create_note(user.id, title, content)
+    return user.id
+
+async def _titles(user_id, query):
+    notes, _ = await search_notes(user_id, query)
+    return sorted(note.title for note in notes)
+
+async def _like_titles(user_id, query):
+    async with session_scope() as session:
+        result = await session.execute(search.like_query(user_id, search._terms(query), 10))
+        return sorted(row.title for row in result.all())
+
+def test_fts_query_syntax_in_a_search_is_taken_as_words(run):
+    async def scenario():
+        user_id = await _user_with_notes(98_000)
+        other_id = await _user_with_notes(98_001)
+        return user_id, [await _titles(user_id, query) for query in (
+            "shop",  # terms match as prefixes
+            'milk OR "unknown"',  # OR is a word to find, not an operator
+            "and NOT gate",
+            'egg* NEAR(milk) -eggs ^milk title:shopping',
+            f"owner:u{other_id} milk",  # no reaching other users' notes
+            '"',
+        )]
+
+    user_id, results = run(scenario())
+    assert results == [["Shopping"], [], ["Ideas"], [], [], []]
+
+def test_like_fallback_matches_substrings_of_every_term(run):
+    async def scenario():
+        user_id = await _user_with_notes(98_002)
+        await _user_with_notes(98_003)
+        return [await _like_titles(user_id, query) for query in (
+            "OPP",  # case-insensitive, anywhere in the word
+            "milk eggs",
+            "and",  # in the content of two notes
+            "userxid",
+            "user_id",  # "_" is not a wildcard
+            "ser_i",
+            "100%",
+        )]
+
+    assert run(scenario()) == [["Shopping"], ["Shopping"], ["Ideas", "Shopping"], ["Typo"],
+                               ["snake_case"], ["snake_case"], []]
@@ -0,0 +1,73 @@
+import asyncio
+import pytest
+from src.auth import create_user
+from src.state import DBStateStore, MemoryStateStore
+
+TTL = 0.5
+
+STORES = {"memory": MemoryStateStore, "db": DBStateStore}
+
+@pytest.fixture(params=sorted(STORES))
+def store(request):
+    return STORES[request.param](ttl=TTL)
+
+_ids = iter(range(96_000, 97_000))
+
+async def _user():
+    telegram_id = next(_ids)
+    return (await create_user(str(telegram_id), f"user{telegram_id}")).id
+
+def test_set_get_and_delete(run, store):
+    async def scenario():
+        user_id = await _user()
+        seen = [await store.get(user_id)]
+        await store.set(user_id, "creating_note")
+        seen.append(await store.get(user_id))
+        await store.set(user_id, "searching")
+        seen.append(await store.get(user_id))
+        await store.delete(user_id)
+        seen.append(await store.get(user_id))
+        # Deleting what isn't there is fine
+        await store.delete(user_id)
+        return seen
+
+    assert run(scenario()) == [None, "creating_note", "searching", None]
+
+def test_a_state_expires_after_the_ttl_and_is_evicted(run, store):
+    async def scenario():
+        user_id, kept_id = await _user(), await _user()
+        await store.set(user_id, "creating_note")
+        await asyncio.sleep(TTL * 0.6)
+        await store.set(kept_id, "searching")
+        await asyncio.sleep(TTL * 0.6)
+        evicted = await store.evict_idle()
+        return evicted, await store.get(user_id), await store.get(kept_id)
+
+    evicted, expired, kept = run(scenario())
+    assert expired is None
+    assert kept == "searching"
+    assert evicted >= 1
+
+def test_setting_a_state_again_restarts_its_ttl(run, store):
+    async def scenario():
+        user_id = await _user()
+        await store.set(user_id, "creating_note")
+        await asyncio.sleep(TTL * 0.6)
+        await store.set(user_id, "creating_note")
+        await asyncio.sleep(TTL * 0.6)
+        return await store.get(user_id)
+
+    assert run(scenario()) == "creating_note"
+
+def test_db_state_read_by_another_process_expires_with_its_row(run):
+    async def scenario():
+        user_id = await _user()
+        await DBStateStore(ttl=TTL).set(user_id, "creating_note")
+        await asyncio.sleep(TTL * 0.6)
+        # A fresh cache, as in another process: the row is read and cached here
+        other = DBStateStore(ttl=TTL)
+        read = await other.get(user_id)
+        await asyncio.sleep(TTL * 0.6)
+        return read, await other.get(user_id)
+
+    assert run(scenario()) == ("creating_note", None)
@@ -0,0 +1,59 @@
+import pytest
+from src import title_index
+from src.auth import create_user
+from src.db import with_session
+from src.notes import create_note, delete_note, update_note
+from src.title_index import INDEX_BUILDS, TitleIndex, get_index
+
+def _titles(index, prefix):
+    found, _ = index.find(prefix)
+    return [title for _, title, _ in found]
+
+def test_index_matches_title_starts_and_later_words():
+    index = TitleIndex([(1, "Shopping list", ""), (2, "Weekly shopping", ""), (3, "Ideas", "")])
+    # Ordered by the words matched: "shopping" before "shopping list"
+    assert _titles(index, "shop") == ["Weekly shopping", "Shopping list"]
+    index.add(1, "Reading list", "")
+    index.remove(3)
+    assert _titles(index, "shop") == ["Weekly shopping"]
+    assert _titles(index, "LIST") == ["Reading list"]
+    assert _titles(index, "ideas") == []
+    assert len(index) == 2
+
+def test_loaded_index_follows_renames_and_deletes_without_reloading(run):
+    async def scenario():
+        user = await create_user("99000", "user99000")
+        kept = await create_note(user.id, "Shopping list", "eggs")
+        renamed = await create_note(user.id, "Shopping for shoes", "size 42")
+        deleted = await create_note(user.id, "Shop opening hours", "9-5")
+        index = await get_index(user.id)
+        builds = INDEX_BUILDS.value()
+
+        await update_note(renamed.id, user.id, "Running shoes", "size 42")
+        await delete_note(deleted.id, user.id)
+        index = await get_index(user.id)
+        return (_titles(index, "shop"), _titles(index, "run"), _titles(index, "shoes"),
+                INDEX_BUILDS.value() - builds)
+
+    shop, run_, shoes, rebuilt = run(scenario())
+    assert shop == ["Shopping list"]
+    assert run_ == ["Running shoes"]
+    assert shoes == ["Running shoes"]
+    assert rebuilt == 0
+
+def test_rename_rolled_back_leaves_the_index_as_it_was(run):
+    async def scenario():
+        user = await create_user("99001", "user99001")
+        note = await create_note(user.id, "Shopping list", "eggs")
+        await get_index(user.id)
+
+        async def rename_then_fail(update, context):
+            await update_note(note.id, user.id, "Running shoes", "eggs")
+            raise RuntimeError("handler failed")
+
+        with pytest.raises(RuntimeError):
+            await with_session(rename_then_fail)(None, None)
+        index = await get_index(user.id)
+        return _titles(index, "shop"), _titles(index, "run")
+
+    assert run(scenario()) == (["Shopping list"], [])
@@ -0,0 +1,83 @@
+import gzip
+import io
+import pytest
+from sqlalchemy.future import select
+from src import notes
+from src.auth import create_user
+from src.db import session_scope, with_session
+from src.models import Note
+from src.notes import create_note, export_notes, import_notes, search_notes
+
+SAMPLES = [
+    ("Shopping\nlist", "eggs\nmilk\n"),
+    ("Ünïcödé ✨", "日本語のメモ 🎉"),
+    ("Quotes \"and\" \\backslashes\\", ""),
+]
+
+async def _export(user_id):
+    out = io.BytesIO()
+    count = await export_notes(user_id, out)
+    return count, gzip.decompress(out.getvalue()).decode()
+
+async def _titles(user_id):
+    async with session_scope() as session:
+        result = await session.execute(select(Note.title).filter_by(user_id=user_id).order_by(Note.id))
+        return result.scalars().all()
+
+def test_export_then_import_recreates_every_note(run):
+    async def scenario():
+        source = await create_user("90000", "user90000")
+        target = await create_user("90001", "user90001")
+        for title, content in SAMPLES:
+            await create_note(source.id, title, content)
+        count, exported = await _export(source.id)
+        imported = await import_notes(target.id, io.BytesIO(gzip.compress(exported.encode())))
+        _, reexported = await _export(target.id)
+        found, _ = await search_notes(target.id, "milk")
+        return count, imported, exported, reexported, [note.title for note in found]
+
+    count, imported, exported, reexported, found = run(scenario())
+    assert count == imported == len(SAMPLES)
+    # One line per note, newlines in titles and content escaped
+    assert len(exported.splitlines()) == len(SAMPLES)
+    # Titles, contents and both timestamps come back as they were
+    assert reexported == exported
+    assert found == ["Shopping\nlist"]
+
+def test_import_failing_halfway_rolls_back_only_its_savepoint(run, monkeypatch):
+    # The first batch is inserted before the bad line is read
+    monkeypatch.setattr(notes, "NOTES_TRANSFER_BATCH", 2)
+    lines = b'{"title": "One", "content": "1"}\n{"title": "Two", "content": "2"}\n' \
+            b'{"title": "Three", "content": "3"}\nnot json\n'
+
+    async def scenario():
+        user = await create_user("90002", "user90002")
+
+        # Like handle_document: the import fails inside the update's transaction, which
+        # goes on to write and then commits
+        async def import_then_write(update, context):
+            with pytest.raises(ValueError, match="line 4 is not valid JSON"):
+                await import_notes(user.id, io.BytesIO(gzip.compress(lines)))
+            await create_note(user.id, "Kept", "written after the failed import")
+
+        await with_session(import_then_write)(None, None)
+        found, _ = await search_notes(user.id, "One")
+        return await _titles(user.id), found
+
+    titles, found = run(scenario())
+    assert titles == ["Kept"]
+    assert found == []
+
+def test_importing_the_same_export_twice_adds_its_notes_twice(run):
+    async def scenario():
+        user = await create_user("90003", "user90003")
+        for title, content in SAMPLES:
+            await create_note(user.id, title, content)
+        _, exported = await _export(user.id)
+        for _ in range(2):
+            await import_notes(user.id, io.BytesIO(exported.encode()))
+        return await _titles(user.id)
+
+    titles = run(scenario())
+    # Imports add to the notes already there; nothing is matched up or replaced
+    assert titles == [title for title, _ in SAMPLES] * 3
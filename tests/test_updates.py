@@ -0,0 +1,41 @@
+import asyncio
+import random
+from telegram import Update
+from src.handlers import router
+
+async def deliver(app, *payloads):
+    """Hand update payloads to the application and wait until all have been handled."""
+    for payload in payloads:
+        await app.update_queue.put(Update.de_json(payload, app.bot))
+    await app.update_queue.join()
+
+def _answered(telegram):
+    return [int(params["callback_query_id"]) for params in telegram.calls_for("answerCallbackQuery")]
+
+def test_each_users_updates_are_handled_in_order(run, bot_app):
+    async def scenario():
+        async with bot_app() as (app, telegram):
+            # Bot API calls take varying time, so a later update could overtake an earlier one
+            rng = random.Random(1)
+            handle = telegram.handle
+
+            async def slow_handle(api_method, params):
+                await asyncio.sleep(rng.random() * 0.01)
+                return await handle(api_method, params)
+            telegram.handle = slow_handle
+
+            users = range(20_000, 20_008)
+            await deliver(app, *(telegram.message_update(user_id, "/start") for user_id in users))
+            # Pattern setup taps, interleaved as they would arrive from users tapping at once
+            taps = [telegram.callback_update(user_id, router.encode("pattern", digit))
+                    for digit in range(1, 10) for user_id in users]
+            await deliver(app, *taps)
+            return taps, _answered(telegram), {user_id: telegram.last_message[user_id]["text"] for user_id in users}
+
+    taps, answered, shown = run(scenario())
+    by_user = {}
+    for payload in taps:
+        by_user.setdefault(payload["callback_query"]["from"]["id"], []).append(payload["update_id"])
+    for user_id, sent in by_user.items():
+        assert [update_id for update_id in answered if update_id in sent] == sent
+        assert shown[user_id].endswith("Current pattern: 123456789")
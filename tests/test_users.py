@@ -0,0 +1,46 @@
+import pytest
+from src.auth import create_user, get_user_by_telegram_id, set_locked, user_cache
+from src.db import with_session
+
+def test_a_committed_change_is_seen_by_the_next_lookup(run):
+    async def scenario():
+        await create_user("95000", "user95000")
+        cached = await get_user_by_telegram_id("95000")
+        await set_locked(cached, True)
+        return await get_user_by_telegram_id("95000")
+
+    user = run(scenario())
+    assert user.is_locked
+
+def test_a_rolled_back_change_is_not_seen_by_the_next_lookup(run):
+    async def scenario():
+        await create_user("95001", "user95001")
+        await get_user_by_telegram_id("95001")
+
+        async def lock_then_fail(update, context):
+            user = await get_user_by_telegram_id("95001")
+            await set_locked(user, True)
+            # The handler still sees its own change
+            assert user.is_locked
+            raise RuntimeError("handler failed")
+
+        with pytest.raises(RuntimeError):
+            await with_session(lock_then_fail)(None, None)
+        cached = user_cache.get("95001")
+        return cached, await get_user_by_telegram_id("95001")
+
+    cached, user = run(scenario())
+    assert cached is None or not cached.is_locked
+    assert not user.is_locked
+
+def test_a_new_user_is_cached_only_once_committed(run):
+    async def scenario():
+        async def create_then_fail(update, context):
+            await create_user("95002", "user95002")
+            raise RuntimeError("handler failed")
+
+        with pytest.raises(RuntimeError):
+            await with_session(create_then_fail)(None, None)
+        return await get_user_by_telegram_id("95002")
+
+    assert run(scenario()) is None